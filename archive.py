@@ -0,0 +1,185 @@
+import os
+import sys
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+import database
+
+# Moves closed rentals older than a retention window out of the rentals table into an archive database next to the
+# main one ("BicycleRental_archive.db"), one table per year of the rental date (rentals_2019, ..., and
+# rentals_undated for rentals without a valid date). The rentals table then only holds open and recent rentals,
+# and the space freed in the main file is reused by new rentals, so it stops growing.
+#
+# What the analytics need from archived rentals is kept in the main database: type_daily_rentals is never
+# decremented, fleetStats' archived_daily_rentals / archived_bike_rentals count what was moved out, and demand.py's
+# weekly demand is brought up to date before anything is moved and never recomputed before the cutoff.
+# Queries that want every rental ever made use history_session(), where the all_rentals view joins the rentals
+# table and every archive table.
+#
+# Each batch is copied into the archive in one transaction and deleted from rentals in a second, so a crash in
+# between leaves the batch in both places (never in neither); the next run finishes moving it.
+
+# Closed rentals returned more than this many days ago are archived
+ARCHIVE_AFTER_DAYS = 730
+
+# Rentals moved per transaction
+ARCHIVE_BATCH_SIZE = 10000
+
+RENTAL_COLUMNS = "id, bicycle_id, rental_date, expected_return_date, return_date, member_id, fees, damage_details"
+
+ARCHIVE_TABLE_SCHEMA = '''CREATE TABLE IF NOT EXISTS archive.{} (
+                              id INTEGER PRIMARY KEY,
+                              bicycle_id INTEGER,
+                              rental_date TEXT,
+                              expected_return_date TEXT,
+                              return_date TEXT,
+                              member_id INTEGER,
+                              fees REAL,
+                              damage_details TEXT
+                          )'''
+
+def archive_path():
+    return os.path.splitext(database.DB_PATH)[0] + "_archive.db"
+
+def _table_name(year):
+    return f"rentals_{year}" if year and year.isdigit() and len(year) == 4 else "rentals_undated"
+
+# A connection of its own in autocommit mode with the archive attached: ATTACH is not allowed inside the pooled
+# connections' transactions, and only archiving and full-history queries need the archive
+def _connect(create=False):
+    database.get_connection()  # Make sure the main database is migrated
+    conn = database.connect_db()
+    conn.isolation_level = None
+    path = archive_path()
+    if create or os.path.exists(path):
+        conn.execute("ATTACH DATABASE ? AS archive", (path,))
+    return conn
+
+def _archive_tables(conn):
+    if not any(row[1] == "archive" for row in conn.execute("PRAGMA database_list")):
+        return []
+    return [row[0] for row in conn.execute(
+        "SELECT name FROM archive.sqlite_master WHERE type = 'table' AND name LIKE 'rentals_%' ORDER BY name")]
+
+# Move the rentals returned before `before` ("YYYY-MM-DD", default ARCHIVE_AFTER_DAYS ago) to the archive.
+# Returns {"archived": number of rentals moved, "tables": archive tables written to}
+def archive_rentals(before=None, batch_size=ARCHIVE_BATCH_SIZE):
+    import demand
+    before = before or (date.today() - timedelta(days=ARCHIVE_AFTER_DAYS)).isoformat()
+    # Weekly demand is computed from the rentals table, so count the rentals about to leave it first
+    demand.update_demand()
+    conn = _connect(create=True)
+    archived, tables = 0, set()
+    try:
+        conn.execute("CREATE TEMP TABLE archive_batch (id INTEGER PRIMARY KEY, year TEXT)")
+        while True:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("DELETE FROM temp.archive_batch")
+                conn.execute("""INSERT INTO temp.archive_batch (id, year)
+                                SELECT id, substr(rental_date, 1, 4) FROM main.rentals
+                                WHERE return_date < ? ORDER BY return_date LIMIT ?""", (before, batch_size))
+                years = [row[0] for row in conn.execute("SELECT DISTINCT year FROM temp.archive_batch")]
+                for year in years:
+                    table = _table_name(year)
+                    conn.execute(ARCHIVE_TABLE_SCHEMA.format(table))
+                    # Already there if an earlier run stopped between copying and deleting
+                    conn.execute(f"""INSERT OR IGNORE INTO archive.{table} ({RENTAL_COLUMNS})
+                                     SELECT {RENTAL_COLUMNS} FROM main.rentals
+                                     WHERE id IN (SELECT id FROM temp.archive_batch WHERE year IS ?)""", (year,))
+                    tables.add(table)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            if not years:
+                break
+
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("""
+                    INSERT INTO archived_daily_rentals (type, day, rentals)
+                        SELECT COALESCE(bicycles.type, ''), COALESCE(rentals.rental_date, ''), COUNT(*)
+                        FROM rentals JOIN bicycles ON bicycles.id = rentals.bicycle_id
+                        WHERE rentals.id IN (SELECT id FROM temp.archive_batch)
+                        GROUP BY 1, 2
+                        ON CONFLICT (type, day) DO UPDATE SET rentals = rentals + excluded.rentals""")
+                conn.execute("""
+                    INSERT INTO archived_bike_rentals (bicycle_id, rentals)
+                        SELECT bicycle_id, COUNT(*) FROM rentals
+                        WHERE id IN (SELECT id FROM temp.archive_batch) AND bicycle_id IS NOT NULL
+                        GROUP BY bicycle_id
+                        ON CONFLICT (bicycle_id) DO UPDATE SET rentals = rentals + excluded.rentals""")
+                demand.record_archive_cutoff(conn, before)
+                archived += conn.execute("DELETE FROM main.rentals WHERE id IN (SELECT id FROM temp.archive_batch)").rowcount
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+    finally:
+        conn.close()
+    return {"archived": archived, "tables": sorted(tables)}
+
+# Rebuild both files to release the space freed by archiving (the main file otherwise keeps it for new rentals).
+# Takes a while and needs exclusive access, so run it off-hours
+def compact():
+    database.close_pool()
+    conn = _connect()
+    try:
+        conn.execute("VACUUM main")
+        conn.execute("PRAGMA main.wal_checkpoint(TRUNCATE)")
+        if _archive_tables(conn):
+            conn.execute("VACUUM archive")
+    finally:
+        conn.close()
+
+# A read transaction on a connection with the temporary view all_rentals: every rental, live and archived,
+# with the columns of the rentals table, e.g.
+#   with history_session() as conn:
+#       conn.execute("SELECT COUNT(*) FROM all_rentals WHERE member_id = ?", (1001,))
+@contextmanager
+def history_session():
+    conn = _connect()
+    try:
+        selects = [f"SELECT {RENTAL_COLUMNS} FROM main.rentals"]
+        selects += [f"SELECT {RENTAL_COLUMNS} FROM archive.{table}" for table in _archive_tables(conn)]
+        conn.execute("CREATE TEMP VIEW all_rentals AS " + " UNION ALL ".join(selects))
+        conn.execute("BEGIN")
+        try:
+            yield conn
+        finally:
+            conn.execute("COMMIT")
+    finally:
+        conn.close()
+
+# Every rental of a bike, archived ones included, oldest first
+def bicycle_history(bike_id):
+    with history_session() as conn:
+        return conn.execute(f"SELECT {RENTAL_COLUMNS} FROM all_rentals WHERE bicycle_id = ? ORDER BY id",
+                            (bike_id,)).fetchall()
+
+# Every rental of a member, archived ones included, oldest first
+def member_history(member_id):
+    with history_session() as conn:
+        return conn.execute(f"SELECT {RENTAL_COLUMNS} FROM all_rentals WHERE member_id = ? ORDER BY id",
+                            (member_id,)).fetchall()
+
+# Rentals per archive table, e.g. {"rentals_2019": 51234, ...}
+def archive_summary():
+    conn = _connect()
+    try:
+        return {table: conn.execute(f"SELECT COUNT(*) FROM archive.{table}").fetchone()[0]
+                for table in _archive_tables(conn)}
+    finally:
+        conn.close()
+
+# Command line: `python archive.py [YYYY-MM-DD]` archives the rentals returned before that date
+# (default ARCHIVE_AFTER_DAYS ago), `python archive.py compact` releases the freed space
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "compact":
+        compact()
+    else:
+        report = archive_rentals(sys.argv[1] if len(sys.argv) > 1 else None)
+        print(f"Archived {report['archived']:,} rentals into {', '.join(report['tables']) or 'no tables'}")
+    for table, rentals in archive_summary().items():
+        print(f"{table}: {rentals:,} rentals")
@@ -0,0 +1,119 @@
+import threading
+import time
+
+import database
+import events
+from database import session, select_in, add_change_listener
+
+# In-process index of the bikes that can be rented right now, bucketed by (type, frame_size), so finding
+# an available bike of a given type and size does not need a query. It is read from the database on first use
+# and kept up to date by the database change listeners as bikes are rented, returned and loaded in this process.
+# Changes made by other processes are picked up from the event log (see events.py) at most REFRESH_SECONDS later,
+# re-reading only the bikes that changed. The index only suggests candidates: renting still re-checks the bike's
+# status in the database
+REFRESH_SECONDS = 2
+
+_lock = threading.RLock()
+_buckets = {}       # (type, frame_size) -> set of available bike IDs
+_bike_keys = {}     # available bike ID -> its (type, frame_size)
+_loaded_path = None
+_checked_at = 0.0
+_event_id = 0       # the last event the index has caught up with
+
+def _add(bike_id, key):
+    _buckets.setdefault(key, set()).add(bike_id)
+    _bike_keys[bike_id] = key
+
+# Function to drop a bike from the index, e.g. when it turned out not to be available after all
+def discard(bike_id):
+    with _lock:
+        key = _bike_keys.pop(bike_id, None)
+        if key is not None:
+            _buckets[key].discard(bike_id)
+
+# Function to (re)load the index from the bicycles table
+def warm():
+    global _loaded_path, _checked_at, _event_id
+    with _lock:
+        with session() as conn:
+            rows = conn.execute("SELECT id, type, frame_size FROM bicycles WHERE status = 'Available'").fetchall()
+            event_id = events.latest_event_id(conn)
+        _buckets.clear()
+        _bike_keys.clear()
+        for bike_id, bike_type, frame_size in rows:
+            _add(bike_id, (bike_type, frame_size))
+        _loaded_path = database.DB_PATH
+        _checked_at = time.monotonic()
+        _event_id = event_id
+
+# Apply the changes logged since the index was last brought up to date, from any process
+def _catch_up():
+    global _checked_at, _event_id
+    with session() as conn:
+        bike_ids, event_id = events.changes_since(_event_id, conn)
+        if bike_ids is None:
+            return warm()
+        rows = list(select_in(conn, "SELECT id, type, frame_size, status FROM bicycles WHERE id IN ({})", bike_ids))
+    _apply(bike_ids, rows)
+    _checked_at = time.monotonic()
+    _event_id = event_id
+
+def _ensure_loaded():
+    if _loaded_path != database.DB_PATH:
+        warm()
+    elif time.monotonic() - _checked_at > REFRESH_SECONDS:
+        _catch_up()
+
+def _apply(bike_ids, rows):
+    for bike_id in bike_ids:
+        discard(bike_id)
+    for bike_id, bike_type, frame_size, status in rows:
+        if status == "Available":
+            _add(bike_id, (bike_type, frame_size))
+
+# Re-read the bikes that a committed transaction changed; a change too broad to list means a full reload on next use
+def _on_bicycles_changed(bike_ids):
+    global _loaded_path
+    with _lock:
+        if _loaded_path is None or _loaded_path != database.DB_PATH:
+            return
+        if bike_ids is None:
+            _loaded_path = None
+            return
+        with session() as conn:
+            rows = list(select_in(conn, "SELECT id, type, frame_size, status FROM bicycles WHERE id IN ({})", bike_ids))
+        _apply(bike_ids, rows)
+
+add_change_listener(_on_bicycles_changed)
+
+def _keys(bike_type, frame_size):
+    if frame_size:
+        return [(bike_type, frame_size)]
+    return [key for key in _buckets if key[0] == bike_type]
+
+# Function to get an available bike of a type (and optionally frame size) without taking it, or None if there is none
+def find_available(bike_type, frame_size=None):
+    with _lock:
+        _ensure_loaded()
+        for key in _keys(bike_type, frame_size):
+            for bike_id in _buckets.get(key, ()):
+                return bike_id
+    return None
+
+# Function to count the available bikes of a type (and optionally frame size)
+def count_available(bike_type, frame_size=None):
+    with _lock:
+        _ensure_loaded()
+        return sum(len(_buckets.get(key, ())) for key in _keys(bike_type, frame_size))
+
+# Function to list the IDs of the available bikes of a type (and optionally frame size), lowest first
+def available_bikes(bike_type, frame_size=None):
+    with _lock:
+        _ensure_loaded()
+        return sorted(bike_id for key in _keys(bike_type, frame_size) for bike_id in _buckets.get(key, ()))
+
+# Function to count the available bikes per (type, frame_size)
+def availability_summary():
+    with _lock:
+        _ensure_loaded()
+        return {key: len(bike_ids) for key, bike_ids in _buckets.items() if bike_ids}
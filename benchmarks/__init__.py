@@ -0,0 +1,2 @@
+# Benchmarks for the bicycle rental system.
+# Run them from the project root, e.g. `python -m benchmarks.bench_pool`
@@ -0,0 +1,56 @@
+import argparse
+import time
+
+import availability
+from bikeRent import rent_bike, rent_available_bike
+from bikeSearch import search_bicycles
+from benchmarks.common import SCALES, make_environment, BIKE_TYPES, FRAME_SIZES
+
+def report(label, latencies):
+    latencies = sorted(latencies)
+    p50 = latencies[len(latencies) // 2] * 1000
+    p99 = latencies[int(len(latencies) * 0.99)] * 1000
+    print(f"{label:<40} p50 {p50:8.3f} ms   p99 {p99:8.3f} ms")
+
+# The old way: search for bikes of the type and size, then rent the first one that is available
+def search_and_rent(member_id, bike_type, frame_size):
+    for bike in search_bicycles(type=bike_type, frame_size=frame_size):
+        if bike[7] == "Available":
+            return rent_bike(member_id, bike[0], 1)
+
+# Allocate --allocations bikes of rotating type and size from the fleet of the scale, first by searching and then
+# through the availability index
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure renting a bike of a type and size by search and by index")
+    parser.add_argument("--scale", choices=SCALES, default="large")
+    parser.add_argument("--allocations", type=int, default=500, help="bikes rented")
+    args = parser.parse_args()
+    bikes, rentals = SCALES[args.scale][0], args.allocations
+    wanted = [(BIKE_TYPES[i % len(BIKE_TYPES)], FRAME_SIZES[i % len(FRAME_SIZES)]) for i in range(rentals)]
+    print(f"{bikes:,} bikes, {rentals} allocations")
+
+    make_environment(bikes=bikes)
+    latencies = []
+    for i, (bike_type, frame_size) in enumerate(wanted):
+        start = time.perf_counter()
+        search_and_rent(1000 + i % 100, bike_type, frame_size)
+        latencies.append(time.perf_counter() - start)
+    report("search, then rent_bike", latencies)
+
+    make_environment(bikes=bikes)
+    start = time.perf_counter()
+    availability.warm()
+    print(f"{'warm the availability index':<40} {(time.perf_counter() - start) * 1000:8.1f} ms")
+    latencies = []
+    for bike_type, frame_size in wanted:
+        start = time.perf_counter()
+        availability.find_available(bike_type, frame_size)
+        latencies.append(time.perf_counter() - start)
+    report("find_available", latencies)
+    latencies = []
+    for i, (bike_type, frame_size) in enumerate(wanted):
+        start = time.perf_counter()
+        message = rent_available_bike(1000 + i % 100, bike_type, frame_size)
+        latencies.append(time.perf_counter() - start)
+        assert message.startswith("Rental successful"), message
+    report("rent_available_bike", latencies)
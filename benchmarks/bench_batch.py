@@ -0,0 +1,39 @@
+import argparse
+import time
+
+from bikeRent import rent_bike, rent_bikes
+from bikeReturn import return_bike, return_bikes
+from benchmarks.common import SCALES, make_environment
+
+# Rent then return --batch-size bikes of the fleet of the scale, once with single calls in a loop and once with
+# the batch APIs
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure batch rents and returns against single calls")
+    parser.add_argument("--scale", choices=SCALES, default="tiny")
+    parser.add_argument("--batch-size", type=int, default=50, help="bikes rented and returned per batch")
+    parser.add_argument("--rounds", type=int, default=20, help="batches rented and returned")
+    args = parser.parse_args()
+    size, rounds = args.batch_size, args.rounds
+    bikes = max(SCALES[args.scale][0], size)
+    requests = [(1000 + i % 10, i + 1, 2) for i in range(size)]
+
+    make_environment(bikes=bikes)
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for member_id, bike_id, duration in requests:
+            rent_bike(member_id, bike_id, duration)
+        for _, bike_id, _ in requests:
+            return_bike(bike_id)
+    looped = time.perf_counter() - start
+
+    make_environment(bikes=bikes)
+    start = time.perf_counter()
+    for _ in range(rounds):
+        rent_bikes(requests)
+        return_bikes([bike_id for _, bike_id, _ in requests])
+    batched = time.perf_counter() - start
+
+    operations = 2 * size * rounds
+    print(f"batches of {size} rentals + {size} returns, {rounds} rounds")
+    print(f"looped single calls: {operations / looped:,.0f} ops/sec")
+    print(f"batch calls:         {operations / batched:,.0f} ops/sec ({looped / batched:.1f}x)")
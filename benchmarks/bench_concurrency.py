@@ -0,0 +1,71 @@
+import argparse
+import multiprocessing
+import random
+import time
+
+import database
+import membershipManager
+from benchmarks.common import SCALES, make_environment
+
+HOT_BIKES = 20      # few bikes, so workers constantly compete for the same ones
+MEMBERS = 100
+
+# Worker process: hammer rent_bike/return_bike on bikes 1..hot_bikes of the shared database for `seconds`
+def worker(db_path, membership_file, seed, seconds, hot_bikes):
+    database.DB_PATH = db_path
+    membershipManager.MEMBERSHIP_FILE = membership_file
+    from bikeRent import rent_bike
+    from bikeReturn import return_bike
+
+    rng = random.Random(seed)
+    latencies, rented, returned, errors = [], 0, 0, 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        bike_id = rng.randint(1, hot_bikes)
+        start = time.perf_counter()
+        try:
+            if rng.random() < 0.5:
+                rented += rent_bike(1000 + rng.randrange(MEMBERS), bike_id, 1).startswith("Rental successful")
+            else:
+                returned += return_bike(bike_id).startswith("Bicycle Return processed")
+        except database.sqlite3.OperationalError:
+            errors += 1
+        latencies.append(time.perf_counter() - start)
+    return latencies, rented, returned, errors
+
+# The fleet has the number of bikes of the scale; the workers rent and return only the first --hot-bikes of them
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure concurrent rents and returns from several processes")
+    parser.add_argument("--scale", choices=SCALES, default="tiny")
+    parser.add_argument("--workers", type=int, default=8, help="number of worker processes")
+    parser.add_argument("--seconds", type=float, default=5, help="how long each worker runs")
+    parser.add_argument("--hot-bikes", type=int, default=HOT_BIKES, help="bikes the workers compete for")
+    args = parser.parse_args()
+    workers, seconds = args.workers, args.seconds
+    bikes = SCALES[args.scale][0]
+    hot_bikes = min(args.hot_bikes, bikes)
+
+    make_environment(bikes=bikes, members=MEMBERS)
+    database.close_pool()
+    # spawn, so no worker inherits the parent's pooled connection
+    with multiprocessing.get_context("spawn").Pool(workers) as pool:
+        results = pool.starmap(worker, [(database.DB_PATH, membershipManager.MEMBERSHIP_FILE, seed, seconds, hot_bikes)
+                                        for seed in range(workers)])
+
+    latencies = sorted(latency for result in results for latency in result[0])
+    rented = sum(result[1] for result in results)
+    returned = sum(result[2] for result in results)
+    errors = sum(result[3] for result in results)
+
+    with database.session() as conn:
+        double_booked = conn.execute("""SELECT COUNT(*) FROM (SELECT bicycle_id FROM rentals WHERE return_date IS NULL
+                                        GROUP BY bicycle_id HAVING COUNT(*) > 1)""").fetchone()[0]
+        open_rentals = conn.execute("SELECT COUNT(*) FROM rentals WHERE return_date IS NULL").fetchone()[0]
+        rented_bikes = conn.execute("SELECT COUNT(*) FROM bicycles WHERE status = 'Rented'").fetchone()[0]
+
+    print(f"{workers} workers, {len(latencies):,} operations in {seconds:.0f}s = {len(latencies) / seconds:,.0f} ops/sec")
+    print(f"latency p50 {latencies[len(latencies) // 2] * 1000:.2f} ms, "
+          f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.2f} ms, max {latencies[-1] * 1000:.2f} ms")
+    print(f"{rented:,} rentals, {returned:,} returns, {errors} lock errors")
+    print(f"double-booked bikes: {double_booked}; open rentals {open_rentals} = "
+          f"rented bikes {rented_bikes} = rentals - returns {rented - returned}")
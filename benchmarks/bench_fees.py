@@ -0,0 +1,51 @@
+import argparse
+import io
+import os
+import random
+import time
+from contextlib import redirect_stdout
+from datetime import date, datetime, timedelta
+
+import database
+from bikeReturn import calculate_fees, calculate_fees_bulk, late_fees_between
+from benchmarks.common import SCALES, make_environment
+from benchmarks.synthetic import write_bicycle_feed, write_rental_feed
+
+# Late fees for the returned rentals of the scale, one calculate_fees call per rental versus one calculate_fees_bulk
+# call, then a month of billing read from a database of those bikes and rentals
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure per-rental and vectorised late fee calculation")
+    parser.add_argument("--scale", choices=SCALES, default="large")
+    args = parser.parse_args()
+    bikes, rentals = SCALES[args.scale]
+    rng = random.Random(0)
+    rates = [rng.choice(["10/day; 50/week", "25/day; 125/week", "£20/day", "Missing"]) for _ in range(rentals)]
+    rental_dates = [date(2020, 1, 1) + timedelta(days=rng.randint(0, 1500)) for _ in range(rentals)]
+    return_dates = [rented + timedelta(days=rng.randint(0, 20)) for rented in rental_dates]
+    print(f"{rentals:,} rentals")
+
+    start = time.perf_counter()
+    with redirect_stdout(io.StringIO()):
+        looped = [calculate_fees(datetime(d.year, d.month, d.day), datetime(r.year, r.month, r.day), rate)
+                  for d, r, rate in zip(rental_dates, return_dates, rates)]
+    print(f"calculate_fees per rental:   {time.perf_counter() - start:6.2f} s")
+
+    # Dates come out of the database as "YYYY-MM-DD" text
+    rental_dates = [rented.strftime("%Y-%m-%d") for rented in rental_dates]
+    return_dates = [returned.strftime("%Y-%m-%d") for returned in return_dates]
+    start = time.perf_counter()
+    bulk = calculate_fees_bulk(rental_dates, return_dates, [database.parse_rental_rate(rate)[0] for rate in rates])
+    print(f"calculate_fees_bulk:         {time.perf_counter() - start:6.2f} s")
+    assert list(bulk) == looped
+
+    workdir = make_environment(bikes=0)
+    bike_path, rental_path = os.path.join(workdir, "bikes.txt"), os.path.join(workdir, "rentals.txt")
+    write_bicycle_feed(bike_path, bikes)
+    write_rental_feed(rental_path, rentals, bikes)
+    database.load_and_clean_data(bike_path, rental_path)
+    start = time.perf_counter()
+    ids, fees = late_fees_between("2020-01-01", "2020-01-31")
+    print(f"late_fees_between, 1 month:  {time.perf_counter() - start:6.2f} s ({len(ids):,} rentals, £{fees.sum():,.2f})")
+    start = time.perf_counter()
+    ids, fees = late_fees_between("2015-01-01", "2024-12-31")
+    print(f"late_fees_between, all:      {time.perf_counter() - start:6.2f} s ({len(ids):,} rentals, £{fees.sum():,.2f})")
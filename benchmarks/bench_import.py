@@ -0,0 +1,28 @@
+import subprocess
+import sys
+
+# Total import time in ms for a set of modules, measured with python -X importtime in a fresh interpreter
+def import_time(modules, repeats=5):
+    best = None
+    for _ in range(repeats):
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {modules}"],
+                                capture_output=True, text=True, check=True)
+        total = 0
+        for line in result.stderr.splitlines():
+            # "import time: self [us] | cumulative | imported package"; top-level imports are not indented
+            if line.startswith("import time:") and not line.endswith("imported package"):
+                _, cumulative, name = line[len("import time:"):].split("|")
+                if not name.startswith("  "):
+                    total += int(cumulative)
+        best = total if best is None else min(best, total)
+    return best / 1000
+
+if __name__ == "__main__":
+    counter_modules = "bikeRent, bikeReturn, bikeSearch"
+    headless = import_time(f"{counter_modules}, bikeSelect")
+    # bikePlots holds the matplotlib/pandas imports bikeSelect used to make at import time
+    with_plots = import_time(f"{counter_modules}, bikeSelect, bikePlots")
+
+    print(f"rent/return/search only:                {import_time(counter_modules):.1f} ms")
+    print(f"+ bikeSelect (headless):                {headless:.1f} ms")
+    print(f"+ bikeSelect with plotting (old import): {with_plots:.1f} ms ({with_plots / headless:.0f}x)")
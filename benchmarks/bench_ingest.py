@@ -0,0 +1,34 @@
+import argparse
+import os
+import resource
+import time
+
+import database
+from benchmarks.common import SCALES, make_environment
+from benchmarks.synthetic import write_bicycle_feed, write_rental_feed
+
+# Generate synthetic feeds of the bikes and rentals of a scale and time a full load into an empty database
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure a full load of the feed files")
+    parser.add_argument("--scale", choices=SCALES, default="large")
+    parser.add_argument("--batch-size", type=int, default=database.INGEST_BATCH_SIZE, help="rows inserted at a time")
+    args = parser.parse_args()
+    bikes, rentals = SCALES[args.scale]
+    batch_size = args.batch_size
+
+    workdir = make_environment(bikes=0)
+    bike_path = os.path.join(workdir, "Bicycle_Info.txt")
+    rental_path = os.path.join(workdir, "Rental_History.txt")
+    write_bicycle_feed(bike_path, bikes)
+    write_rental_feed(rental_path, rentals, bikes)
+
+    start = time.perf_counter()
+    reports = database.load_and_clean_data(bike_path, rental_path, batch_size=batch_size)
+    elapsed = time.perf_counter() - start
+
+    total = sum(report["rows"] + report["rejected"] for report in reports)
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    for report in reports:
+        print(f"{report['table']}: {report['rows']:,} rows loaded, {report['rejected']:,} rejected")
+    print(f"{total:,} lines in {elapsed:.2f}s = {total / elapsed:,.0f} rows/sec, batch size {batch_size}, "
+          f"peak RSS {peak_rss_mb:.0f} MB")
@@ -0,0 +1,52 @@
+import argparse
+import os
+import random
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+import database
+import overdue
+from benchmarks.common import SCALES, make_environment
+
+# Nightly overdue run over the rentals of the scale, --open-share of them still open with expected return dates
+# spread over two years either side of the run date
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the nightly overdue billing report")
+    parser.add_argument("--scale", choices=SCALES, default="large")
+    parser.add_argument("--open-share", type=float, default=0.2, help="share of the rentals still open")
+    args = parser.parse_args()
+    bikes, rentals = SCALES[args.scale]
+    open_share = args.open_share
+    as_of = "2024-06-30"
+
+    workdir = make_environment(bikes=bikes)
+    rng = random.Random(0)
+    with database.session() as conn:
+        rows = []
+        for rental_id in range(1, rentals + 1):
+            rented = date(2022, 7, 1) + timedelta(days=rng.randint(0, 730))
+            expected = rented + timedelta(days=rng.randint(1, 14))
+            returned = None if rng.random() < open_share else (expected + timedelta(days=rng.randint(-1, 3))).isoformat()
+            rows.append((rental_id, rng.randint(1, bikes), rented.isoformat(), expected.isoformat(), returned,
+                         rng.randint(1000, 1099)))
+            if len(rows) == 100000:
+                conn.executemany("INSERT INTO rentals (id, bicycle_id, rental_date, expected_return_date, return_date, "
+                                 "member_id) VALUES (?, ?, ?, ?, ?, ?)", rows)
+                rows = []
+        conn.executemany("INSERT INTO rentals (id, bicycle_id, rental_date, expected_return_date, return_date, "
+                         "member_id) VALUES (?, ?, ?, ?, ?, ?)", rows)
+        conn.execute("ANALYZE")
+
+    start = time.perf_counter()
+    summary = overdue.write_billing_report(os.path.join(workdir, "overdue.csv"), as_of)
+    elapsed = time.perf_counter() - start
+    print(f"{rentals:,} rentals, {summary['rentals']:,} overdue as of {as_of}, £{summary['total_fees']:,.2f} accrued")
+    print(f"report written in {elapsed:.2f} s ({summary['rentals'] / elapsed:,.0f} overdue rentals/sec)")
+
+    # Run it again under tracemalloc to show memory stays bounded by the chunk size
+    tracemalloc.start()
+    overdue.write_billing_report(os.path.join(workdir, "overdue.csv"), as_of)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"peak Python memory during the report: {peak / 2 ** 20:.1f} MB")
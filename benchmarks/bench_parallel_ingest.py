@@ -0,0 +1,37 @@
+import argparse
+import os
+
+import database
+import ingest
+from benchmarks.common import SCALES, make_environment
+from benchmarks.synthetic import write_bicycle_feed, write_rental_feed
+
+# Generate the bikes and rentals of a scale, with the rentals split into one feed per depot, and load them all
+# with 1, 2, 4, ... worker processes, each time into a fresh database, to show how ingest throughput scales with cores
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure parallel ingest of per-depot rental feeds")
+    parser.add_argument("--scale", choices=SCALES, default="large")
+    parser.add_argument("--depots", type=int, default=8, help="number of rental feeds the rentals are split into")
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1, help="most worker processes to try")
+    args = parser.parse_args()
+
+    bikes, rentals = SCALES[args.scale]
+    depots, max_workers = args.depots, args.max_workers
+    rentals_per_depot = max(rentals // depots, 1)
+
+    feeds = os.path.join(make_environment(bikes=0), "depots")
+    os.makedirs(feeds)
+    write_bicycle_feed(os.path.join(feeds, "Bicycle_Info.txt"), bikes)
+    for depot in range(depots):
+        write_rental_feed(os.path.join(feeds, f"Rental_History_depot{depot:02d}.txt"), rentals_per_depot, bikes, seed=depot)
+
+    workers, baseline = 1, None
+    while workers <= max_workers:
+        make_environment(bikes=0)
+        result = ingest.ingest_sources([feeds], workers)
+        baseline = baseline or result["seconds"]
+        print(f"{workers:>3} workers: {result['lines']:,} lines from {len(result['files'])} files in "
+              f"{result['seconds']:.2f}s = {result['rows_per_s']:,.0f} lines/s, {result['mb_per_s']:.1f} MB/s, "
+              f"speedup {baseline / result['seconds']:.2f}x")
+        database.close_pool()
+        workers *= 2
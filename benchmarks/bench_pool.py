@@ -0,0 +1,38 @@
+import argparse
+import time
+
+import database
+from bikeRent import rent_bike
+from bikeReturn import return_bike
+from benchmarks.common import SCALES, make_environment
+
+# Rent and return `rounds` bikes out of the first `bikes` and report how many rentals per second we manage
+def run(rounds, bikes):
+    start = time.perf_counter()
+    for i in range(rounds):
+        bike_id = i % bikes + 1
+        result = rent_bike(1000 + i % 100, bike_id, 3)
+        assert result.startswith("Rental successful"), result
+        return_bike(bike_id)
+    return rounds / (time.perf_counter() - start)
+
+# The fleet has the number of bikes of the scale
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure rents and returns with per-call and pooled connections")
+    parser.add_argument("--scale", choices=SCALES, default="tiny")
+    parser.add_argument("--rounds", type=int, default=2000, help="bikes rented and returned")
+    args = parser.parse_args()
+    bikes, rounds = SCALES[args.scale][0], args.rounds
+
+    # Before: a fresh connection per call, default journal mode
+    database.USE_POOL = False
+    make_environment(bikes=bikes)
+    before = run(rounds, bikes)
+
+    # After: pooled per-thread connections with WAL and the tuned pragmas
+    database.USE_POOL = True
+    make_environment(bikes=bikes)
+    after = run(rounds, bikes)
+
+    print(f"Per-call connections: {before:,.0f} rentals/sec")
+    print(f"Pooled connections:   {after:,.0f} rentals/sec ({after / before:.1f}x)")
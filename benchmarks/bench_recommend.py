@@ -0,0 +1,50 @@
+import argparse
+import random
+import time
+from datetime import datetime
+
+import database
+from bikeSelect import compute_fleet_statistics
+from benchmarks.common import SCALES, make_environment
+
+# The data-gathering part of the four recommendations as they were before: one connection and query each
+def legacy_statistics():
+    results = []
+    for query in ("SELECT type, COUNT(*) FROM rentals JOIN bicycles ON rentals.bicycle_id = bicycles.id GROUP BY type",
+                  "SELECT id, type, brand, purchase_date FROM bicycles",
+                  """SELECT type, condition, COUNT(*) FROM bicycles WHERE condition IN ('Fair', 'New', 'Good', 'Damaged')
+                     GROUP BY type, condition ORDER BY type, condition""",
+                  "SELECT type, COUNT(*) FROM bicycles JOIN rentals ON bicycles.id = rentals.bicycle_id GROUP BY type"):
+        conn = database.connect_db()
+        results.append(conn.execute(query).fetchall())
+        conn.close()
+    current_year = datetime.now().year
+    ages = [(bike[1], current_year - int(bike[3][:4]) if bike[3] else 0) for bike in results[1]]
+    return results, max(ages, key=lambda x: x[1])
+
+# Time both approaches on a synthetic fleet of the bikes and rentals of a scale
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the fleet statistics behind the purchase recommendations")
+    parser.add_argument("--scale", choices=SCALES, default="large")
+    args = parser.parse_args()
+    bikes, rentals = SCALES[args.scale]
+
+    make_environment(bikes=bikes)
+    rng = random.Random(0)
+    with database.session() as conn:
+        conn.execute("UPDATE bicycles SET condition = CASE id % 4 WHEN 0 THEN 'New' WHEN 1 THEN 'Good' "
+                     "WHEN 2 THEN 'Fair' ELSE 'Damaged' END")
+        conn.executemany("INSERT INTO rentals (bicycle_id, rental_date, return_date, member_id) VALUES (?, ?, ?, ?)",
+                         ((rng.randint(1, bikes), "2024-01-01", "2024-01-05", 1000) for _ in range(rentals)))
+
+    start = time.perf_counter()
+    legacy_statistics()
+    legacy = time.perf_counter() - start
+
+    start = time.perf_counter()
+    compute_fleet_statistics()
+    single_pass = time.perf_counter() - start
+
+    print(f"{bikes:,} bikes, {rentals:,} rentals")
+    print(f"four separate queries: {legacy:.2f}s")
+    print(f"single pass:           {single_pass:.2f}s ({legacy / single_pass:.1f}x)")
@@ -0,0 +1,50 @@
+import argparse
+import time
+
+import bikeSearch
+from database import session
+from benchmarks.common import SCALES, make_environment
+
+def timed(label, work, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        work()
+    elapsed = (time.perf_counter() - start) / repeat
+    print(f"{label:<42} {elapsed * 1000:8.2f} ms")
+
+# What the old search cost: every matching row fetched on every click
+def full_fetch():
+    with session() as conn:
+        conn.execute(bikeSearch.SELECT_BICYCLES + " WHERE type = ?", ("Hybrid Bike",)).fetchall()
+
+# Search the fleet of a scale the way the search screen does: facet counts for the dropdowns and the
+# first page of results, first with a cold cache and then repeated
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure bicycle searches and facet counts")
+    parser.add_argument("--scale", choices=SCALES, default="large")
+    parser.add_argument("--repeat", type=int, default=20, help="repetitions of each search")
+    args = parser.parse_args()
+    bikes, repeat = SCALES[args.scale][0], args.repeat
+
+    make_environment(bikes=bikes)
+    print(f"{bikes:,} bikes")
+    timed("full fetch of one type (old search)", full_fetch, repeat)
+
+    def cold(work):
+        def run():
+            bikeSearch.clear_search_cache()
+            work()
+        return run
+
+    first_page = lambda: bikeSearch.search_page(type="Hybrid Bike")
+    facets = lambda: bikeSearch.facet_counts(type="Hybrid Bike", status="Available")
+    timed("first page, cold cache", cold(first_page), repeat)
+    timed("first page, cached", first_page, repeat)
+    timed("facet counts, cold cache", cold(facets), repeat)
+    timed("facet counts, cached", facets, repeat)
+
+    rows, after_id = bikeSearch.search_page(type="Hybrid Bike")
+    for _ in range(50):
+        rows, after_id = bikeSearch.search_page(after_id, type="Hybrid Bike")
+    timed("page 51, cold cache", cold(lambda: bikeSearch.search_page(after_id, type="Hybrid Bike")), repeat)
+    timed("stream every match with iter_bicycles", lambda: sum(1 for _ in bikeSearch.iter_bicycles(type="Hybrid Bike")), 3)
@@ -0,0 +1,110 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import random
+import time
+
+import database
+import membershipManager
+from benchmarks.common import SCALES, make_environment, BIKE_TYPES, FRAME_SIZES
+
+PORT = 8765
+MEMBERS = 100
+
+# Server process: run the service against the benchmark database
+def run_server(db_path, membership_file, port, workers):
+    database.DB_PATH = db_path
+    membershipManager.MEMBERSHIP_FILE = membership_file
+    import service
+    asyncio.run(service.serve("127.0.0.1", port, workers))
+
+async def request(reader, writer, method, path, payload=None):
+    body = json.dumps(payload).encode() if payload is not None else b""
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if not line.strip():
+            break
+        if line.lower().startswith(b"content-length:"):
+            length = int(line.split(b":")[1])
+    return status, json.loads(await reader.readexactly(length))
+
+# One client on a keep-alive connection: 70% searches, 15% rentals of any available bike, 15% returns
+async def client(seed, deadline, latencies, counts):
+    rng = random.Random(seed)
+    reader, writer = await asyncio.open_connection("127.0.0.1", PORT)
+    rented = []
+    while time.perf_counter() < deadline:
+        kind = rng.random()
+        start = time.perf_counter()
+        if kind < 0.7 or (kind >= 0.85 and not rented):
+            label = "search"
+            status, _ = await request(reader, writer, "GET",
+                                      f"/bicycles?type={rng.choice(BIKE_TYPES).replace(' ', '+')}"
+                                      f"&frame_size={rng.choice(FRAME_SIZES)}&status=Available")
+        elif kind < 0.85:
+            label = "rent"
+            status, answer = await request(reader, writer, "POST", "/rentals", {
+                "member_id": 1000 + rng.randrange(MEMBERS), "type": rng.choice(BIKE_TYPES), "rental_duration": 1})
+            if answer["message"].startswith("Rental successful"):
+                rented.append(int(answer["message"].split()[4]))
+        else:
+            label = "return"
+            status, _ = await request(reader, writer, "POST", "/returns", {"bike_id": rented.pop()})
+        latencies.setdefault(label, []).append(time.perf_counter() - start)
+        counts[status] = counts.get(status, 0) + 1
+    writer.close()
+
+async def load(clients, seconds):
+    latencies, counts = {}, {}
+    deadline = time.perf_counter() + seconds
+    await asyncio.gather(*(client(seed, deadline, latencies, counts) for seed in range(clients)))
+    return latencies, counts
+
+async def wait_for_server():
+    for _ in range(100):
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", PORT)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError("service did not start")
+
+def percentile(values, share):
+    return values[min(int(len(values) * share), len(values) - 1)] * 1000
+
+# Mixed search/rent/return traffic on the fleet of a scale from --clients concurrent keep-alive connections
+# for --seconds
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the HTTP service under mixed search, rent and return traffic")
+    parser.add_argument("--scale", choices=SCALES, default="medium")
+    parser.add_argument("--clients", type=int, default=32, help="concurrent client connections")
+    parser.add_argument("--seconds", type=float, default=10, help="how long the clients run")
+    parser.add_argument("--workers", type=int, default=8, help="worker threads of the service")
+    args = parser.parse_args()
+    clients, seconds, workers = args.clients, args.seconds, args.workers
+    bikes = SCALES[args.scale][0]
+
+    make_environment(bikes=bikes, members=MEMBERS)
+    database.close_pool()
+    server = multiprocessing.get_context("spawn").Process(
+        target=run_server, args=(database.DB_PATH, membershipManager.MEMBERSHIP_FILE, PORT, workers), daemon=True)
+    server.start()
+    try:
+        asyncio.run(wait_for_server())
+        latencies, counts = asyncio.run(load(clients, seconds))
+    finally:
+        server.terminate()
+
+    total = sum(len(values) for values in latencies.values())
+    print(f"{clients} clients, {workers} worker threads, {bikes:,} bikes: "
+          f"{total:,} requests in {seconds:.0f}s = {total / seconds:,.0f} requests/sec, statuses {counts}")
+    for label, values in sorted(latencies.items()):
+        values.sort()
+        print(f"{label:<7} {len(values):>7,}  p50 {percentile(values, 0.5):7.2f} ms  "
+              f"p95 {percentile(values, 0.95):7.2f} ms  p99 {percentile(values, 0.99):7.2f} ms")
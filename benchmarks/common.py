@@ -0,0 +1,47 @@
+import atexit
+import json
+import os
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+
+import database
+import membershipManager
+
+BIKE_TYPES = ["Mountain Bike", "Road Bike", "Hybrid Bike", "Electric Bike", "Gravel Bike", "BMX", "Folding Bike"]
+BRANDS = ["Trek", "Giant", "Specialized", "Cannondale", "Schwinn", "Bianchi", "BMC", "Santa Cruz", "GT", "Scott", "Norco"]
+FRAME_SIZES = ["Small", "Medium", "Large"]
+RATES = ["10/day; 50/week", "15/day; 75/week", "20/day; 100/week", "25/day; 125/week", "30/day; 150/week"]
+
+# (bikes, rentals) for each named scale, chosen with --scale
+SCALES = {
+    "tiny": (1_000, 1_000),
+    "small": (1_000, 10_000),
+    "medium": (10_000, 100_000),
+    "large": (100_000, 1_000_000),
+    "huge": (1_000_000, 10_000_000),
+}
+
+# Build a throwaway database and membership file in a temporary directory and point
+# the modules at them, so benchmarks never touch BicycleRental.db or membership.json
+def make_environment(bikes=1000, members=100, rental_limit=1000):
+    workdir = tempfile.mkdtemp(prefix="bikebench-")
+    atexit.register(shutil.rmtree, workdir, True)
+    database.close_pool()
+    database.DB_PATH = os.path.join(workdir, "BicycleRental.db")
+    membershipManager.MEMBERSHIP_FILE = os.path.join(workdir, "membership.json")
+
+    end_date = (datetime.now() + timedelta(days=365)).strftime("%Y-%m-%d")
+    with open(membershipManager.MEMBERSHIP_FILE, "w") as file:
+        json.dump({str(1000 + i): {"active": True, "RentalLimit": rental_limit, "MembershipEndDate": end_date}
+                   for i in range(members)}, file)
+
+    database.create_tables()
+    with database.session() as conn:
+        conn.executemany(
+            "INSERT INTO bicycles (id, brand, type, frame_size, rental_rate, purchase_date, condition, status, "
+            "daily_rate, weekly_rate) VALUES (?, ?, ?, ?, ?, ?, ?, 'Available', ?, ?)",
+            ((i, BRANDS[i % len(BRANDS)], BIKE_TYPES[i % len(BIKE_TYPES)], FRAME_SIZES[i % len(FRAME_SIZES)],
+              RATES[i % len(RATES)], f"{2015 + i % 10}-01-01", "Good") + database.parse_rental_rate(RATES[i % len(RATES)])
+             for i in range(1, bikes + 1)))
+    return workdir
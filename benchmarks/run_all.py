@@ -0,0 +1,167 @@
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import database
+import bikeSearch
+import bikeSelect
+from bikeRent import rent_bike, rent_bikes
+from bikeReturn import return_bike, return_bikes
+from benchmarks.common import SCALES, make_environment
+from benchmarks.synthetic import generate
+
+# A result is flagged as a regression when it is this much slower than the baseline
+REGRESSION_THRESHOLD = 0.2
+
+# Run work() `repeat` times and return the median and best time in seconds
+def measure(work, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        work()
+        times.append(time.perf_counter() - start)
+    return {"median_s": statistics.median(times), "best_s": min(times), "repeat": repeat}
+
+def bench_ingest(bikes, rentals, seed, workdir):
+    bike_path, rental_path = generate(os.path.join(workdir, "feeds"), bikes, rentals, seed)
+    start = time.perf_counter()
+    reports = database.load_and_clean_data(bike_path, rental_path)
+    elapsed = time.perf_counter() - start
+    lines = sum(report["rows"] + report["rejected"] for report in reports)
+    return {"ingest": {"median_s": elapsed, "best_s": elapsed, "repeat": 1, "lines": lines,
+                       "rows_per_s": lines / elapsed, "rejected": sum(report["rejected"] for report in reports)}}
+
+def bench_search(repeat):
+    def cold(work):
+        def run():
+            bikeSearch.clear_search_cache()
+            work()
+        return run
+
+    by_type = lambda: bikeSearch.search_bicycles(type="Hybrid Bike", frame_size="Medium")
+    first_page = lambda: bikeSearch.search_page(type="Hybrid Bike", status="Available")
+    facets = lambda: bikeSearch.facet_counts(type="Hybrid Bike")
+    return {
+        "search_bicycles": measure(cold(by_type), repeat),
+        "search_page": measure(cold(first_page), repeat),
+        "search_page_cached": measure(first_page, repeat),
+        "facet_counts": measure(cold(facets), repeat),
+    }
+
+# Rent and return `count` available bikes, one call at a time and then as batches. Bikes that still have an
+# open rental in the history (a blank return date in the feed) are left out, as return_bike would close that one
+def bench_rent_return(count):
+    with database.session() as conn:
+        bike_ids = [row[0] for row in conn.execute("""
+            SELECT id FROM bicycles WHERE status = 'Available'
+              AND id NOT IN (SELECT bicycle_id FROM rentals WHERE return_date IS NULL)
+            ORDER BY id LIMIT ?""", (count,))]
+    members = [1000 + i % 100 for i in range(len(bike_ids))]
+    results = {}
+
+    start = time.perf_counter()
+    for member_id, bike_id in zip(members, bike_ids):
+        rent_bike(member_id, bike_id, 3)
+    results["rent_bike"] = _per_operation(time.perf_counter() - start, len(bike_ids))
+    start = time.perf_counter()
+    for bike_id in bike_ids:
+        return_bike(bike_id)
+    results["return_bike"] = _per_operation(time.perf_counter() - start, len(bike_ids))
+
+    start = time.perf_counter()
+    rent_bikes([(member_id, bike_id, 3) for member_id, bike_id in zip(members, bike_ids)])
+    results["rent_bikes"] = _per_operation(time.perf_counter() - start, len(bike_ids))
+    start = time.perf_counter()
+    return_bikes(bike_ids)
+    results["return_bikes"] = _per_operation(time.perf_counter() - start, len(bike_ids))
+    return results
+
+def _per_operation(elapsed, operations):
+    return {"median_s": elapsed / max(operations, 1), "best_s": elapsed / max(operations, 1), "repeat": operations,
+            "ops_per_s": operations / elapsed if elapsed else None}
+
+def bench_recommend(repeat):
+    stats = bikeSelect.compute_fleet_statistics()
+    return {
+        "compute_fleet_statistics": measure(bikeSelect.compute_fleet_statistics, repeat),
+        "compute_fleet_statistics_scan": measure(lambda: bikeSelect.compute_fleet_statistics(use_summary=False),
+                                                 max(repeat // 5, 1)),
+        "recommend_by_rental_frequency": measure(lambda: bikeSelect.recommend_by_rental_frequency(stats, False), repeat),
+        "recommend_by_age": measure(lambda: bikeSelect.recommend_by_age(stats, False), repeat),
+        "recommend_by_condition": measure(lambda: bikeSelect.recommend_by_condition(stats, False), repeat),
+        "recommend_by_type_popularity": measure(lambda: bikeSelect.recommend_by_type_popularity(stats, False), repeat),
+        "recommend_purchase_order": measure(lambda: bikeSelect.recommend_purchase_order(5000, show=False), repeat),
+    }
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+# Compare with an earlier results file, returning {benchmark: slowdown ratio} for every result that got slower
+# by more than the threshold
+def regressions(results, baseline, threshold=REGRESSION_THRESHOLD):
+    slower = {}
+    for name, result in results["results"].items():
+        before = baseline.get("results", {}).get(name)
+        if before and before["median_s"] and result["median_s"] > before["median_s"] * (1 + threshold):
+            slower[name] = result["median_s"] / before["median_s"]
+    return slower
+
+def run(bikes, rentals, seed=0, repeat=20, operations=200):
+    workdir = make_environment(bikes=0)
+    results = {}
+    results.update(bench_ingest(bikes, rentals, seed, workdir))
+    results.update(bench_search(repeat))
+    results.update(bench_rent_return(operations))
+    results.update(bench_recommend(repeat))
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "bikes": bikes,
+        "rentals": rentals,
+        "seed": seed,
+        "results": results,
+    }
+
+# Run every benchmark on freshly generated data and write the timings as JSON, e.g.
+#   python -m benchmarks.run_all --scale medium --output results.json --baseline last_release.json
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the whole benchmark suite and emit JSON results")
+    parser.add_argument("--scale", choices=SCALES, default="small")
+    parser.add_argument("--bikes", type=int, help="override the number of bikes of the scale")
+    parser.add_argument("--rentals", type=int, help="override the number of rentals of the scale")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=20, help="repetitions of each read benchmark")
+    parser.add_argument("--operations", type=int, default=200, help="bikes rented and returned per write benchmark")
+    parser.add_argument("--output", help="write the results to this file instead of stdout")
+    parser.add_argument("--baseline", help="earlier results file to check for regressions")
+    args = parser.parse_args()
+
+    bikes, rentals = SCALES[args.scale]
+    results = run(args.bikes or bikes, args.rentals or rentals, args.seed, args.repeat, args.operations)
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(text + "\n")
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            slower = regressions(results, json.load(file))
+        for name, ratio in sorted(slower.items()):
+            print(f"Regression: {name} is {ratio:.2f}x slower than the baseline", file=sys.stderr)
+        sys.exit(1 if slower else 0)
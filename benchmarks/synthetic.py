@@ -0,0 +1,104 @@
+import argparse
+import os
+import random
+from datetime import date, timedelta
+
+from benchmarks.common import SCALES, BIKE_TYPES, BRANDS, FRAME_SIZES, RATES
+
+CONDITIONS = ["New", "Good", "Fair", "Damaged"]
+STATUSES = ["Available", "Rented", "Under Maintenance"]
+
+# Some types are rented far more than others, so the recommendations have something to find
+TYPE_WEIGHTS = [30, 15, 25, 12, 8, 4, 6]
+
+# Rental history starts on this date; everything is derived from the seed, so the same arguments
+# always produce byte-identical files
+FIRST_DAY = date(2015, 1, 1)
+
+# Lines are written in blocks of this many to keep memory flat at any scale
+WRITE_BLOCK = 10000
+
+# Write a Bicycle_Info.txt style feed with `rows` bikes. `messy` is the share of lines with values the loader
+# has to clean up: pound signs, rates without a period, "Missing" rates, blank fields and odd date formats
+def write_bicycle_feed(path, rows, seed=0, messy=0.1):
+    rng = random.Random(seed)
+    with open(path, "w", encoding="utf-8") as file:
+        file.write("ID|Brand|Type|Frame Size|Rental Rate|Purchase Date|Condition|Status\n")
+        for start in range(1, rows + 1, WRITE_BLOCK):
+            file.writelines(_bicycle_line(rng, bike_id, messy) for bike_id in range(start, min(start + WRITE_BLOCK, rows + 1)))
+
+def _bicycle_line(rng, bike_id, messy):
+    brand = rng.choice(BRANDS)
+    bike_type = rng.choices(BIKE_TYPES, TYPE_WEIGHTS)[0]
+    rate = rng.choice(RATES)
+    purchased = FIRST_DAY - timedelta(days=rng.randint(0, 365)) + timedelta(days=rng.randint(0, 3650))
+    if rng.random() < messy:
+        kind = rng.randrange(4)
+        if kind == 0:
+            rate = "£" + rate.split(";")[0]
+        elif kind == 1:
+            rate = rate.split("/")[0]
+        elif kind == 2:
+            rate = rng.choice(["Missing", ""])
+        else:
+            brand = ""
+    return (f"{bike_id}|{brand}|{bike_type}|{rng.choice(FRAME_SIZES)}|{rate}|{_messy_date(rng, purchased, messy)}|"
+            f"{rng.choice(CONDITIONS)}|{rng.choice(STATUSES)}\n")
+
+# Write a Rental_History.txt style feed with `rentals` rentals of bikes 1..bikes, spread over `years` years.
+# Popular bikes (low IDs within the fleet) are rented more often; a `messy` share of lines has unusual date
+# formats, invalid dates, missing return dates or member IDs that are not numbers
+def write_rental_feed(path, rentals, bikes, seed=0, messy=0.1, years=10):
+    rng = random.Random(seed)
+    days = 365 * years
+    with open(path, "w", encoding="utf-8") as file:
+        for start in range(0, rentals, WRITE_BLOCK):
+            file.writelines(_rental_line(rng, bikes, days, messy) for _ in range(min(WRITE_BLOCK, rentals - start)))
+
+def _rental_line(rng, bikes, days, messy):
+    bike_id = min(int(rng.paretovariate(1.2)), bikes) if rng.random() < 0.3 else rng.randint(1, bikes)
+    rented = FIRST_DAY + timedelta(days=rng.randrange(days))
+    returned = _messy_date(rng, rented + timedelta(days=rng.choice([1, 1, 2, 3, 5, 7, 7, 10, 14, 21])), messy)
+    member_id = str(rng.randint(1001, 1100))
+    if rng.random() < messy:
+        kind = rng.randrange(3)
+        if kind == 0:
+            returned = ""
+        elif kind == 1:
+            member_id = rng.choice(["unknown", "M" + member_id, ""])
+    return f"{bike_id}|{_messy_date(rng, rented, messy)}|{returned}|{member_id}\n"
+
+# Mostly dd/mm/yyyy; a `messy` share in ISO, dd-mm-yyyy, unpadded or invalid form
+def _messy_date(rng, day, messy=0.15):
+    if rng.random() >= messy:
+        return day.strftime("%d/%m/%Y")
+    kind = rng.randrange(4)
+    if kind == 0:
+        return day.strftime("%Y-%m-%d")
+    if kind == 1:
+        return day.strftime("%d-%m-%Y")
+    if kind == 2:
+        return f"{day.day}/{day.month}/{day.year}"
+    return f"{day.day:02d}/{day.month + 20:02d}/{day.year}"
+
+# Write both feeds into `directory` and return their paths (bicycles, rentals)
+def generate(directory, bikes, rentals, seed=0, messy=0.1):
+    os.makedirs(directory, exist_ok=True)
+    bike_path = os.path.join(directory, "Bicycle_Info.txt")
+    rental_path = os.path.join(directory, "Rental_History.txt")
+    write_bicycle_feed(bike_path, bikes, seed, messy)
+    write_rental_feed(rental_path, rentals, bikes, seed + 1, messy)
+    return bike_path, rental_path
+
+# Command line: `python -m benchmarks.synthetic [DIRECTORY] [--scale small] [--seed 0]`
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write reproducible synthetic feed files")
+    parser.add_argument("directory", nargs="?", default="synthetic")
+    parser.add_argument("--scale", choices=SCALES, default="small")
+    parser.add_argument("--bikes", type=int, help="override the number of bikes of the scale")
+    parser.add_argument("--rentals", type=int, help="override the number of rentals of the scale")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    bikes, rentals = SCALES[args.scale]
+    for path in generate(args.directory, args.bikes or bikes, args.rentals or rentals, args.seed):
+        print(f"Wrote {path}")
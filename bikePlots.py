@@ -0,0 +1,95 @@
+import matplotlib.pyplot as plt
+import pandas as pd
+
+# Charts for the purchase recommendations in bikeSelect. This module is only imported when a
+# recommendation is shown, so headless callers never load matplotlib or pandas.
+# Each chart has a draw_* function that draws onto a given Axes, so it can also be rendered off-screen
+# (bikeUI draws them on a background thread), and a plot_* function that draws it in a new pyplot figure
+
+def _show(draw, *args):
+    figure, ax = plt.subplots(figsize=(10, 6))
+    draw(ax, *args)
+    plt.show()
+
+# Rental frequency as a bubble chart from (type, rental count) pairs
+def draw_rental_frequency(ax, all_types):
+    df = pd.DataFrame(all_types, columns=['Type', 'Rental Count'])
+    unique_types = df['Type'].unique()
+    colors = plt.cm.get_cmap('tab20', len(unique_types))  # Choose a color map
+    color_map = {unique_types[i]: colors(i) for i in range(len(unique_types))}
+    bubble_colors = df['Type'].map(color_map)
+
+    ax.scatter(df['Type'], df['Rental Count'], s=df['Rental Count']*10, c=bubble_colors, alpha=0.6, edgecolors="w", linewidth=2)
+    ax.set_title("Rental Frequency by Bicycle Type")
+    ax.set_xlabel("Bicycle Type")
+    ax.set_ylabel("Rental Count")
+    ax.tick_params(axis='x', labelrotation=45)
+
+def plot_rental_frequency(all_types):
+    _show(draw_rental_frequency, all_types)
+
+# The age of the oldest bicycle of each type from (type, age) pairs
+def draw_age(ax, bicycles_with_age):
+    df = pd.DataFrame(bicycles_with_age, columns=['Type', 'Age'])
+
+    ax.bar(df['Type'], df['Age'], color='cornflowerblue')
+    ax.set_title("Bicycle Ages by Type")
+    ax.set_xlabel("Bicycle Type")
+    ax.set_ylabel("Age")
+    ax.tick_params(axis='x', labelrotation=45)
+
+def plot_age(bicycles_with_age):
+    _show(draw_age, bicycles_with_age)
+
+# The condition table ("count (percentage%)" per type and condition) from {type: {condition: (count, percentage)}}
+def condition_table(mix):
+    pivot_df = pd.DataFrame({bike_type: {condition: count for condition, (count, _) in conditions.items()}
+                             for bike_type, conditions in mix.items()}).T
+    pivot_df_percentage = pd.DataFrame({bike_type: {condition: pct for condition, (_, pct) in conditions.items()}
+                                        for bike_type, conditions in mix.items()}).T
+    pivot_df.index.name = pivot_df_percentage.index.name = 'Type'
+    pivot_df.columns.name = pivot_df_percentage.columns.name = 'Condition'
+    return pivot_df.astype(int).astype(str) + " (" + pivot_df_percentage.round(1).astype(str) + "%)"
+
+# Condition percentages as a stacked bar chart, from {type: {condition: (count, percentage)}}
+def draw_condition_mix(ax, mix):
+    pivot_df_percentage = pd.DataFrame({bike_type: {condition: pct for condition, (_, pct) in conditions.items()}
+                                        for bike_type, conditions in mix.items()}).T
+    pivot_df_percentage.plot(kind='bar', stacked=True, ax=ax, colormap='Set3')
+    ax.set_title("Bicycle Condition Distribution by Type")
+    ax.set_xlabel("Bicycle Type")
+    ax.set_ylabel("Percentage")
+    ax.tick_params(axis='x', labelrotation=45)
+    ax.legend(title='Condition')
+
+# Print the condition table and plot the condition mix
+def plot_condition_mix(mix):
+    # Display the result table
+    print(condition_table(mix))
+    _show(draw_condition_mix, mix)
+
+# Popularity as a horizontal bar chart from (type, popularity) pairs
+def draw_type_popularity(ax, all_types_popularity):
+    df = pd.DataFrame(all_types_popularity, columns=['Type', 'Popularity'])
+
+    ax.barh(df['Type'], df['Popularity'], color='lightcoral', edgecolor='black')
+    ax.set_title("Bicycle Type Popularity Distribution")
+    ax.set_xlabel("Popularity (Number of Rentals)")
+    ax.set_ylabel("Bicycle Type")
+    for i, popularity in enumerate(df['Popularity']):
+        ax.text(popularity, i, str(popularity), va='center', fontsize=10)
+
+def plot_type_popularity(all_types_popularity):
+    _show(draw_type_popularity, all_types_popularity)
+
+# The purchase order distribution
+def draw_purchase_order(ax, recommendations, budget):
+    ax.barh([rec['type'] for rec in recommendations], [rec['units'] for rec in recommendations], color='cornflowerblue')
+    ax.set_title(f"Recommended Purchase Order (Budget: £{budget})")
+    ax.set_xlabel("Bicycle Type")
+    ax.set_ylabel("Units Recommended")
+    for i, rec in enumerate(recommendations):
+        ax.text(rec['units'], i, f"£{rec['cost_per_unit']}/unit\nTotal: £{rec['total_cost']}", va='center')
+
+def plot_purchase_order(recommendations, budget):
+    _show(draw_purchase_order, recommendations, budget)
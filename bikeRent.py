@@ -2,8 +2,9 @@ import sqlite3
 import json
 from datetime import datetime
 from datetime import datetime, timedelta
-from database import connect_db, close_db
+from database import write_transaction, select_in, execute_in, clean_bike_id, mark_bicycles_changed
 import membershipManager
+import availability
 
 # Memberships dictionary for testing
 # memberships = {
@@ -26,68 +27,144 @@ import membershipManager
 #         memberships[member_id]["MembershipEndDate"], "%Y-%m-%d"
 #     )
 
-# Load the memberships data from the JSON file
+# Load the memberships data from the JSON file (cached, re-read only when the file changes)
 def load_memberships():
-    try:
-        with open("membership.json", "r") as file:
-            memberships = json.load(file)
-            
-            # Convert MembershipEndDate strings to datetime objects for consistency
-            for member_id, details in memberships.items():
-                details["MembershipEndDate"] = datetime.strptime(details["MembershipEndDate"], "%Y-%m-%d")
-                
-            return memberships
-    except (FileNotFoundError, json.JSONDecodeError):
-        print("Error: Could not load membership data.")
-        return {}
+    return membershipManager.get_memberships()
 
 # Function to rent a bicycle
 def rent_bike(member_id, bike_id, rental_duration):
-    memberships = load_memberships()  # Load the membership dictionary
-    conn = connect_db()
-    cursor = conn.cursor()
-
     # Convert member_id to string if necessary
     member_id = str(member_id)
 
     # Step 1: Verify if the member is active
-    if not membershipManager.check_membership(member_id, memberships):
-        close_db(conn)
+    if not membershipManager.check_membership(member_id):
         return f"Member ID {member_id} is not active."
 
-    # Step 2: Check if the member has reached their rental limit
-    current_rentals = cursor.execute(
-        "SELECT COUNT(*) FROM rentals WHERE member_id = ? AND return_date IS NULL",
-        (member_id,)
-    ).fetchone()[0]
+    # Steps 2-4 run in one write transaction, so two terminals cannot rent the same bike
+    return write_transaction(lambda conn: _rent_in_transaction(conn, member_id, bike_id, rental_duration))
 
-    rental_limit = membershipManager.get_rental_limit(member_id, memberships)
-    if current_rentals >= rental_limit:
-        close_db(conn)
-        return f"Member ID {member_id} has reached the rental limit of {rental_limit}."
+def _rent_in_transaction(conn, member_id, bike_id, rental_duration):
+    cursor = conn.cursor()
+
+    # Step 2: Check if the member has reached their rental limit
+    limit_message = _check_rental_limit(cursor, member_id)
+    if limit_message:
+        return limit_message
 
     # Step 3: Check if the bicycle is available
     cursor.execute("SELECT status FROM bicycles WHERE id = ?", (bike_id,))
     bike_status = cursor.fetchone()
     if not bike_status:
-        close_db(conn)
         return f"Bicycle ID {bike_id} does not exist."
     elif bike_status[0] != "Available":
-        close_db(conn)
         return f"Bicycle ID {bike_id} is not available for rent. It is {bike_status[0]}"
 
     # Step 4: Process the rental with rental duration and expected return date
+    return (_record_rental(cursor, member_id, bike_id, rental_duration)
+            or f"Bicycle ID {bike_id} is not available for rent. It is Rented")
+
+# Return a message if the member cannot rent another bike, otherwise None
+def _check_rental_limit(cursor, member_id):
+    current_rentals = cursor.execute(
+        "SELECT COUNT(*) FROM rentals WHERE member_id = ? AND return_date IS NULL",
+        (member_id,)
+    ).fetchone()[0]
+
+    rental_limit = membershipManager.get_rental_limit(member_id)
+    if current_rentals >= rental_limit:
+        return f"Member ID {member_id} has reached the rental limit of {rental_limit}."
+    return None
+
+# Take the bike and record the rental, returning the confirmation message, or None if the bike is no longer available
+def _record_rental(cursor, member_id, bike_id, rental_duration):
     rental_date = datetime.now()
     expected_return_date = rental_date + timedelta(days=rental_duration)
-    
-    cursor.execute("UPDATE bicycles SET status = 'Rented' WHERE id = ?", (bike_id,))
+
+    # Only take the bike if it is still available
+    cursor.execute("UPDATE bicycles SET status = 'Rented' WHERE id = ? AND status = 'Available'", (bike_id,))
+    if cursor.rowcount == 0:
+        return None
     cursor.execute("INSERT INTO rentals (bicycle_id, rental_date, expected_return_date, member_id) VALUES (?, ?, ?, ?)",
                    (bike_id, rental_date.strftime("%Y-%m-%d"), expected_return_date.strftime("%Y-%m-%d"), member_id))
-    conn.commit()
+    mark_bicycles_changed([clean_bike_id(bike_id)])
 
-    close_db(conn)
     return f"Rental successful. Bicycle ID {bike_id} rented by Member ID {member_id} for {rental_duration} days. Expected return date: {expected_return_date.strftime('%Y-%m-%d')}"
 
+# Function to rent whichever bike of a type (and optionally frame size) is available, e.g. "any Medium Hybrid Bike".
+# Candidates come from the in-memory availability index, so no search is needed
+def rent_available_bike(member_id, bike_type, frame_size=None, rental_duration=1):
+    member_id = str(member_id)
+    if not membershipManager.check_membership(member_id):
+        return f"Member ID {member_id} is not active."
+    return write_transaction(
+        lambda conn: _rent_available_in_transaction(conn, member_id, bike_type, frame_size, rental_duration))
+
+def _rent_available_in_transaction(conn, member_id, bike_type, frame_size, rental_duration):
+    cursor = conn.cursor()
+    limit_message = _check_rental_limit(cursor, member_id)
+    if limit_message:
+        return limit_message
+
+    while True:
+        bike_id = availability.find_available(bike_type, frame_size)
+        if bike_id is None:
+            return f"No {frame_size + ' ' if frame_size else ''}{bike_type} is available for rent."
+        message = _record_rental(cursor, member_id, bike_id, rental_duration)
+        if message:
+            return message
+        # Taken by another process since the index was loaded, try the next one
+        availability.discard(bike_id)
+
+# Function to rent several bicycles at once, e.g. for a tour group.
+# `requests` is a list of (member_id, bike_id, rental_duration) tuples. The whole batch is checked and applied in
+# one transaction, and a message is returned for each request in the same order and format as rent_bike
+def rent_bikes(requests):
+    requests = [(str(member_id), clean_bike_id(bike_id), rental_duration)
+                for member_id, bike_id, rental_duration in requests]
+    return write_transaction(lambda conn: _rent_batch_in_transaction(conn, requests))
+
+def _rent_batch_in_transaction(conn, requests):
+    # Look up open rentals and bike statuses for the whole batch up front
+    member_ids = {member_id for member_id, _, _ in requests}
+    bike_ids = {bike_id for _, bike_id, _ in requests}
+    current_rentals = {str(member_id): count for member_id, count in select_in(
+        conn, "SELECT member_id, COUNT(*) FROM rentals WHERE return_date IS NULL AND member_id IN ({}) GROUP BY member_id",
+        member_ids)}
+    bike_statuses = dict(select_in(conn, "SELECT id, status FROM bicycles WHERE id IN ({})", bike_ids))
+
+    rental_date = datetime.now()
+    messages, rented, new_rentals = [], [], []
+    for member_id, bike_id, rental_duration in requests:
+        # Same checks, in the same order, as rent_bike; earlier requests in the batch count towards later ones
+        if not membershipManager.check_membership(member_id):
+            messages.append(f"Member ID {member_id} is not active.")
+            continue
+        rental_limit = membershipManager.get_rental_limit(member_id)
+        if current_rentals.get(member_id, 0) >= rental_limit:
+            messages.append(f"Member ID {member_id} has reached the rental limit of {rental_limit}.")
+            continue
+        bike_status = bike_statuses.get(bike_id)
+        if bike_status is None:
+            messages.append(f"Bicycle ID {bike_id} does not exist.")
+            continue
+        elif bike_status != "Available":
+            messages.append(f"Bicycle ID {bike_id} is not available for rent. It is {bike_status}")
+            continue
+
+        expected_return_date = rental_date + timedelta(days=rental_duration)
+        bike_statuses[bike_id] = "Rented"
+        current_rentals[member_id] = current_rentals.get(member_id, 0) + 1
+        rented.append(bike_id)
+        new_rentals.append((bike_id, rental_date.strftime("%Y-%m-%d"), expected_return_date.strftime("%Y-%m-%d"), member_id))
+        messages.append(f"Rental successful. Bicycle ID {bike_id} rented by Member ID {member_id} for {rental_duration} days. Expected return date: {expected_return_date.strftime('%Y-%m-%d')}")
+
+    # Apply every successful rental at once
+    execute_in(conn, "UPDATE bicycles SET status = 'Rented' WHERE id IN ({})", rented)
+    mark_bicycles_changed(rented)
+    conn.executemany("INSERT INTO rentals (bicycle_id, rental_date, expected_return_date, member_id) VALUES (?, ?, ?, ?)",
+                     new_rentals)
+    return messages
+
 # Testing Purposes Only
 # Uncomment it if you want to test this module
 # Testing the rent_bike function
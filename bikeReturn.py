@@ -1,56 +1,114 @@
 import sqlite3
 from datetime import datetime
-from database import connect_db, close_db
+from database import session, write_transaction, select_in, clean_bike_id, mark_bicycles_changed, parse_rental_rate
 
 # Define an additional daily fee for late returns
 LATE_FEE_PER_DAY = 5  # Flat late fee added on top of rental rate for each late day
+ALLOWED_RENTAL_DAYS = 7  # Allowed rental period before late fees apply
 
-# Function to calculate late fees based on rental rate and additional fees
-def calculate_fees(rental_date, return_date, rental_rate):
-    # Clean up the rental rate string
-    cleaned_rate = rental_rate.replace("£", "").replace("Â", "").split("/")[0].strip()
-    
-    try:
-        rental_rate_per_day = float(cleaned_rate)  # Convert cleaned rate to a float
-    except ValueError:
+# Function to calculate late fees based on rental rate and additional fees.
+# daily_rate is the pre-parsed bicycles.daily_rate; without it the rate is read from the rental_rate text
+def calculate_fees(rental_date, return_date, rental_rate, daily_rate=None):
+    rental_rate_per_day = daily_rate_of(daily_rate, rental_rate)
+    if rental_rate_per_day is None:
         print("Error: Could not parse rental rate.")
         return 0  # Return 0 if rental rate is invalid
 
     days_rented = (return_date - rental_date).days
-    allowed_rental_days = 7  # Allowed rental period before late fees apply
 
     # Calculate late fees if the return is after the allowed days
-    if days_rented > allowed_rental_days:
-        late_days = days_rented - allowed_rental_days
+    if days_rented > ALLOWED_RENTAL_DAYS:
+        late_days = days_rented - ALLOWED_RENTAL_DAYS
         return late_days * (rental_rate_per_day + LATE_FEE_PER_DAY)
     return 0
 
+# The daily rate to charge: the pre-parsed bicycles.daily_rate, or the rate read from the rental_rate text
+# for rows written without it
+def daily_rate_of(daily_rate, rental_rate):
+    if daily_rate is None and rental_rate:
+        return parse_rental_rate(rental_rate)[0]
+    return daily_rate
+
+# Function to calculate late fees for many rentals at once with NumPy, for billing runs and reports.
+# Takes sequences (or arrays) of rental dates, return dates ("YYYY-MM-DD" strings, dates or datetime64) and daily rates,
+# and returns an array of fees, with the same rules as calculate_fees. Rentals with a missing date or rate cost 0
+def calculate_fees_bulk(rental_dates, return_dates, daily_rates):
+    import numpy as np
+    rental_days = np.asarray(rental_dates, dtype="datetime64[D]")
+    return_days = np.asarray(return_dates, dtype="datetime64[D]")
+    rates = np.asarray(daily_rates, dtype=float)
+    known = ~(np.isnat(rental_days) | np.isnat(return_days) | np.isnan(rates))
+    late_days = np.where(known, (return_days - rental_days).astype("int64"), 0) - ALLOWED_RENTAL_DAYS
+    return np.where(known & (late_days > 0), late_days * (rates + LATE_FEE_PER_DAY), 0.0)
+
+# Function to calculate the late fees for every rental returned between two dates (inclusive, "YYYY-MM-DD"),
+# e.g. for monthly billing. Rentals are read in chunks of chunk_size rows; returns (rental IDs, fees) arrays
+def late_fees_between(start_date, end_date, chunk_size=100000):
+    import numpy as np
+    ids, fees = [], []
+    with session() as conn:
+        cursor = conn.execute("""
+            SELECT rentals.id, rentals.rental_date, rentals.return_date, bicycles.daily_rate, bicycles.rental_rate
+            FROM rentals
+            JOIN bicycles ON rentals.bicycle_id = bicycles.id
+            WHERE rentals.return_date BETWEEN ? AND ?""", (start_date, end_date))
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            ids.append(np.array([row[0] for row in rows], dtype="int64"))
+            fees.append(calculate_fees_bulk([row[1] for row in rows], [row[2] for row in rows],
+                                            [daily_rate_of(row[3], row[4]) for row in rows]))
+    if not ids:
+        return np.zeros(0, dtype="int64"), np.zeros(0)
+    return np.concatenate(ids), np.concatenate(fees)
+
 # Function to return a bicycle with optional damage handling
 def return_bike(bike_id, damage_details=None, damage_charge=0, new_condition="Good"):
-    conn = connect_db()
+    # The lookup and both updates run in one write transaction, so a rental cannot be closed twice
+    late_fee = write_transaction(
+        lambda conn: _return_in_transaction(conn, bike_id, damage_details, damage_charge, new_condition))
+
+    # If no active rental is found, return an error message
+    if late_fee is None:
+        return f"No active rental found for Bicycle ID {bike_id}."
+
+    return _return_message(bike_id, late_fee, damage_charge, new_condition)
+
+# Build the confirmation message for a processed return
+def _return_message(bike_id, late_fee, damage_charge, new_condition):
+    return_message = f"Bicycle Return processed for Bicycle ID {bike_id}."
+    if late_fee > 0:
+        return_message += f" Late fee: £{late_fee:.2f}."
+    if damage_charge > 0:
+        return_message += f" Damage charge: £{damage_charge:.2f}."
+    if new_condition == "Damaged":
+        return_message += " Bicycle marked as 'Damaged' and made unavailable for rental."
+
+    return return_message
+
+# Close the open rental for a bike and update the bike, returning the late fee (None if there is no open rental)
+def _return_in_transaction(conn, bike_id, damage_details, damage_charge, new_condition):
     cursor = conn.cursor()
 
     # Retrieve the rental record and rental rate for the bicycle
     cursor.execute("""
-        SELECT rentals.rental_date, bicycles.rental_rate, bicycles.condition
+        SELECT rentals.rental_date, bicycles.rental_rate, bicycles.condition, bicycles.daily_rate
         FROM rentals
         JOIN bicycles ON rentals.bicycle_id = bicycles.id
         WHERE rentals.bicycle_id = ? AND rentals.return_date IS NULL
     """, (bike_id,))
     rental_record = cursor.fetchone()
-
-    # If no active rental is found, return an error message
     if not rental_record:
-        close_db(conn)
-        return f"No active rental found for Bicycle ID {bike_id}."
+        return None
 
-    # Extract rental_date, rental_rate, and current condition
-    rental_date_str, rental_rate, current_condition = rental_record
+    # Extract rental_date, rental_rate, current condition and the parsed daily rate
+    rental_date_str, rental_rate, current_condition, daily_rate = rental_record
     rental_date = datetime.strptime(rental_date_str, "%Y-%m-%d")
     return_date = datetime.now()
 
     # Calculate fees
-    late_fee = calculate_fees(rental_date, return_date, rental_rate)
+    late_fee = calculate_fees(rental_date, return_date, rental_rate, daily_rate)
     total_damage_charge = damage_charge if damage_details else 0
     total_fees = late_fee + total_damage_charge
 
@@ -60,6 +118,8 @@ def return_bike(bike_id, damage_details=None, damage_charge=0, new_condition="Go
         SET return_date = ?, fees = ?, damage_details = ?
         WHERE bicycle_id = ? AND return_date IS NULL
     """, (return_date.strftime("%Y-%m-%d"), total_fees, damage_details, bike_id))
+    if cursor.rowcount == 0:
+        return None
 
     # Update the bicycle's condition and status
     cursor.execute("""
@@ -67,20 +127,54 @@ def return_bike(bike_id, damage_details=None, damage_charge=0, new_condition="Go
     SET condition = ?, status = ?
     WHERE id = ?
     """, (new_condition, "Unavailable" if new_condition == "Damaged" else "Available", bike_id))
+    mark_bicycles_changed([clean_bike_id(bike_id)])
 
-    conn.commit()
-    close_db(conn)
+    return late_fee
 
-    # Return confirmation message
-    return_message = f"Bicycle Return processed for Bicycle ID {bike_id}."
-    if late_fee > 0:
-        return_message += f" Late fee: £{late_fee:.2f}."
-    if damage_charge > 0:
-        return_message += f" Damage charge: £{damage_charge:.2f}."
-    if new_condition == "Damaged":
-        return_message += " Bicycle marked as 'Damaged' and made unavailable for rental."
+# Function to return several bicycles at once, e.g. at the end-of-day fleet check-in.
+# Each entry in `returns` is a bike ID or a tuple of return_bike's arguments
+# (bike_id, damage_details, damage_charge, new_condition). The whole batch is applied in one
+# transaction and a message is returned for each entry, in order, in the same format as return_bike
+def return_bikes(returns):
+    returns = [_return_args(*(item if isinstance(item, (tuple, list)) else (item,))) for item in returns]
+    return write_transaction(lambda conn: _return_batch_in_transaction(conn, returns))
 
-    return return_message
+def _return_args(bike_id, damage_details=None, damage_charge=0, new_condition="Good"):
+    return bike_id, damage_details, damage_charge, new_condition
+
+def _return_batch_in_transaction(conn, returns):
+    # Fetch the open rental (the first one, as return_bike does) and rental rate for every bike in the batch
+    open_rentals = {}
+    for bike_id, rental_date_str, rental_rate, daily_rate in select_in(conn, """
+            SELECT rentals.bicycle_id, rentals.rental_date, bicycles.rental_rate, bicycles.daily_rate
+            FROM rentals
+            JOIN bicycles ON rentals.bicycle_id = bicycles.id
+            WHERE rentals.return_date IS NULL AND rentals.bicycle_id IN ({})
+            ORDER BY rentals.id""", {bike_id for bike_id, _, _, _ in returns}):
+        open_rentals.setdefault(bike_id, (rental_date_str, rental_rate, daily_rate))
+
+    return_date = datetime.now()
+    messages, rental_updates, bike_updates = [], [], []
+    for bike_id, damage_details, damage_charge, new_condition in returns:
+        rental = open_rentals.pop(clean_bike_id(bike_id), None)
+        if rental is None:
+            messages.append(f"No active rental found for Bicycle ID {bike_id}.")
+            continue
+
+        late_fee = calculate_fees(datetime.strptime(rental[0], "%Y-%m-%d"), return_date, rental[1], rental[2])
+        total_fees = late_fee + (damage_charge if damage_details else 0)
+        rental_updates.append((return_date.strftime("%Y-%m-%d"), total_fees, damage_details, bike_id))
+        bike_updates.append((new_condition, "Unavailable" if new_condition == "Damaged" else "Available", bike_id))
+        messages.append(_return_message(bike_id, late_fee, damage_charge, new_condition))
+
+    conn.executemany("""
+        UPDATE rentals
+        SET return_date = ?, fees = ?, damage_details = ?
+        WHERE bicycle_id = ? AND return_date IS NULL
+    """, rental_updates)
+    conn.executemany("UPDATE bicycles SET condition = ?, status = ? WHERE id = ?", bike_updates)
+    mark_bicycles_changed(clean_bike_id(bike_id) for _, _, bike_id in bike_updates)
+    return messages
 
 # Testing the return_bike function
 # if __name__ == "__main__":
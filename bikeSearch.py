@@ -1,38 +1,171 @@
 import sqlite3
-from database import connect_db, close_db  # Import connection functions from database.py
+import threading
+from functools import lru_cache
+
+import database
+from database import session, add_change_listener  # Import the pooled session from database.py
+
+# Columns that can be filtered on by exact value, and that facet_counts() counts for the search dropdowns
+FACETS = ("type", "brand", "frame_size", "status", "condition")
+
+# The columns every search returns, in this order. Listed explicitly so rows keep the same shape when
+# columns are added to bicycles (such as the parsed daily_rate and weekly_rate)
+COLUMNS = ("id", "brand", "type", "frame_size", "rental_rate", "purchase_date", "condition", "status")
+SELECT_BICYCLES = f"SELECT {', '.join(COLUMNS)} FROM bicycles"
+
+# Default number of rows per page for search_page() and per batch for iter_bicycles()
+PAGE_SIZE = 50
+
+# Number of distinct query results kept in memory
+CACHE_SIZE = 256
+
+# Build the WHERE clause for a set of filters. A filter value may be a single value or a list of accepted values;
+# empty values are ignored. `skip` leaves one facet out, so its counts reflect the other filters only
+def _where(filters, skip=None):
+    clauses, parameters = [], []
+    for column in FACETS:
+        value = filters.get(column)
+        if not value or column == skip:
+            continue
+        if isinstance(value, (list, tuple, set, frozenset)):
+            clauses.append(f"{column} IN ({', '.join('?' * len(value))})")
+            parameters.extend(sorted(value))
+        else:
+            clauses.append(f"{column} = ?")
+            parameters.append(value)
+    if filters.get("min_rate") is not None:
+        clauses.append("daily_rate >= ?")
+        parameters.append(float(filters["min_rate"]))
+    if filters.get("max_rate") is not None:
+        clauses.append("daily_rate <= ?")
+        parameters.append(float(filters["max_rate"]))
+    return (" WHERE " + " AND ".join(clauses)) if clauses else "", parameters
+
+def _check_filters(filters):
+    unknown = set(filters) - set(FACETS) - {"min_rate", "max_rate"}
+    if unknown:
+        raise TypeError(f"Unknown search filter(s): {', '.join(sorted(unknown))}")
+
+# Query results are cached until bikes change. Rents, returns and loads in this process invalidate the cache
+# through the database change listeners; commits from other processes are spotted through PRAGMA data_version
+_generation = 0
+_local = threading.local()
+
+def clear_search_cache(bike_ids=None):
+    global _generation
+    _generation += 1
+    _cached_rows.cache_clear()
+
+add_change_listener(clear_search_cache)
+
+def _check_data_version(conn):
+    version = conn.execute("PRAGMA data_version").fetchone()[0]
+    if getattr(_local, "seen", None) != (conn, version):
+        # First look from this connection, or another connection has committed since: drop what we have
+        clear_search_cache()
+        _local.seen = (conn, version)
+
+# The generation and database path are part of the key, so a result read before an invalidation is never reused
+@lru_cache(maxsize=CACHE_SIZE)
+def _cached_rows(generation, db_path, query, parameters):
+    with session() as conn:
+        return tuple(conn.execute(query, parameters))
+
+def _rows(query, parameters):
+    with session() as conn:
+        _check_data_version(conn)
+        return _cached_rows(_generation, database.DB_PATH, query, tuple(parameters))
 
 # Function to search bicycles based on dynamic criteria
-def search_bicycles(type=None, brand=None, frame_size=None):
+def search_bicycles(type=None, brand=None, frame_size=None, status=None, condition=None, min_rate=None, max_rate=None):
+    filters = {"type": type, "brand": brand, "frame_size": frame_size, "status": status, "condition": condition,
+               "min_rate": min_rate, "max_rate": max_rate}
     # Check if all search criteria are empty
-    if not type and not brand and not frame_size:
+    if not any(filters[column] for column in FACETS) and min_rate is None and max_rate is None:
         return "Please specify at least one search criterion."
-    
-    conn = connect_db()
-    cursor = conn.cursor()
-    
-    # Start with base query
-    query = "SELECT * FROM bicycles WHERE 1=1"
-    parameters = []
-
-    # Add filters based on available parameters
-    if type:
-        query += " AND type = ?"
-        parameters.append(type)
-    if brand:
-        query += " AND brand = ?"
-        parameters.append(brand)
-    if frame_size:
-        query += " AND frame_size = ?"
-        parameters.append(frame_size)
-
-    # Execute the dynamically built query with parameters
-    cursor.execute(query, parameters)
-    results = cursor.fetchall()
-    close_db(conn)
+
+    # Build the query from the filters that were given and run it (or reuse the cached result)
+    where, parameters = _where(filters)
+    results = list(_rows(f"{SELECT_BICYCLES}{where} ORDER BY id", parameters))
 
     # Return results if found, or a message if no results match
     return results if results else "No bicycles found matching the criteria."
 
+# Function to fetch one page of matching bicycles, ordered by ID. Pass the returned next_after_id back in
+# to get the following page; it is None on the last page. Unlike OFFSET, later pages cost the same as the first
+def search_page(after_id=None, limit=PAGE_SIZE, **filters):
+    _check_filters(filters)
+    if limit < 1:
+        raise ValueError("limit must be at least 1")
+    where, parameters = _where(filters)
+    if after_id is not None:
+        where += " AND id > ?" if where else " WHERE id > ?"
+        parameters.append(after_id)
+    rows = _rows(f"{SELECT_BICYCLES}{where} ORDER BY id LIMIT ?", parameters + [limit + 1])
+    if len(rows) > limit:
+        return list(rows[:limit]), rows[limit - 1][0]
+    return list(rows), None
+
+# Function to stream every matching bicycle without holding them all in memory, one page at a time.
+# Streamed results are not cached
+def iter_bicycles(batch_size=1000, **filters):
+    _check_filters(filters)
+    if batch_size < 1:
+        raise ValueError("batch_size must be at least 1")
+    where, parameters = _where(filters)
+    query = f"{SELECT_BICYCLES}{where}{' AND' if where else ' WHERE'} id > ? ORDER BY id LIMIT ?"
+    after_id = -1
+    while True:
+        with session() as conn:
+            rows = conn.execute(query, parameters + [after_id, batch_size]).fetchall()
+        yield from rows
+        if len(rows) < batch_size:
+            return
+        after_id = rows[-1][0]
+
+# Function to count matching bicycles
+def count_bicycles(**filters):
+    _check_filters(filters)
+    where, parameters = _where(filters)
+    return _rows(f"SELECT COUNT(*) FROM bicycles{where}", parameters)[0][0]
+
+# Function to count matching bicycles per value of each facet, e.g. {"type": {"BMX": 12, ...}, "brand": {...}}.
+# Each facet ignores its own filter, so the counts show what picking another value would give
+def facet_counts(facets=FACETS, **filters):
+    _check_filters(filters)
+    for column in facets:
+        if column not in FACETS:
+            raise ValueError(f"Unknown facet: {column}")
+
+    # Count bikes per combination of facet values, then add up the combinations each facet's filters accept.
+    # The counts are kept in the bicycle_facets summary table (see fleetStats.py), so only a rate range
+    # needs a grouped query over bicycles
+    if filters.get("min_rate") is None and filters.get("max_rate") is None:
+        combinations = _rows("""SELECT NULLIF(type, ''), NULLIF(brand, ''), NULLIF(frame_size, ''), NULLIF(status, ''),
+                                       NULLIF(condition, ''), bikes
+                                FROM bicycle_facets WHERE bikes > 0""", ())
+    else:
+        where, parameters = _where({"min_rate": filters.get("min_rate"), "max_rate": filters.get("max_rate")})
+        combinations = _rows(f"SELECT {', '.join(FACETS)}, COUNT(*) FROM bicycles{where} GROUP BY {', '.join(FACETS)}",
+                             parameters)
+
+    accepted = {}
+    for position, column in enumerate(FACETS):
+        value = filters.get(column)
+        if value:
+            accepted[position] = set(value) if isinstance(value, (list, tuple, set, frozenset)) else {value}
+    counts = {column: {} for column in facets}
+    for row in combinations:
+        failed = [position for position, values in accepted.items() if row[position] not in values]
+        if len(failed) > 1:
+            continue
+        for column in facets:
+            position = FACETS.index(column)
+            if not failed or failed == [position]:
+                counts[column][row[position]] = counts[column].get(row[position], 0) + row[-1]
+    return {column: dict(sorted(values.items(), key=lambda item: (item[0] is not None, item[0] or "")))
+            for column, values in counts.items()}
+
 # Function to display search results
 def display_results(results):
     if not results:
@@ -1,10 +1,8 @@
 import sqlite3
 from datetime import datetime
-from collections import Counter
-import matplotlib.pyplot as plt
-import pandas as pd
-import numpy as np
-from database import connect_db, close_db
+from collections import Counter, namedtuple
+from database import session
+import fleetStats
 
 # Define the cost for each bicycle type
 bicycle_costs = {
@@ -17,150 +15,168 @@ bicycle_costs = {
     "BMX": 250,
 }
 
+# Statistics for one bicycle type: number of bikes, number of rentals, age of the oldest bike,
+# bikes per age (Counter) and bikes per condition (Counter)
+TypeStats = namedtuple("TypeStats", ["type", "bikes", "rentals", "max_age", "ages", "conditions"])
+
+# Statistics for the whole fleet: TypeStats per type (sorted by type name) and the oldest bike's type and age
+FleetStats = namedtuple("FleetStats", ["types", "oldest_type", "oldest_age"])
+
+# Gather every per-type statistic the recommendations need. By default this reads the summary tables
+# maintained by fleetStats, a few rows per type; use_summary=False recomputes everything with one scan
+# over bicycles and rentals (plus the per-bike counts of archived rentals)
+def compute_fleet_statistics(use_summary=True):
+    if use_summary:
+        groups = fleetStats.bikes_per_type_condition_year()
+        rentals = fleetStats.rentals_per_type()
+        first_ids = None
+    else:
+        with session() as conn:
+            rows = conn.execute("""
+                SELECT bicycles.type, bicycles.condition, substr(bicycles.purchase_date, 1, 4) AS purchase_year,
+                       COUNT(*), MIN(bicycles.id), COALESCE(SUM(rental_counts.rentals), 0)
+                FROM bicycles
+                LEFT JOIN (SELECT bicycle_id, SUM(rentals) AS rentals FROM (
+                               SELECT bicycle_id, COUNT(*) AS rentals FROM rentals GROUP BY bicycle_id
+                               UNION ALL
+                               SELECT bicycle_id, rentals FROM archived_bike_rentals)
+                           GROUP BY bicycle_id) AS rental_counts
+                       ON rental_counts.bicycle_id = bicycles.id
+                GROUP BY bicycles.type, bicycles.condition, purchase_year
+            """).fetchall()
+        groups = [row[:4] for row in rows]
+        first_ids = {row[:3]: row[4] for row in rows}
+        rentals = Counter()
+        for row in rows:
+            rentals[row[0]] += row[5]
+
+    current_year = datetime.now().year
+    types = {}
+    oldest_age, oldest_groups = None, []
+    for bike_type, condition, purchase_year, bikes in groups:
+        age = current_year - int(purchase_year) if purchase_year else 0
+        stats = types.setdefault(bike_type, {"bikes": 0, "ages": Counter(), "conditions": Counter()})
+        stats["bikes"] += bikes
+        stats["ages"][age] += bikes
+        stats["conditions"][condition] += bikes
+        if oldest_age is None or age > oldest_age:
+            oldest_age, oldest_groups = age, []
+        if age == oldest_age:
+            oldest_groups.append((bike_type, condition, purchase_year))
+
+    type_stats = {
+        bike_type: TypeStats(bike_type, stats["bikes"], rentals.get(bike_type, 0), max(stats["ages"]),
+                             stats["ages"], stats["conditions"])
+        for bike_type, stats in sorted(types.items(), key=lambda item: (item[0] is not None, item[0] or ""))
+    }
+    return FleetStats(type_stats, _oldest_type(oldest_groups, first_ids), oldest_age)
+
+# The type of the oldest bike. When several types share the oldest age the bike with the lowest ID wins
+def _oldest_type(oldest_groups, first_ids):
+    oldest_types = {group[0] for group in oldest_groups}
+    if len(oldest_types) <= 1:
+        return next(iter(oldest_types), None)
+    if first_ids is not None:
+        return min(oldest_groups, key=lambda group: first_ids[group])[0]
+    years = sorted({group[2] or "" for group in oldest_groups})
+    with session() as conn:
+        return conn.execute(f"""
+            SELECT type FROM bicycles WHERE COALESCE(substr(purchase_date, 1, 4), '') IN ({", ".join("?" * len(years))})
+            ORDER BY id LIMIT 1""", years).fetchone()[0]
+
+# Conditions that count towards the condition mix
+CONDITIONS = ('Fair', 'New', 'Good', 'Damaged')
+
+# Charts are drawn by bikePlots, which is only imported (along with matplotlib and pandas) when something is shown
+def _plots():
+    import bikePlots
+    return bikePlots
+
+# Headless analytics: these return data only, without printing or plotting
+
+# Rentals per type as (type, rental count) pairs, for types that have been rented
+def rental_frequency_by_type(stats=None):
+    stats = stats or compute_fleet_statistics()
+    return [(type_stats.type, type_stats.rentals) for type_stats in stats.types.values() if type_stats.rentals]
+
+# Age of the oldest bike of each type as (type, age) pairs
+def age_by_type(stats=None):
+    stats = stats or compute_fleet_statistics()
+    return [(type_stats.type, type_stats.max_age) for type_stats in stats.types.values()]
+
+# Condition mix per type as {type: {condition: (count, percentage of the type's bikes)}}
+def condition_mix_by_type(stats=None):
+    stats = stats or compute_fleet_statistics()
+    present = sorted({condition for type_stats in stats.types.values()
+                      for condition in type_stats.conditions if condition in CONDITIONS})
+    mix = {}
+    for type_stats in stats.types.values():
+        total = sum(type_stats.conditions[condition] for condition in present)
+        if total:
+            mix[type_stats.type] = {condition: (type_stats.conditions[condition],
+                                                type_stats.conditions[condition] / total * 100)
+                                    for condition in present}
+    return mix
+
 # Recommend based on rental frequency
-def recommend_by_rental_frequency():
-    conn = connect_db()
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT type, COUNT(*) AS rental_count
-        FROM rentals
-        JOIN bicycles ON rentals.bicycle_id = bicycles.id
-        GROUP BY type
-    """)
-    all_types = cursor.fetchall()
-    close_db(conn)
+def recommend_by_rental_frequency(stats=None, show=True):
+    all_types = rental_frequency_by_type(stats)
 
     if all_types:
-        df = pd.DataFrame(all_types, columns=['Type', 'Rental Count'])
-        # Plot rental frequency as a bubble chart
-        unique_types = df['Type'].unique()
-        colors = plt.cm.get_cmap('tab20', len(unique_types))  # Choose a color map
-        color_map = {unique_types[i]: colors(i) for i in range(len(unique_types))}
-        bubble_colors = df['Type'].map(color_map)
-        
-        plt.figure(figsize=(10, 6))
-        plt.scatter(df['Type'], df['Rental Count'], s=df['Rental Count']*10, c=bubble_colors, alpha=0.6, edgecolors="w", linewidth=2)
-        plt.title("Rental Frequency by Bicycle Type")
-        plt.xlabel("Bicycle Type")
-        plt.ylabel("Rental Count")
-        plt.xticks(rotation=45)
-        plt.show()
-        
         highest_rental_type = max(all_types, key=lambda x: x[1])
-        print(f"Recommended Bicycle based on rental frequency: {highest_rental_type[0]}")
+        if show:
+            _plots().plot_rental_frequency(all_types)
+            print(f"Recommended Bicycle based on rental frequency: {highest_rental_type[0]}")
         return [{"Type": highest_rental_type[0], "Rental Count": highest_rental_type[1]}]
     return []
 
 # Recommend based on age (select the oldest bicycle)
-def recommend_by_age():
-    conn = connect_db()
-    cursor = conn.cursor()
-    current_year = datetime.now().year
-    cursor.execute("SELECT id, type, brand, purchase_date FROM bicycles")
-    all_bicycles = cursor.fetchall()
-    close_db(conn)
-
-    bicycles_with_age = []
-    for bike in all_bicycles:
-        purchase_year = int(bike[3][:4]) if bike[3] else current_year
-        age = current_year - purchase_year
-        bicycles_with_age.append((bike[1], age))
+def recommend_by_age(stats=None, show=True):
+    stats = stats or compute_fleet_statistics()
+    bicycles_with_age = age_by_type(stats)
 
     if bicycles_with_age:
-        df = pd.DataFrame(bicycles_with_age, columns=['Type', 'Age'])
-
-        # Plot the age of bicycles
-        plt.figure(figsize=(10, 6))
-        plt.bar(df['Type'], df['Age'], color='cornflowerblue')
-        plt.title("Bicycle Ages by Type")
-        plt.xlabel("Bicycle Type")
-        plt.ylabel("Age")
-        plt.xticks(rotation=45)
-        plt.show()
-
-        oldest_bike = max(bicycles_with_age, key=lambda x: x[1])
-        print(f"Recommended Bicycle based on age: {oldest_bike[0]} ")
-        return [{"Type": oldest_bike[0], "Age": oldest_bike[1]}]
+        if show:
+            _plots().plot_age(bicycles_with_age)
+            print(f"Recommended Bicycle based on age: {stats.oldest_type} ")
+        return [{"Type": stats.oldest_type, "Age": stats.oldest_age}]
     return []
 
 # Recommend based on condition (select the type with highest % of damaged bikes)
-def recommend_by_condition():
-    conn = connect_db()
-    cursor = conn.cursor()
-
-    cursor.execute("""
-        SELECT type, condition, COUNT(*) AS condition_count
-        FROM bicycles
-        WHERE condition IN ('Fair', 'New', 'Good', 'Damaged')
-        GROUP BY type, condition
-        ORDER BY type, condition
-    """)
-    bikes_by_condition = cursor.fetchall()
-    close_db(conn)
-
-    if bikes_by_condition:
-        df = pd.DataFrame(bikes_by_condition, columns=['Type', 'Condition', 'Condition Count'])
-        pivot_df = df.pivot(index='Type', columns='Condition', values='Condition Count').fillna(0)
-
-        # Calculate percentage of damaged bikes
-        pivot_df_percentage = pivot_df.div(pivot_df.sum(axis=1), axis=0) * 100
-        result_df = pivot_df.astype(int).astype(str) + " (" + pivot_df_percentage.round(1).astype(str) + "%)"
-        
-        # Display the result table
-        print(result_df)
-
-        # Plot condition percentages as a stacked bar chart
-        pivot_df_percentage.plot(kind='bar', stacked=True, figsize=(10, 6), colormap='Set3')
-        plt.title("Bicycle Condition Distribution by Type")
-        plt.xlabel("Bicycle Type")
-        plt.ylabel("Percentage")
-        plt.xticks(rotation=45)
-        plt.legend(title='Condition')
-        plt.show()
+def recommend_by_condition(stats=None, show=True):
+    mix = condition_mix_by_type(stats)
 
+    if mix:
         # Find the type with the highest % of damaged bikes
-        highest_damaged_type = pivot_df_percentage['Damaged'].idxmax()
-        print(f"Recommended Bicycle based on condition (highest damaged percentage): {highest_damaged_type} ")
-        return [{"Type": highest_damaged_type, "Damaged Percentage": pivot_df_percentage.loc[highest_damaged_type, 'Damaged']}]
+        damaged = [(bike_type, conditions.get('Damaged', (0, 0.0))[1]) for bike_type, conditions in mix.items()]
+        highest_damaged_type, damaged_percentage = max(damaged, key=lambda x: x[1])
+        if show:
+            _plots().plot_condition_mix(mix)
+            print(f"Recommended Bicycle based on condition (highest damaged percentage): {highest_damaged_type} ")
+        return [{"Type": highest_damaged_type, "Damaged Percentage": damaged_percentage}]
     return []
 
 # Recommend based on type popularity (select the most popular type)
-def recommend_by_type_popularity():
-    conn = connect_db()
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT type, COUNT(*) AS popularity
-        FROM bicycles
-        JOIN rentals ON bicycles.id = rentals.bicycle_id
-        GROUP BY type
-    """)
-    all_types_popularity = cursor.fetchall()
-    close_db(conn)
+def recommend_by_type_popularity(stats=None, show=True):
+    all_types_popularity = rental_frequency_by_type(stats)
 
     if all_types_popularity:
-        df = pd.DataFrame(all_types_popularity, columns=['Type', 'Popularity'])
-
-        # Plot popularity as a horizontal bar chart
-        plt.figure(figsize=(10, 6))
-        plt.barh(df['Type'], df['Popularity'], color='lightcoral', edgecolor='black')
-        plt.title("Bicycle Type Popularity Distribution")
-        plt.xlabel("Popularity (Number of Rentals)")
-        plt.ylabel("Bicycle Type")
-        for i, popularity in enumerate(df['Popularity']):
-            plt.text(popularity, i, str(popularity), va='center', fontsize=10)
-        plt.show()
-
         most_popular_type = max(all_types_popularity, key=lambda x: x[1])
-        print(f"Recommended Bicycle based on popularity: {most_popular_type[0]} ")
+        if show:
+            _plots().plot_type_popularity(all_types_popularity)
+            print(f"Recommended Bicycle based on popularity: {most_popular_type[0]} ")
         return [{"Type": most_popular_type[0], "Popularity": most_popular_type[1]}]
     return []
 
-# Purchase order recommendation based on budget
-def recommend_purchase_order(budget):
-    rental_freq_recs = recommend_by_rental_frequency()
-    age_recs = recommend_by_age()
-    condition_recs = recommend_by_condition()
-    type_popularity_recs = recommend_by_type_popularity()
+# Purchase order recommendation based on budget. With show=False nothing is printed or plotted.
+# Pass `stats` to reuse fleet statistics already gathered
+def recommend_purchase_order(budget, show=True, stats=None):
+    # Gather the fleet statistics once and share them between the four recommendations
+    stats = stats or compute_fleet_statistics()
+    rental_freq_recs = recommend_by_rental_frequency(stats, show)
+    age_recs = recommend_by_age(stats, show)
+    condition_recs = recommend_by_condition(stats, show)
+    type_popularity_recs = recommend_by_type_popularity(stats, show)
 
     # Combine all recommendations
     all_recommendations = rental_freq_recs + age_recs + condition_recs + type_popularity_recs
@@ -176,19 +192,10 @@ def recommend_purchase_order(budget):
     if cost > 0 and cost <= budget:
         units = budget // cost
         recommendations = [{'type': most_common_type, 'units': int(units), 'cost_per_unit': cost, 'total_cost': units * cost}]
-        
-        # Plot the purchase order distribution
-        plt.figure(figsize=(10, 6))
-        plt.barh([rec['type'] for rec in recommendations], [rec['units'] for rec in recommendations], color='cornflowerblue')
-        plt.title(f"Recommended Purchase Order (Budget: £{budget})")
-        plt.xlabel("Bicycle Type")
-        plt.ylabel("Units Recommended")
-        for rec in recommendations:
-            plt.text(rec['units'], rec['type'], f"£{rec['cost_per_unit']}/unit\nTotal: £{rec['total_cost']}", va='center')
-        plt.show()
-        
+        if show:
+            _plots().plot_purchase_order(recommendations, budget)
         return recommendations
-    else:
+    elif show:
         print(f"Recommended Bicycle: {most_common_type}")
         print(f"Cost per unit: £{cost}")
         print("Unfortunately, your budget is too low to purchase this bicycle.")
@@ -196,6 +203,18 @@ def recommend_purchase_order(budget):
 
     return []
 
+# Purchase order spread over several types by weekly demand (see demand.py) instead of spending the whole budget on
+# the type most heuristics vote for. With show=False nothing is printed or plotted
+def recommend_purchase_allocation(budget, show=True):
+    import demand
+    recommendations = demand.allocate_budget(budget, bicycle_costs)
+    if show:
+        if recommendations:
+            _plots().plot_purchase_order(recommendations, budget)
+        else:
+            print("No bicycle type has been in enough demand to recommend buying more.")
+    return recommendations
+
 # Testing the recommendation functions with graphs
 # if __name__ == "__main__":
 #     print("Bicycles recommended based on rental frequency:")
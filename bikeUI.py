@@ -0,0 +1,306 @@
+import io
+import os
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from html import escape
+
+import ipywidgets as widgets
+
+import database
+from database import session, add_change_listener
+import bikeSelect
+
+# Building blocks for the menu.ipynb front end. Images are read from disk once, slow work (searches and
+# purchase recommendations) runs on a background executor so button clicks return straight away and the
+# kernel stays responsive, results are shown as paginated tables, and recommendations (with their charts,
+# rendered off-screen) are reused until bikes or rentals change
+
+HEADER_IMAGE = "images/HYBRID-BIKE-1-500x330.jpg.webp"
+
+# Background threads for searches and recommendations
+UI_WORKERS = 2
+
+# Rows per page of a results table
+TABLE_PAGE_SIZE = 20
+
+# Purchase orders kept per budget until the data changes
+RECOMMENDATION_CACHE_SIZE = 32
+
+# Resolution of the recommendation charts
+CHART_DPI = 80
+
+BICYCLE_COLUMNS = ("ID", "Brand", "Type", "Frame Size", "Rental Rate", "Purchase Date", "Condition", "Status")
+
+IMAGE_FORMATS = {".jpg": "jpeg", ".jpeg": "jpeg", ".png": "png", ".webp": "webp", ".gif": "gif"}
+
+# Static files
+
+@lru_cache(maxsize=32)
+def _read_asset(path, modified, size):
+    with open(path, "rb") as file:
+        return file.read()
+
+# The contents of a static file such as an image, read once and reused until the file changes on disk
+def asset(path):
+    stat = os.stat(path)
+    return _read_asset(path, stat.st_mtime_ns, stat.st_size)
+
+def image_widget(path, width=300, height=100):
+    image_format = IMAGE_FORMATS.get(os.path.splitext(path)[1].lower(), "png")
+    return widgets.Image(value=asset(path), format=image_format, width=width, height=height)
+
+def header_image():
+    return image_widget(HEADER_IMAGE)
+
+# Background work
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def _background():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=UI_WORKERS, thread_name_prefix="bikeUI")
+        return _executor
+
+# A progress bar with a status line underneath; `box` is the widget to display
+Progress = namedtuple("Progress", ["bar", "label", "box"])
+
+def progress_indicator():
+    bar = widgets.IntProgress(value=0, min=0, max=1, layout=widgets.Layout(width='250px', visibility='hidden'))
+    label = widgets.Label(value="")
+    return Progress(bar, label, widgets.VBox([bar, label], layout=widgets.Layout(align_items='center')))
+
+# Run work(report) on the background executor and return its Future at once. work may call
+# report(done, total, message) to move the progress bar. When it finishes, on_done(result) is called on the
+# worker thread (widget updates from there reach the notebook); an error is shown in the status line instead.
+# `buttons` are disabled while it runs, so a second click does not queue the same work again
+def run_in_background(work, progress, on_done, buttons=()):
+    def report(done, total, message=""):
+        progress.bar.max = max(total, 1)
+        progress.bar.value = done
+        progress.label.value = message
+
+    def run():
+        started = time.perf_counter()
+        try:
+            result = work(report)
+            progress.bar.value = progress.bar.max
+            on_done(result)
+            progress.label.value = f"Done in {time.perf_counter() - started:.1f}s"
+        except Exception as e:
+            progress.label.value = f"Error: {e}"
+        finally:
+            progress.bar.layout.visibility = 'hidden'
+            for button in buttons:
+                button.disabled = False
+
+    for button in buttons:
+        button.disabled = True
+    progress.bar.value = 0
+    progress.bar.layout.visibility = 'visible'
+    progress.label.value = "Working..."
+    return _background().submit(run)
+
+# Tables
+
+# Rows as an HTML table, with every value escaped
+def table_html(rows, columns):
+    head = "".join(f"<th style='padding: 2px 8px'>{escape(str(column))}</th>" for column in columns)
+    body = "".join("<tr>" + "".join(f"<td style='padding: 2px 8px'>{escape('' if value is None else str(value))}</td>"
+                                    for value in row) + "</tr>"
+                   for row in rows)
+    return f"<table><thead><tr>{head}</tr></thead><tbody>{body}</tbody></table>"
+
+# A table showing one page of rows at a time, with Previous/Next buttons. fetch_page(after) returns
+# (rows, next_after) like bikeSearch.search_page, with next_after None on the last page; count(), if given,
+# returns the total number of rows. Pages are fetched in the background
+def paged_table(fetch_page, columns, count=None, empty_message="No results."):
+    table = widgets.HTML(value="")
+    previous_button = widgets.Button(description="Previous Page", layout=widgets.Layout(width='150px', height='40px'))
+    next_button = widgets.Button(description="Next Page", layout=widgets.Layout(width='150px', height='40px'))
+    progress = progress_indicator()
+    # starts[i] is the `after` value that fetches page i
+    state = {"starts": [None], "page": 0, "total": None}
+
+    def load(page):
+        def work(report):
+            report(0, 1, f"Loading page {page + 1}...")
+            if state["total"] is None and count is not None:
+                state["total"] = count()
+            return fetch_page(state["starts"][page])
+
+        def show(result):
+            rows, next_after = result
+            state["page"] = page
+            del state["starts"][page + 1:]
+            if next_after is not None:
+                state["starts"].append(next_after)
+            table.value = table_html(rows, columns) if rows else f"<p>{escape(empty_message)}</p>"
+            if rows:
+                pages = f" of {-(-state['total'] // TABLE_PAGE_SIZE)} ({state['total']:,} rows)" if state["total"] else ""
+                table.value += f"<p>Page {page + 1}{pages}</p>"
+
+        def enable_buttons():
+            previous_button.disabled = state["page"] == 0
+            next_button.disabled = len(state["starts"]) <= state["page"] + 1
+
+        future = run_in_background(work, progress, show, (previous_button, next_button))
+        future.add_done_callback(lambda _: enable_buttons())
+
+    previous_button.on_click(lambda b: load(state["page"] - 1))
+    next_button.on_click(lambda b: load(state["page"] + 1))
+    load(0)
+    return widgets.VBox([progress.box, table, widgets.HBox([previous_button, next_button])],
+                        layout=widgets.Layout(align_items='center'))
+
+# Paginated search results for bikeSearch filters
+def bicycle_results(filters, page_size=TABLE_PAGE_SIZE):
+    import bikeSearch
+    return paged_table(lambda after_id: bikeSearch.search_page(after_id, page_size, **filters), BICYCLE_COLUMNS,
+                       lambda: bikeSearch.count_bicycles(**filters), "No bicycles found matching the criteria.")
+
+# A dropdown per bikeSearch facet, offering the values the fleet actually has with how many bikes have each
+# (from bikeSearch.facet_counts), plus '' for any value
+def facet_dropdowns(facets=("type", "brand", "frame_size", "status")):
+    import bikeSearch
+    counts = bikeSearch.facet_counts(facets)
+    return {facet: widgets.Dropdown(
+                options=[("", "")] + [(f"{value} ({bikes})", value) for value, bikes in counts[facet].items()
+                                      if value is not None],
+                description=facet.replace("_", " ").title() + ":",
+                layout=widgets.Layout(width='250px'))
+            for facet in facets}
+
+# Recommendations
+
+# The fleet-wide part of the recommendations, the same for every budget: the four recommendations with
+# their charts (PNG bytes) and the condition table as HTML
+FleetView = namedtuple("FleetView", ["stats", "recommendations", "charts", "condition_table"])
+
+# Everything the recommendations view shows for one budget
+PurchaseView = namedtuple("PurchaseView", ["budget", "order", "order_chart", "fleet", "computed_at"])
+
+# Results are cached until bikes or rentals change: rents, returns and loads in this process invalidate them
+# through the database change listeners, commits from other processes through PRAGMA data_version
+_generation = 0
+_cache_lock = threading.Lock()
+_fleet_views = {}       # (generation, database) -> FleetView
+_purchase_views = {}    # (generation, database, budget) -> PurchaseView
+_local = threading.local()
+
+def clear_recommendation_cache(bike_ids=None):
+    global _generation
+    with _cache_lock:
+        _generation += 1
+        _fleet_views.clear()
+        _purchase_views.clear()
+
+add_change_listener(clear_recommendation_cache)
+
+def _check_data_version():
+    with session() as conn:
+        version = conn.execute("PRAGMA data_version").fetchone()[0]
+    if getattr(_local, "seen", None) != (conn, version):
+        clear_recommendation_cache()
+        _local.seen = (conn, version)
+
+# Draw a bikePlots chart into a PNG without pyplot, which is not safe to use off the main thread
+def chart_png(draw, *args):
+    from matplotlib.figure import Figure
+    figure = Figure(figsize=(10, 6))
+    draw(figure.add_subplot(), *args)
+    figure.tight_layout()
+    buffer = io.BytesIO()
+    figure.savefig(buffer, format="png", dpi=CHART_DPI)
+    return buffer.getvalue()
+
+def _fleet_view(report):
+    import bikePlots
+    report(0, 6, "Gathering fleet statistics...")
+    stats = bikeSelect.compute_fleet_statistics()
+    frequency = bikeSelect.rental_frequency_by_type(stats)
+    mix = bikeSelect.condition_mix_by_type(stats)
+    steps = [
+        ("Rental frequency", bikeSelect.recommend_by_rental_frequency, bikePlots.draw_rental_frequency, frequency),
+        ("Age", bikeSelect.recommend_by_age, bikePlots.draw_age, bikeSelect.age_by_type(stats)),
+        ("Condition", bikeSelect.recommend_by_condition, bikePlots.draw_condition_mix, mix),
+        ("Type popularity", bikeSelect.recommend_by_type_popularity, bikePlots.draw_type_popularity, frequency),
+    ]
+    recommendations, charts = [], []
+    for done, (title, recommend, draw, data) in enumerate(steps, 1):
+        report(done, 6, f"Charting {title.lower()}...")
+        recommendations.append((title, recommend(stats, show=False)))
+        charts.append((title, chart_png(draw, data) if data else None))
+    condition_table = bikePlots.condition_table(mix).to_html() if mix else ""
+    return FleetView(stats, recommendations, charts, condition_table)
+
+# Purchase recommendations for a budget, computed (with progress reported through report(done, total, message))
+# or reused from the cache
+def purchase_recommendations(budget, report=lambda done, total, message="": None):
+    _check_data_version()
+    with _cache_lock:
+        generation = _generation
+        fleet = _fleet_views.get((generation, database.DB_PATH))
+        view = _purchase_views.get((generation, database.DB_PATH, budget))
+    if view is not None:
+        return view
+
+    if fleet is None:
+        fleet = _fleet_view(report)
+    report(5, 6, "Working out the purchase order...")
+    order = bikeSelect.recommend_purchase_order(budget, show=False, stats=fleet.stats)
+    if order:
+        import bikePlots
+        order_chart = chart_png(bikePlots.draw_purchase_order, order, budget)
+    else:
+        order_chart = None
+    view = PurchaseView(budget, order, order_chart, fleet, time.strftime("%H:%M:%S"))
+
+    with _cache_lock:
+        # Results computed from data that has changed since are returned but not kept
+        if generation == _generation:
+            _fleet_views[(generation, database.DB_PATH)] = fleet
+            if len(_purchase_views) >= RECOMMENDATION_CACHE_SIZE:
+                _purchase_views.pop(next(iter(_purchase_views)))
+            _purchase_views[(generation, database.DB_PATH, budget)] = view
+    return view
+
+def _chart_widget(png):
+    return widgets.Image(value=png, format="png", layout=widgets.Layout(width='600px'))
+
+# The widgets showing a PurchaseView: the purchase order, the four recommendations with their charts and the
+# condition table
+def recommendation_widgets(view):
+    if view.order:
+        lines = [f"<h3>Purchase Recommendations (Budget: £{view.budget:.2f})</h3>"]
+        lines += [f"<p>{rec['units']} units of {escape(rec['type'])} - £{rec['cost_per_unit']}/unit "
+                  f"(Total: £{rec['total_cost']})</p>" for rec in view.order]
+    else:
+        lines = ["<p>Current budget is too low.</p>"]
+    lines.append("<p>Note: Recommendations are based on factors such as rental frequency, condition, age, and "
+                 f"popularity. Computed at {view.computed_at}.</p>")
+    children = [widgets.HTML("".join(lines))]
+    if view.order_chart:
+        children.append(_chart_widget(view.order_chart))
+
+    for (title, recommendation), (_, png) in zip(view.fleet.recommendations, view.fleet.charts):
+        if recommendation:
+            details = ", ".join(f"{key}: {value:.1f}" if isinstance(value, float) else f"{key}: {value}"
+                                for key, value in recommendation[0].items())
+            children.append(widgets.HTML(f"<h4>Based on {escape(title.lower())}</h4><p>{escape(details)}</p>"))
+        if png:
+            children.append(_chart_widget(png))
+        if title == "Condition" and view.fleet.condition_table:
+            children.append(widgets.HTML(view.fleet.condition_table))
+    return children
+
+# Compute the recommendations for a budget in the background and show them in `container` (a Box) when ready
+def show_recommendations(budget, container, progress, buttons=()):
+    def show(view):
+        container.children = recommendation_widgets(view)
+    return run_in_background(lambda report: purchase_recommendations(budget, report), progress, show, buttons)
@@ -1,20 +1,197 @@
 import sqlite3
-from datetime import datetime
+from datetime import date, datetime
+from functools import lru_cache
+import hashlib
+import os
+import random
+import time
 
-import sqlite3
-from datetime import datetime
+import threading
+from contextlib import contextmanager
+
+# Location of the database file, can be changed before the first connection is made
+DB_PATH = "BicycleRental.db"
+
+# Set to False to fall back to one short-lived connection per call (the old behaviour)
+USE_POOL = True
+
+# Seconds a connection waits for another process's write lock before giving up with "database is locked"
+BUSY_TIMEOUT = 10.0
+
+# How many times write_transaction() retries after "database is locked", and its first backoff delay in seconds
+LOCK_RETRIES = 5
+LOCK_BACKOFF = 0.02
+
+# Class of every connection we open; instrumentation.enable() swaps in a profiling subclass
+CONNECTION_FACTORY = sqlite3.Connection
+
+# Pragmas applied to every connection we open
+PRAGMAS = {
+    "journal_mode": "WAL",          # readers and the writer no longer block each other
+    "synchronous": "NORMAL",        # safe with WAL and saves an fsync per commit
+    "cache_size": -16000,           # 16 MB page cache per connection
+    "mmap_size": 268435456,         # map up to 256 MB of the file into memory
+    "temp_store": "MEMORY",
+}
+
+# Pooled connections, one per thread, kept open between calls
+_local = threading.local()
+_pool = []
+_pool_lock = threading.Lock()
+_pool_generation = 0
 
 # Step 1: Database connection and disconnection functions
+def _apply_pragmas(conn):
+    for name, value in PRAGMAS.items():
+        conn.execute(f"PRAGMA {name} = {value}")
+
 def connect_db():
-    return sqlite3.connect("BicycleRental.db")
+    conn = sqlite3.connect(DB_PATH, timeout=BUSY_TIMEOUT, factory=CONNECTION_FACTORY)
+    _apply_pragmas(conn)
+    return conn
 
 def close_db(conn):
     conn.close()
 
+# Get the long-lived connection for the current thread, opening it on first use
+def get_connection():
+    conn = getattr(_local, "conn", None)
+    if conn is not None and _local.path == DB_PATH and _local.generation == _pool_generation:
+        return conn
+    # Transactions are started explicitly in session(), so run the connection in autocommit mode
+    conn = sqlite3.connect(DB_PATH, timeout=BUSY_TIMEOUT, isolation_level=None, check_same_thread=False,
+                           factory=CONNECTION_FACTORY)
+    _apply_pragmas(conn)
+    _ensure_schema(conn)
+    with _pool_lock:
+        _pool.append(conn)
+        _local.generation = _pool_generation
+    _local.conn = conn
+    _local.path = DB_PATH
+    return conn
+
+# Create missing tables and apply pending migrations the first time a database is opened
+def _ensure_schema(conn):
+    if conn.execute("PRAGMA user_version").fetchone()[0] >= len(MIGRATIONS):
+        return
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        _create_tables(conn)
+        migrate(conn)
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+# Close every pooled connection (e.g. before switching DB_PATH or at shutdown)
+def close_pool():
+    global _pool_generation
+    with _pool_lock:
+        while _pool:
+            _pool.pop().close()
+        # Connections cached by other threads are now stale and will be reopened on next use
+        _pool_generation += 1
+
+# Run a block of work in one transaction on the pooled connection:
+# commits when the block finishes, rolls back if it raises. Nested sessions share the outer transaction.
+# immediate=True takes the write lock up front (BEGIN IMMEDIATE) so what is read cannot change before it is written
+@contextmanager
+def session(immediate=False):
+    if not USE_POOL:
+        conn = sqlite3.connect(DB_PATH, timeout=BUSY_TIMEOUT, isolation_level=None, factory=CONNECTION_FACTORY)
+    else:
+        conn = get_connection()
+        if conn.in_transaction:
+            # Already inside a session on this thread, so join its transaction
+            yield conn
+            return
+    conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+    _local.changed_bikes = set()
+    try:
+        yield conn
+    except BaseException:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    else:
+        conn.execute("COMMIT")
+        _notify_bicycles_changed()
+    finally:
+        _local.changed_bikes = None
+        if not USE_POOL:
+            conn.close()
+
+# Run work(conn) in an immediate write transaction and return its result. If another process holds
+# the lock for longer than BUSY_TIMEOUT the whole transaction is retried with exponential backoff
+def write_transaction(work):
+    for attempt in range(LOCK_RETRIES + 1):
+        try:
+            with session(immediate=True) as conn:
+                return work(conn)
+        except sqlite3.OperationalError as e:
+            if "locked" not in str(e) or attempt == LOCK_RETRIES:
+                raise
+            time.sleep(LOCK_BACKOFF * 2 ** attempt * random.uniform(0.5, 1.5))
+
+# Functions called with the set of changed bike IDs (or None for "possibly all of them") after a commit
+# that changed bicycles, e.g. to invalidate caches
+_change_listeners = []
+
+def add_change_listener(listener):
+    _change_listeners.append(listener)
+
+def remove_change_listener(listener):
+    if listener in _change_listeners:
+        _change_listeners.remove(listener)
+
+# Record inside a session that bikes were changed; listeners hear about it once the transaction commits,
+# and never if it rolls back. Pass no IDs when the change is too broad to list (e.g. a bulk load)
+def mark_bicycles_changed(bike_ids=None):
+    changed = getattr(_local, "changed_bikes", None)
+    if changed is None:
+        # Outside a session there is nothing to wait for
+        _local.changed_bikes = {None} if bike_ids is None else set(bike_ids)
+        _notify_bicycles_changed()
+        _local.changed_bikes = None
+    elif bike_ids is None:
+        changed.add(None)
+    else:
+        changed.update(bike_ids)
+
+def _notify_bicycles_changed():
+    changed = _local.changed_bikes
+    if not changed:
+        return
+    bike_ids = None if None in changed else changed
+    for listener in list(_change_listeners):
+        listener(bike_ids)
+
+# Largest number of values bound into one "IN (...)" list
+IN_CHUNK_SIZE = 500
+
+def _in_chunks(statement, values, chunk_size):
+    values = list(values)
+    for start in range(0, len(values), chunk_size):
+        chunk = values[start:start + chunk_size]
+        yield statement.format(", ".join("?" * len(chunk))), chunk
+
+# Run a query whose "{}" placeholder is an IN list over `values`, in chunks, yielding every result row
+def select_in(conn, query, values, chunk_size=IN_CHUNK_SIZE):
+    for sql, chunk in _in_chunks(query, values, chunk_size):
+        yield from conn.execute(sql, chunk)
+
+# Run an UPDATE/DELETE whose "{}" placeholder is an IN list over `values`, returning the number of rows changed
+def execute_in(conn, statement, values, chunk_size=IN_CHUNK_SIZE):
+    return sum(conn.execute(sql, chunk).rowcount for sql, chunk in _in_chunks(statement, values, chunk_size))
+
 
 # Step 2: Table creation function
 def create_tables():
-    conn = connect_db()
+    with session() as conn:
+        _create_tables(conn)
+        migrate(conn)
+
+def _create_tables(conn):
     cursor = conn.cursor()
     # Create bicycles table
     cursor.execute('''CREATE TABLE IF NOT EXISTS bicycles (
@@ -39,62 +216,531 @@ def create_tables():
                         damage_details TEXT,
                         FOREIGN KEY (bicycle_id) REFERENCES bicycles (id)
                     )''')
-    conn.commit()
-    close_db(conn)
+    # Create ingest ledger, recording how far into each feed file we have loaded
+    cursor.execute('''CREATE TABLE IF NOT EXISTS ingest_ledger (
+                        path TEXT PRIMARY KEY,
+                        table_name TEXT,
+                        byte_offset INTEGER,
+                        lines INTEGER,
+                        fingerprint TEXT,
+                        loaded_at TEXT
+                    )''')
+
+
+# Ledger entries for databases loaded before the ingest ledger existed, which would otherwise load every feed again
+# and duplicate all rentals: each default feed whose table already has rows is recorded as loaded in full.
+# Entries written with absolute paths are moved to the relative keys
+def _seed_ingest_ledger(conn):
+    for (path,) in conn.execute("SELECT path FROM ingest_ledger").fetchall():
+        if os.path.isabs(path) and _ledger_key(path) != path:
+            conn.execute("UPDATE OR REPLACE ingest_ledger SET path = ? WHERE path = ?", (_ledger_key(path), path))
+    for path, kind in ((BICYCLE_FEED, "bicycles"), (RENTAL_FEED, "rentals")):
+        path = os.path.join(os.path.dirname(DB_PATH), path)
+        if (not os.path.isfile(path) or conn.execute(f"SELECT 1 FROM {kind} LIMIT 1").fetchone() is None
+                or conn.execute("SELECT 1 FROM ingest_ledger WHERE path = ?", (_ledger_key(path),)).fetchone()):
+            continue
+        with open(path, "rb") as file:
+            data = file.read()
+        update_ledger(conn, path, kind, len(data), data.count(b"\n") + (not data.endswith(b"\n") and len(data) > 0))
+
+# Fill the numeric rate columns from the rental_rate text of every bike that does not have them yet
+def _backfill_rental_rates(conn):
+    rows = conn.execute("SELECT id, rental_rate FROM bicycles WHERE daily_rate IS NULL AND weekly_rate IS NULL").fetchall()
+    conn.executemany("UPDATE bicycles SET daily_rate = ?, weekly_rate = ? WHERE id = ?",
+                     (parse_rental_rate(rate) + (bike_id,) for bike_id, rate in rows))
 
+# Schema migrations applied on top of the tables above, in order. PRAGMA user_version
+# records how many have been applied, so only ever append new entries to this list.
+# Each entry is a list of SQL statements or functions taking the connection. An entry is never changed once it
+# has shipped, so each spells out its own SQL rather than using the current schema of the modules it serves: an old
+# database is upgraded through exactly the steps a new one went through
+MIGRATIONS = [
+    # 1: indexes for the open-rental checks in rent_bike/return_bike and for bikeSearch
+    [
+        "CREATE INDEX IF NOT EXISTS idx_rentals_open_bicycle ON rentals (bicycle_id) WHERE return_date IS NULL",
+        "CREATE INDEX IF NOT EXISTS idx_rentals_open_member ON rentals (member_id) WHERE return_date IS NULL",
+        "CREATE INDEX IF NOT EXISTS idx_bicycles_search ON bicycles (type, brand, frame_size, status)",
+        "ANALYZE",
+    ],
+    # 2: optional members table, used by membershipManager when MEMBERSHIP_SOURCE is "db"
+    [
+        '''CREATE TABLE IF NOT EXISTS members (
+               id INTEGER PRIMARY KEY,
+               active INTEGER,
+               rental_limit INTEGER,
+               membership_end_date TEXT
+           )''',
+    ],
+    # 3: materialized fleet statistics maintained by triggers (see fleetStats.py)
+    [
+        '''CREATE TABLE IF NOT EXISTS type_daily_rentals (
+               type TEXT,
+               day TEXT,
+               rentals INTEGER,
+               PRIMARY KEY (type, day)
+           ) WITHOUT ROWID''',
+        '''CREATE TABLE IF NOT EXISTS type_condition_counts (
+               type TEXT,
+               condition TEXT,
+               purchase_year TEXT,
+               bikes INTEGER,
+               PRIMARY KEY (type, condition, purchase_year)
+           ) WITHOUT ROWID''',
+        '''CREATE TABLE IF NOT EXISTS member_active_rentals (
+               member_id INTEGER PRIMARY KEY,
+               active_rentals INTEGER
+           ) WITHOUT ROWID''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_rentals_insert_stats AFTER INSERT ON rentals
+           BEGIN
+               INSERT INTO type_daily_rentals (type, day, rentals)
+                   SELECT COALESCE(type, ''), COALESCE(NEW.rental_date, ''), 1 FROM bicycles WHERE id = NEW.bicycle_id
+                   ON CONFLICT (type, day) DO UPDATE SET rentals = rentals + 1;
+               INSERT INTO member_active_rentals (member_id, active_rentals)
+                   SELECT NEW.member_id, 1 WHERE NEW.member_id IS NOT NULL AND NEW.return_date IS NULL
+                   ON CONFLICT (member_id) DO UPDATE SET active_rentals = active_rentals + 1;
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_rentals_update_stats AFTER UPDATE OF return_date, member_id ON rentals
+           WHEN (OLD.return_date IS NULL) != (NEW.return_date IS NULL) OR OLD.member_id IS NOT NEW.member_id
+           BEGIN
+               UPDATE member_active_rentals SET active_rentals = active_rentals - 1
+                   WHERE member_id = OLD.member_id AND OLD.return_date IS NULL;
+               INSERT INTO member_active_rentals (member_id, active_rentals)
+                   SELECT NEW.member_id, 1 WHERE NEW.member_id IS NOT NULL AND NEW.return_date IS NULL
+                   ON CONFLICT (member_id) DO UPDATE SET active_rentals = active_rentals + 1;
+               DELETE FROM member_active_rentals WHERE member_id = OLD.member_id AND active_rentals <= 0;
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_rentals_delete_stats AFTER DELETE ON rentals
+           WHEN OLD.return_date IS NULL
+           BEGIN
+               UPDATE member_active_rentals SET active_rentals = active_rentals - 1 WHERE member_id = OLD.member_id;
+               DELETE FROM member_active_rentals WHERE member_id = OLD.member_id AND active_rentals <= 0;
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_bicycles_insert_stats AFTER INSERT ON bicycles
+           BEGIN
+               INSERT INTO type_condition_counts (type, condition, purchase_year, bikes)
+                   VALUES (COALESCE(NEW.type, ''), COALESCE(NEW.condition, ''), COALESCE(substr(NEW.purchase_date, 1, 4), ''), 1)
+                   ON CONFLICT (type, condition, purchase_year) DO UPDATE SET bikes = bikes + 1;
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_bicycles_update_stats AFTER UPDATE OF type, condition, purchase_date ON bicycles
+           WHEN OLD.type IS NOT NEW.type OR OLD.condition IS NOT NEW.condition
+                OR substr(OLD.purchase_date, 1, 4) IS NOT substr(NEW.purchase_date, 1, 4)
+           BEGIN
+               UPDATE type_condition_counts SET bikes = bikes - 1
+                   WHERE type = COALESCE(OLD.type, '') AND condition = COALESCE(OLD.condition, '')
+                     AND purchase_year = COALESCE(substr(OLD.purchase_date, 1, 4), '');
+               INSERT INTO type_condition_counts (type, condition, purchase_year, bikes)
+                   VALUES (COALESCE(NEW.type, ''), COALESCE(NEW.condition, ''), COALESCE(substr(NEW.purchase_date, 1, 4), ''), 1)
+                   ON CONFLICT (type, condition, purchase_year) DO UPDATE SET bikes = bikes + 1;
+               DELETE FROM type_condition_counts WHERE bikes <= 0;
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_bicycles_delete_stats AFTER DELETE ON bicycles
+           BEGIN
+               UPDATE type_condition_counts SET bikes = bikes - 1
+                   WHERE type = COALESCE(OLD.type, '') AND condition = COALESCE(OLD.condition, '')
+                     AND purchase_year = COALESCE(substr(OLD.purchase_date, 1, 4), '');
+               DELETE FROM type_condition_counts WHERE bikes <= 0;
+           END''',
+        # Fill the summaries from the existing bikes and rentals
+        """INSERT INTO type_daily_rentals (type, day, rentals)
+            SELECT COALESCE(bicycles.type, ''), COALESCE(rentals.rental_date, ''), COUNT(*)
+            FROM rentals JOIN bicycles ON bicycles.id = rentals.bicycle_id
+            GROUP BY 1, 2""",
+        """INSERT INTO type_condition_counts (type, condition, purchase_year, bikes)
+            SELECT COALESCE(type, ''), COALESCE(condition, ''), COALESCE(substr(purchase_date, 1, 4), ''), COUNT(*)
+            FROM bicycles
+            GROUP BY 1, 2, 3""",
+        """INSERT INTO member_active_rentals (member_id, active_rentals)
+            SELECT member_id, COUNT(*)
+            FROM rentals WHERE return_date IS NULL AND member_id IS NOT NULL
+            GROUP BY member_id""",
+    ],
+    # 4: bikeSearch facet counts table (see fleetStats.py), and single-column indexes, which keep bicycles ordered
+    #    by id within each value, so search pages filtered on one column are read straight from the index
+    [
+        '''CREATE TABLE IF NOT EXISTS bicycle_facets (
+               type TEXT,
+               brand TEXT,
+               frame_size TEXT,
+               status TEXT,
+               condition TEXT,
+               bikes INTEGER,
+               PRIMARY KEY (type, brand, frame_size, status, condition)
+           ) WITHOUT ROWID''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_bicycles_insert_facets AFTER INSERT ON bicycles
+           BEGIN
+               INSERT INTO bicycle_facets (type, brand, frame_size, status, condition, bikes)
+                   VALUES (COALESCE(NEW.type, ''), COALESCE(NEW.brand, ''), COALESCE(NEW.frame_size, ''),
+                           COALESCE(NEW.status, ''), COALESCE(NEW.condition, ''), 1)
+                   ON CONFLICT (type, brand, frame_size, status, condition) DO UPDATE SET bikes = bikes + 1;
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_bicycles_update_facets AFTER UPDATE OF type, brand, frame_size, status, condition ON bicycles
+           WHEN OLD.type IS NOT NEW.type OR OLD.brand IS NOT NEW.brand OR OLD.frame_size IS NOT NEW.frame_size
+                OR OLD.status IS NOT NEW.status OR OLD.condition IS NOT NEW.condition
+           BEGIN
+               UPDATE bicycle_facets SET bikes = bikes - 1
+                   WHERE type = COALESCE(OLD.type, '') AND brand = COALESCE(OLD.brand, '')
+                     AND frame_size = COALESCE(OLD.frame_size, '') AND status = COALESCE(OLD.status, '')
+                     AND condition = COALESCE(OLD.condition, '');
+               INSERT INTO bicycle_facets (type, brand, frame_size, status, condition, bikes)
+                   VALUES (COALESCE(NEW.type, ''), COALESCE(NEW.brand, ''), COALESCE(NEW.frame_size, ''),
+                           COALESCE(NEW.status, ''), COALESCE(NEW.condition, ''), 1)
+                   ON CONFLICT (type, brand, frame_size, status, condition) DO UPDATE SET bikes = bikes + 1;
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_bicycles_delete_facets AFTER DELETE ON bicycles
+           BEGIN
+               UPDATE bicycle_facets SET bikes = bikes - 1
+                   WHERE type = COALESCE(OLD.type, '') AND brand = COALESCE(OLD.brand, '')
+                     AND frame_size = COALESCE(OLD.frame_size, '') AND status = COALESCE(OLD.status, '')
+                     AND condition = COALESCE(OLD.condition, '');
+           END''',
+        """INSERT INTO bicycle_facets (type, brand, frame_size, status, condition, bikes)
+            SELECT COALESCE(type, ''), COALESCE(brand, ''), COALESCE(frame_size, ''), COALESCE(status, ''),
+                   COALESCE(condition, ''), COUNT(*)
+            FROM bicycles
+            GROUP BY 1, 2, 3, 4, 5""",
+        "CREATE INDEX IF NOT EXISTS idx_bicycles_type ON bicycles (type)",
+        "CREATE INDEX IF NOT EXISTS idx_bicycles_brand ON bicycles (brand)",
+        "CREATE INDEX IF NOT EXISTS idx_bicycles_frame_size ON bicycles (frame_size)",
+        "CREATE INDEX IF NOT EXISTS idx_bicycles_status ON bicycles (status)",
+        "ANALYZE",
+    ],
+    # 5: rental rates as numbers, parsed once at load time instead of on every return
+    [
+        "ALTER TABLE bicycles ADD COLUMN daily_rate REAL",
+        "ALTER TABLE bicycles ADD COLUMN weekly_rate REAL",
+        _backfill_rental_rates,
+    ],
+    # 6: open rentals by expected return date, for the overdue scan in overdue.py
+    [
+        "CREATE INDEX IF NOT EXISTS idx_rentals_open_expected ON rentals (expected_return_date) WHERE return_date IS NULL",
+    ],
+    # 7: weekly demand per type (see demand.py), and rentals by return date, so its incremental update and
+    #    late_fees_between only read the rentals returned in the period they look at
+    [
+        "CREATE INDEX IF NOT EXISTS idx_rentals_return_date ON rentals (return_date)",
+        '''CREATE TABLE IF NOT EXISTS type_weekly_demand (
+               type TEXT,
+               week TEXT,
+               rentals INTEGER,
+               rental_days INTEGER,
+               peak INTEGER,
+               PRIMARY KEY (type, week)
+           ) WITHOUT ROWID''',
+        '''CREATE TABLE IF NOT EXISTS demand_state (
+               id INTEGER PRIMARY KEY CHECK (id = 1),
+               processed_week TEXT,
+               last_rental_id INTEGER
+           )''',
+    ],
+    # 8: summaries of the rentals moved out to the archive (see archive.py and fleetStats.py), empty until then
+    [
+        '''CREATE TABLE IF NOT EXISTS archived_daily_rentals (
+               type TEXT,
+               day TEXT,
+               rentals INTEGER,
+               PRIMARY KEY (type, day)
+           ) WITHOUT ROWID''',
+        '''CREATE TABLE IF NOT EXISTS archived_bike_rentals (
+               bicycle_id INTEGER PRIMARY KEY,
+               rentals INTEGER
+           ) WITHOUT ROWID''',
+    ],
+    # 9: append-only log of rentals, returns and status and condition changes, written by triggers (see events.py)
+    [
+        '''CREATE TABLE IF NOT EXISTS rental_events (
+               id INTEGER PRIMARY KEY AUTOINCREMENT,
+               recorded_at TEXT,
+               kind TEXT,
+               bicycle_id INTEGER,
+               rental_id INTEGER,
+               member_id INTEGER,
+               old_value TEXT,
+               new_value TEXT,
+               details TEXT
+           )''',
+        '''CREATE INDEX IF NOT EXISTS idx_rental_events_bicycle ON rental_events (bicycle_id, id)''',
+        '''CREATE TABLE IF NOT EXISTS event_cursors (
+               consumer TEXT PRIMARY KEY,
+               last_event_id INTEGER,
+               updated_at TEXT
+           )''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_rentals_insert_event AFTER INSERT ON rentals
+           WHEN NEW.return_date IS NULL
+           BEGIN
+               INSERT INTO rental_events (recorded_at, kind, bicycle_id, rental_id, member_id, details)
+                   VALUES (strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime'), 'rent', NEW.bicycle_id, NEW.id, NEW.member_id,
+                           json_object('rental_date', NEW.rental_date, 'expected_return_date', NEW.expected_return_date));
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_rentals_return_event AFTER UPDATE OF return_date ON rentals
+           WHEN OLD.return_date IS NULL AND NEW.return_date IS NOT NULL
+           BEGIN
+               INSERT INTO rental_events (recorded_at, kind, bicycle_id, rental_id, member_id, details)
+                   VALUES (strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime'), 'return', NEW.bicycle_id, NEW.id, NEW.member_id,
+                           json_object('return_date', NEW.return_date, 'fees', NEW.fees));
+               INSERT INTO rental_events (recorded_at, kind, bicycle_id, rental_id, member_id, details)
+                   SELECT strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime'), 'damage', NEW.bicycle_id, NEW.id, NEW.member_id,
+                          json_object('damage_details', NEW.damage_details, 'fees', NEW.fees)
+                   WHERE NEW.damage_details IS NOT NULL;
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_bicycles_status_event AFTER UPDATE OF status ON bicycles
+           WHEN OLD.status IS NOT NEW.status
+           BEGIN
+               INSERT INTO rental_events (recorded_at, kind, bicycle_id, old_value, new_value)
+                   VALUES (strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime'), 'status', NEW.id, OLD.status, NEW.status);
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_bicycles_condition_event AFTER UPDATE OF condition ON bicycles
+           WHEN OLD.condition IS NOT NEW.condition
+           BEGIN
+               INSERT INTO rental_events (recorded_at, kind, bicycle_id, old_value, new_value)
+                   VALUES (strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime'), 'condition', NEW.id, OLD.condition, NEW.condition);
+           END''',
+    ],
+    # 10: ledger entries for the feeds of databases loaded before the ledger, and ledger paths relative to the database
+    [
+        _seed_ingest_ledger,
+    ],
+    # 11: flags that bulk loads set to switch off the per-row rentals triggers (see fleetStats.deferred_rental_stats
+    #     and events.bulk_load), instead of dropping and recreating the triggers, which changed the schema every load
+    [
+        '''CREATE TABLE IF NOT EXISTS ingest_state (
+               id INTEGER PRIMARY KEY CHECK (id = 1),
+               defer_stats INTEGER NOT NULL DEFAULT 0,
+               defer_events INTEGER NOT NULL DEFAULT 0
+           )''',
+        "INSERT OR IGNORE INTO ingest_state (id) VALUES (1)",
+        "DROP TRIGGER IF EXISTS trg_rentals_insert_stats",
+        '''CREATE TRIGGER IF NOT EXISTS trg_rentals_insert_stats AFTER INSERT ON rentals
+           WHEN (SELECT defer_stats FROM ingest_state) = 0
+           BEGIN
+               INSERT INTO type_daily_rentals (type, day, rentals)
+                   SELECT COALESCE(type, ''), COALESCE(NEW.rental_date, ''), 1 FROM bicycles WHERE id = NEW.bicycle_id
+                   ON CONFLICT (type, day) DO UPDATE SET rentals = rentals + 1;
+               INSERT INTO member_active_rentals (member_id, active_rentals)
+                   SELECT NEW.member_id, 1 WHERE NEW.member_id IS NOT NULL AND NEW.return_date IS NULL
+                   ON CONFLICT (member_id) DO UPDATE SET active_rentals = active_rentals + 1;
+           END''',
+        "DROP TRIGGER IF EXISTS trg_rentals_insert_event",
+        '''CREATE TRIGGER IF NOT EXISTS trg_rentals_insert_event AFTER INSERT ON rentals
+           WHEN NEW.return_date IS NULL AND (SELECT defer_events FROM ingest_state) = 0
+           BEGIN
+               INSERT INTO rental_events (recorded_at, kind, bicycle_id, rental_id, member_id, details)
+                   VALUES (strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime'), 'rent', NEW.bicycle_id, NEW.id, NEW.member_id,
+                           json_object('rental_date', NEW.rental_date, 'expected_return_date', NEW.expected_return_date));
+           END''',
+    ],
+    # 12: the date before which rentals have been archived, so demand.py keeps the weekly demand of earlier weeks
+    [
+        "ALTER TABLE demand_state ADD COLUMN archived_before TEXT",
+    ],
+]
+
+# Bring the schema up to date, returning the number of migrations applied
+def migrate(conn):
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for number, steps in enumerate(MIGRATIONS[version:], version + 1):
+        for step in steps:
+            if callable(step):
+                step(conn)
+            else:
+                conn.execute(step)
+        conn.execute(f"PRAGMA user_version = {number}")
+    return len(MIGRATIONS) - min(version, len(MIGRATIONS))
+
+# The queries on the rent/return/search paths, with sample parameters, that must be answered from an index
+HOT_QUERIES = {
+    "rent: open rentals per member": (
+        "SELECT COUNT(*) FROM rentals WHERE member_id = ? AND return_date IS NULL", ("1001",)),
+    "rent: bicycle status": (
+        "SELECT status FROM bicycles WHERE id = ?", (1,)),
+    "return: open rental for bicycle": (
+        """SELECT rentals.rental_date, bicycles.rental_rate, bicycles.condition
+           FROM rentals
+           JOIN bicycles ON rentals.bicycle_id = bicycles.id
+           WHERE rentals.bicycle_id = ? AND rentals.return_date IS NULL""", (1,)),
+    "search: by type and frame size": (
+        "SELECT id, brand, type, frame_size, rental_rate, purchase_date, condition, status FROM bicycles "
+        "WHERE type = ? AND frame_size = ? ORDER BY id", ("Hybrid Bike", "Medium")),
+    "overdue: next chunk of open rentals": (
+        """SELECT id FROM rentals
+           WHERE return_date IS NULL AND expected_return_date < ? AND (expected_return_date, id) > (?, ?)
+           ORDER BY expected_return_date, id LIMIT ?""", ("2024-01-01", "", 0, 10000)),
+    "demand: rentals returned since a week": (
+        "SELECT bicycle_id, rental_date, return_date FROM rentals WHERE return_date >= ?", ("2024-01-01",)),
+    "archive: next batch of closed rentals": (
+        "SELECT id FROM rentals WHERE return_date < ? ORDER BY return_date LIMIT ?", ("2020-01-01", 10000)),
+    "search: page of one type": (
+        "SELECT id, brand, type, frame_size, rental_rate, purchase_date, condition, status FROM bicycles "
+        "WHERE type = ? AND id > ? ORDER BY id LIMIT ?", ("Hybrid Bike", 0, 51)),
+    "events: next page of the change feed": (
+        """SELECT id, kind, bicycle_id FROM rental_events WHERE id > ? AND id <= ? ORDER BY id LIMIT ?""", (0, 1000, 1000)),
+    "events: history of one bicycle": (
+        "SELECT id, kind FROM rental_events WHERE id > ? AND bicycle_id = ? ORDER BY id LIMIT ?", (0, 1, 1000)),
+}
+
+# Get the EXPLAIN QUERY PLAN lines for a query
+def explain_query_plan(conn, query, parameters=()):
+    return [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + query, parameters)]
+
+# Check every hot query is answered without a full table scan; returns {name: plan} for the ones that are not
+def check_query_plans():
+    failures = {}
+    with session() as conn:
+        for name, (query, parameters) in HOT_QUERIES.items():
+            plan = explain_query_plan(conn, query, parameters)
+            if any(line.startswith("SCAN") for line in plan):
+                failures[name] = plan
+    return failures
 
 # Step 3: Data loading and cleaning function
-def load_and_clean_data():
-    conn = connect_db()
-    cursor = conn.cursor()
+# Number of rows parsed and written per executemany batch
+INGEST_BATCH_SIZE = 5000
 
-    # Load Bicycle_Info.txt
-    with open("Bicycle_Info.txt", "r") as bike_file:
-        for line in bike_file:
-            fields = line.strip().split("|")  # Assuming fields are seperated by |
+# Only the first few rejected lines are kept in a report, the rest are just counted
+MAX_REPORTED_REJECTS = 1000
 
-            # Extract each field and clean data
-            try:
-                bike_id = int(fields[0])
-                brand = fields[1].strip() if fields[1].strip() else "Unknown"
-                bike_type = fields[2].strip() if fields[2].strip() else "Unknown"
-                frame_size = fields[3].strip() if fields[3].strip() else "Unknown"
-                rental_rate = clean_rental_rate(fields[4]) if fields[4] else "0/day"
-                purchase_date = clean_date(fields[5].strip())
-                condition = fields[6].strip() if fields[6].strip() else "Good"
-                status = fields[7].strip() if fields[7].strip() else "Available"
-
-                # Insert into bicycles table
-                cursor.execute('''INSERT OR IGNORE INTO bicycles (id, brand, type, frame_size, rental_rate, purchase_date, condition, status)
-                                  VALUES (?, ?, ?, ?, ?, ?, ?, ?)''', 
-                               (bike_id, brand, bike_type, frame_size, rental_rate, purchase_date, condition, status))
+# Parse a Bicycle_Info.txt line into a row for the bicycles table
+def parse_bicycle_line(line):
+    fields = line.strip().split("|")  # Assuming fields are seperated by |
+    bike_id = int(fields[0])
+    brand = fields[1].strip() if fields[1].strip() else "Unknown"
+    bike_type = fields[2].strip() if fields[2].strip() else "Unknown"
+    frame_size = fields[3].strip() if fields[3].strip() else "Unknown"
+    rental_rate = clean_rental_rate(fields[4]) if fields[4] else "0/day"
+    purchase_date = normalise_date(fields[5].strip())
+    condition = fields[6].strip() if fields[6].strip() else "Good"
+    status = fields[7].strip() if fields[7].strip() else "Available"
+    return (bike_id, brand, bike_type, frame_size, rental_rate, purchase_date, condition, status) + parse_rental_rate(rental_rate)
 
-            except (IndexError, ValueError) as e:
-                print(f"Error in Bicycle_Info.txt - Skipping line: {line}, Error: {e}")
+# Parse a Rental_History.txt line into a row for the rentals table
+def parse_rental_line(line):
+    fields = line.strip().split("|")
+    bicycle_id = int(fields[0])
+    rental_date = normalise_date(fields[1].strip())
+    return_date = normalise_date(fields[2].strip())
+    member_id = _parse_member_id(fields[3].strip())
+    return (bicycle_id, rental_date, return_date, member_id)
+
+# The feed files load_and_clean_data reads by default
+BICYCLE_FEED = "Bicycle_Info.txt"
+RENTAL_FEED = "Rental_History.txt"
 
-    # Load Rental_History.txt
-    with open("Rental_History.txt", "r") as rental_file:
-        for line in rental_file:
-            fields = line.strip().split("|")
+# How each kind of feed is parsed and stored
+FEEDS = {
+    "bicycles": (parse_bicycle_line,
+                 '''INSERT OR IGNORE INTO bicycles (id, brand, type, frame_size, rental_rate, purchase_date, condition, status,
+                                                daily_rate, weekly_rate)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'''),
+    "rentals": (parse_rental_line,
+                '''INSERT INTO rentals (bicycle_id, rental_date, return_date, member_id)
+                   VALUES (?, ?, ?, ?)'''),
+}
 
-            # Extract each field and clean data
+# Read a feed file lazily from byte `offset`, yielding (rows, rejects, end_offset) chunks of at most batch_size rows.
+# With complete_lines_only a last line without a newline is left for the next run, as it may still be being written
+def iter_feed(path, parse_line, batch_size=INGEST_BATCH_SIZE, offset=0, first_line=1, complete_lines_only=False):
+    rows, rejects = [], []
+    with open(path, "rb") as file:
+        file.seek(offset)
+        for line_no, raw_line in enumerate(file, first_line):
+            if complete_lines_only and not raw_line.endswith(b"\n"):
+                break
+            offset += len(raw_line)
             try:
-                bicycle_id = int(fields[0])
-                rental_date = clean_date(fields[1].strip())
-                return_date = clean_date(fields[2].strip())
-                member_id = clean_member_id(fields[3].strip())
+                rows.append(parse_line(raw_line.decode("utf-8")))
+            except (IndexError, ValueError) as e:
+                text = raw_line.decode("utf-8", "replace").rstrip("\r\n")
+                rejects.append({"file": path, "line": line_no, "text": text, "error": str(e)})
+            if len(rows) >= batch_size:
+                yield rows, rejects, offset
+                rows, rejects = [], []
+    if rows or rejects:
+        yield rows, rejects, offset
 
-                # Insert into rentals table
-                cursor.execute('''INSERT INTO rentals (bicycle_id, rental_date, return_date, member_id)
-                                  VALUES (?, ?, ?, ?)''', 
-                               (bicycle_id, rental_date, return_date, member_id))
+# Bytes hashed at the start of a file and just before the ledger offset to spot a rewritten or rotated feed
+FINGERPRINT_BYTES = 4096
 
-            except (IndexError, ValueError) as e:
-                print(f"Error in Rental_History.txt - Skipping line: {line}, Error: {e}")
+def _fingerprint(path, offset):
+    with open(path, "rb") as file:
+        head = file.read(min(offset, FINGERPRINT_BYTES))
+        tail_start = max(offset - FINGERPRINT_BYTES, 0)
+        file.seek(tail_start)
+        tail = file.read(offset - tail_start)
+    return hashlib.sha256(head + tail).hexdigest()
+
+# Stream one feed file into its table in batches, returning a report of what was loaded and rejected.
+# In incremental mode loading resumes where the ledger says the last run stopped, so only appended lines are read.
+# If the file no longer matches the ledger (truncated or rewritten) it is treated as a new file and loaded from the start
+def ingest_file(conn, path, kind, batch_size=INGEST_BATCH_SIZE, incremental=True):
+    import events
+    parse_line, insert_sql = FEEDS[kind]
+    offset, lines = ledger_position(conn, path) if incremental else (0, 0)
+
+    report = {"file": path, "table": kind, "start_offset": offset, "rows": 0, "rejected": 0, "rejects": []}
+    # The load is logged as one event rather than one per rental
+    with events.bulk_load(conn):
+        for rows, rejects, offset in iter_feed(path, parse_line, batch_size, offset, lines + 1, incremental):
+            conn.executemany(insert_sql, rows)
+            report["rows"] += len(rows)
+            report["rejected"] += len(rejects)
+            room = MAX_REPORTED_REJECTS - len(report["rejects"])
+            report["rejects"].extend(rejects[:room])
+    update_ledger(conn, path, kind, offset, lines + report["rows"] + report["rejected"])
+    if report["rows"]:
+        events.record_event(conn, "load", details={"table": kind, "source": os.path.abspath(path), "rows": report["rows"]})
+    return report
+
+# Feed files are recorded in the ledger by their path relative to the database, so moving the database together
+# with its feeds (e.g. the whole checkout) keeps the ledger valid. Files on another drive fall back to absolute paths
+def _ledger_key(path):
+    try:
+        return os.path.relpath(os.path.abspath(path), os.path.dirname(os.path.abspath(DB_PATH)))
+    except ValueError:
+        return os.path.abspath(path)
+
+# Where loading a feed file should resume, as (byte offset, lines already read): (0, 0) for a file that is new,
+# or no longer matches the ledger
+def ledger_position(conn, path):
+    entry = conn.execute("SELECT byte_offset, lines, fingerprint FROM ingest_ledger WHERE path = ?",
+                         (_ledger_key(path),)).fetchone()
+    if entry and os.path.getsize(path) >= entry[0] and _fingerprint(path, entry[0]) == entry[2]:
+        return entry[0], entry[1]
+    return 0, 0
 
-    # Commit and close connection
-    conn.commit()
-    close_db(conn)
+# Record in the ledger that a feed file has been loaded up to byte `offset` (`lines` lines)
+def update_ledger(conn, path, kind, offset, lines):
+    conn.execute('''INSERT OR REPLACE INTO ingest_ledger (path, table_name, byte_offset, lines, fingerprint, loaded_at)
+                    VALUES (?, ?, ?, ?, ?, ?)''',
+                 (_ledger_key(path), kind, offset, lines, _fingerprint(path, offset),
+                  datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+
+# Load both feed files in a single transaction; returns one report per file.
+# By default only lines appended since the last load are read, so re-running is cheap and does not duplicate rentals
+def load_and_clean_data(bike_path=BICYCLE_FEED, rental_path=RENTAL_FEED, batch_size=INGEST_BATCH_SIZE,
+                        incremental=True):
+    import fleetStats
+    with session() as conn:
+        reports = [ingest_file(conn, bike_path, "bicycles", batch_size, incremental)]
+        # Fold the new rentals into the fleet statistics in one pass rather than row by row
+        with fleetStats.deferred_rental_stats(conn):
+            reports.append(ingest_file(conn, rental_path, "rentals", batch_size, incremental))
+        # Loaded rentals change which bikes are out as much as loaded bikes do
+        if reports[0]["rows"] or reports[1]["rows"]:
+            mark_bicycles_changed()
+        # Refresh planner statistics if the load changed the tables significantly
+        conn.execute("PRAGMA optimize")
+    # Bring the columnar snapshot used for analytics up to date, if one has been created (see snapshot.py)
+    if reports[0]["rows"] or reports[1]["rows"]:
+        import snapshot
+        snapshot.refresh_if_present()
+    return reports
+
+# Print a short summary of ingest reports
+def print_ingest_reports(reports):
+    for report in reports:
+        resumed = f" (resumed at byte {report['start_offset']})" if report["start_offset"] else ""
+        print(f"{report['file']}: loaded {report['rows']} rows into {report['table']}, rejected {report['rejected']}{resumed}")
+        for reject in report["rejects"][:10]:
+            print(f"  line {reject['line']}: {reject['error']} ({reject['text']})")
 
 # Helper function to clean rental rate
 def clean_rental_rate(rate):
@@ -105,15 +751,59 @@ def clean_rental_rate(rate):
         rate += "/day"  # Default to daily rate if no period is specified
     return rate
 
+# Split a rental rate such as "25/day; 125/week" into numeric (daily, weekly) rates, with None for a rate that is
+# missing or unreadable (e.g. "Missing/day"). The daily rate is the number before the first "/", as calculate_fees
+# has always read it. Feeds repeat the same few rates, so results are memoised
+@lru_cache(maxsize=4096)
+def parse_rental_rate(rate):
+    if not rate:
+        return None, None
+    cleaned = rate.replace("£", "").replace("Â", "")
+    daily_rate = _parse_amount(cleaned.split("/")[0])
+    weekly_rate = None
+    for part in cleaned.split(";"):
+        amount, _, period = part.partition("/")
+        if period.strip().lower() == "week":
+            weekly_rate = _parse_amount(amount)
+    return daily_rate, weekly_rate
+
+def _parse_amount(amount):
+    try:
+        return float(amount.strip())
+    except ValueError:
+        return None
+
 # Helper function to clean date
 def clean_date(date_str):
     # Handle different date formats, defaulting to a standard format
+    cleaned = normalise_date(date_str)
+    if cleaned is None:
+        print(f"Invalid date format for {date_str}, setting as NULL")
+    return cleaned
+
+# Convert a date in one of the accepted formats to YYYY-MM-DD, or None if it is not valid.
+# Feeds repeat the same dates over and over, so results are memoised
+@lru_cache(maxsize=65536)
+def normalise_date(date_str):
+    # Fast path for the zero-padded dd/mm/yyyy, yyyy-mm-dd and dd-mm-yyyy forms
+    if len(date_str) == 10:
+        if date_str[2] == date_str[5] and date_str[2] in "/-":
+            day, month, year = date_str[:2], date_str[3:5], date_str[6:]
+        elif date_str[4] == date_str[7] == "-":
+            year, month, day = date_str[:4], date_str[5:7], date_str[8:]
+        else:
+            day = month = year = ""
+        if day.isdigit() and month.isdigit() and year.isdigit():
+            try:
+                return date(int(year), int(month), int(day)).strftime("%Y-%m-%d")
+            except ValueError:
+                return None
+    # Anything else (e.g. unpadded days) goes through strptime
     for fmt in ("%d/%m/%Y", "%Y-%m-%d", "%d-%m-%Y"):
         try:
             return datetime.strptime(date_str, fmt).strftime("%Y-%m-%d")
         except ValueError:
             continue
-    print(f"Invalid date format for {date_str}, setting as NULL")
     return None  # Return None if no valid date format is found
 
 # Helper function to clean member ID
@@ -125,11 +815,27 @@ def clean_member_id(member_id):
         print(f"Invalid Member ID '{member_id}', setting as NULL")
         return None
 
+# Helper function to normalise a bike ID given as text (e.g. from a form) to an integer, leaving invalid IDs as they are
+def clean_bike_id(bike_id):
+    try:
+        return int(bike_id)
+    except (TypeError, ValueError):
+        return bike_id
+
+# Same as clean_member_id but quiet, for bulk loading
+def _parse_member_id(member_id):
+    try:
+        return int(member_id)
+    except ValueError:
+        return None
+
 # Step 4: Initialization function
-def initialize_database():
+def initialize_database(incremental=True):
     create_tables()
-    load_and_clean_data()
+    return load_and_clean_data(incremental=incremental)
 
 # Run the initialization function to set up the database
 if __name__ == "__main__":
-    initialize_database()
+    print_ingest_reports(initialize_database())
+    for name, plan in check_query_plans().items():
+        print(f"Warning: '{name}' does not use an index: {plan}")
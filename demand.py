@@ -0,0 +1,253 @@
+import heapq
+import sys
+from datetime import date, timedelta
+
+from database import session, write_transaction
+
+# Weekly demand per bike type, for purchase planning. For every type and week (starting on Monday) it records
+# the rentals started, the rental days (bikes out on each day, summed over the week) and the peak number of
+# bikes out at once. Rentals count under their bike's current type and, while open, as out until today.
+# The table is brought up to date by update_demand(): weeks before the last processed week are final and kept,
+# unless rentals added since (e.g. an ingest of older history) started earlier, so a rerun only reads the rentals
+# open during the last week or two. Weeks before the cutoff of archive.py are never recomputed: their rentals have
+# left the rentals table, and were counted before they did (see record_archive_cutoff).
+# The tables are created by database.MIGRATIONS 7 and 12.
+
+# Rentals read from the database at a time; the per-day counts are accumulated chunk by chunk
+DEMAND_CHUNK_SIZE = 100000
+
+# Weeks of history the profile and the budget allocation look at, and the most recent of those that set the trend
+PROFILE_WEEKS = 52
+RECENT_WEEKS = 13
+
+# A bike is only worth buying if the fleet of its type would have been fully rented in at least this share of weeks
+MIN_PEAK_SHARE = 0.1
+
+def _monday(day):
+    return day - timedelta(days=day.weekday())
+
+def _as_date(day):
+    if day is None:
+        return date.today()
+    return date.fromisoformat(day) if isinstance(day, str) else day
+
+# Step 1: aggregation
+
+# Add one chunk of (type, rental_date, return_date) rows to the per-day counters. `delta[t][d]` gets +1 on the day
+# a rental of type index t starts and -1 the day after it ends (a running sum gives the bikes out on each day),
+# `started[t][d]` counts rentals started on day d. Days are counted from `origin`; rentals end no later than `last`
+def _add_chunk(np, rows, types, origin, last, delta, started):
+    codes = np.array([types.setdefault(row[0] or "", len(types)) for row in rows], dtype="int64")
+    if len(types) > delta.shape[0]:
+        grown = len(types) - delta.shape[0]
+        delta = np.vstack([delta, np.zeros((grown, delta.shape[1]), dtype="int64")])
+        started = np.vstack([started, np.zeros((grown, started.shape[1]), dtype="int64")])
+    starts = np.array([row[1] for row in rows], dtype="datetime64[D]")
+    ends = np.array([row[2] for row in rows], dtype="datetime64[D]")
+    # Open rentals are out until `last`, same-day returns count as one day and bad return dates are ignored
+    ends = np.where(np.isnat(ends), last, ends)
+    ends = np.minimum(np.maximum(ends, starts), last) + 1
+    keep = ~np.isnat(starts) & (starts <= last) & (ends > origin)
+    codes, starts, ends = codes[keep], starts[keep], ends[keep]
+
+    width = delta.shape[1]
+    first_days = np.maximum((starts - origin).astype("int64"), 0)
+    end_days = (ends - origin).astype("int64")
+    delta += (np.bincount(codes * width + first_days, minlength=delta.size)
+              - np.bincount(codes * width + end_days, minlength=delta.size)).reshape(delta.shape)
+    new = starts >= origin
+    started += np.bincount(codes[new] * width + (starts[new] - origin).astype("int64"),
+                           minlength=started.size).reshape(started.shape)
+    return delta, started
+
+# Weekly (rentals, rental days, peak) per type from rows of (type, rental_date, return_date), for the weeks from
+# `origin` (a Monday) to the one containing `last`. Returns {(type, week): (rentals, rental_days, peak)}
+def weekly_demand_from_rows(chunks, origin, last):
+    import numpy as np
+    weeks = (last - origin).days // 7 + 1
+    origin64, last64 = np.datetime64(origin, "D"), np.datetime64(last, "D")
+    types = {}
+    delta = np.zeros((0, weeks * 7 + 1), dtype="int64")
+    started = np.zeros((0, weeks * 7 + 1), dtype="int64")
+    for rows in chunks:
+        if rows:
+            delta, started = _add_chunk(np, rows, types, origin64, last64, delta, started)
+
+    out = np.cumsum(delta, axis=1)[:, :weeks * 7].reshape(len(types), weeks, 7)
+    rentals = started[:, :weeks * 7].reshape(len(types), weeks, 7).sum(axis=2)
+    rental_days, peaks = out.sum(axis=2), out.max(axis=2, initial=0)
+    demand = {}
+    for bike_type, code in types.items():
+        for week in np.flatnonzero(rentals[code] | rental_days[code]):
+            demand[bike_type, (origin + timedelta(weeks=int(week))).isoformat()] = (
+                int(rentals[code, week]), int(rental_days[code, week]), int(peaks[code, week]))
+    return demand
+
+def _fetch_chunks(cursor, chunk_size):
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            return
+        yield rows
+
+# Bring type_weekly_demand up to date as of `as_of` (default today). Returns the number of weeks recomputed
+def update_demand(as_of=None, chunk_size=DEMAND_CHUNK_SIZE):
+    last = _as_date(as_of)
+    with session() as conn:
+        state = conn.execute("SELECT processed_week, last_rental_id, archived_before FROM demand_state").fetchone()
+        last_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM rentals").fetchone()[0]
+        if state is None:
+            first = conn.execute("SELECT MIN(rental_date) FROM rentals").fetchone()[0]
+        else:
+            # Rentals added since the last update may have started before the week it stopped at
+            earliest = conn.execute("SELECT MIN(rental_date) FROM rentals WHERE id > ?", (state[1],)).fetchone()[0]
+            first = min(state[0], earliest) if earliest else state[0]
+        origin = _monday(min(date.fromisoformat(first), last)) if first else _monday(last)
+        if state is not None and state[2]:
+            # Keep the weeks that archived rentals were out in; only weeks starting on or after the cutoff are
+            # made up of rentals still in the table (a rental loaded since that started earlier counts from there)
+            origin = max(origin, _monday(date.fromisoformat(state[2]) + timedelta(days=6)))
+        if state is None:
+            # First run: every rental, read straight through the table
+            cursor = conn.execute("""
+                SELECT bicycles.type, rentals.rental_date, rentals.return_date
+                FROM rentals JOIN bicycles ON bicycles.id = rentals.bicycle_id
+                WHERE rentals.rental_date IS NOT NULL""")
+        else:
+            # Every rental out on or after `origin`: returned since, or still open
+            cursor = conn.execute("""
+                SELECT bicycles.type, rentals.rental_date, rentals.return_date
+                FROM rentals JOIN bicycles ON bicycles.id = rentals.bicycle_id
+                WHERE rentals.return_date >= ? AND rentals.rental_date IS NOT NULL
+                UNION ALL
+                SELECT bicycles.type, rentals.rental_date, rentals.return_date
+                FROM rentals JOIN bicycles ON bicycles.id = rentals.bicycle_id
+                WHERE rentals.return_date IS NULL AND rentals.rental_date IS NOT NULL""", (origin.isoformat(),))
+        demand = weekly_demand_from_rows(_fetch_chunks(cursor, chunk_size), origin, last) if origin <= last else {}
+
+    def save(conn):
+        conn.execute("DELETE FROM type_weekly_demand WHERE week >= ?", (origin.isoformat(),))
+        conn.executemany("INSERT INTO type_weekly_demand (type, week, rentals, rental_days, peak) VALUES (?, ?, ?, ?, ?)",
+                         (key + values for key, values in demand.items()))
+        conn.execute("""INSERT INTO demand_state (id, processed_week, last_rental_id) VALUES (1, ?, ?)
+                        ON CONFLICT (id) DO UPDATE SET processed_week = excluded.processed_week,
+                                                       last_rental_id = excluded.last_rental_id""",
+                     (_monday(last).isoformat(), last_id))
+    write_transaction(save)
+    return max((last - origin).days // 7 + 1, 0)
+
+# Called by archive.py in the transaction that deletes archived rentals, after update_demand() has counted them:
+# from then on the weeks before `before` are kept as they are
+def record_archive_cutoff(conn, before):
+    conn.execute("UPDATE main.demand_state SET archived_before = MAX(COALESCE(archived_before, ''), ?)", (before,))
+
+# Step 2: reading
+
+# Weekly demand for the `weeks` complete weeks before the week of `as_of`, as (week start dates, types, arrays)
+# where arrays is {"rentals", "rental_days", "peak"}, each with one row per type and one column per week
+def weekly_demand(weeks=PROFILE_WEEKS, as_of=None):
+    import numpy as np
+    end = _monday(_as_date(as_of))
+    start = end - timedelta(weeks=weeks)
+    week_starts = [(start + timedelta(weeks=week)).isoformat() for week in range(weeks)]
+    with session() as conn:
+        rows = conn.execute("""SELECT type, week, rentals, rental_days, peak FROM type_weekly_demand
+                               WHERE week >= ? AND week < ? AND type != ''""",
+                            (start.isoformat(), end.isoformat())).fetchall()
+    types = sorted({row[0] for row in rows})
+    arrays = {name: np.zeros((len(types), weeks), dtype="int64") for name in ("rentals", "rental_days", "peak")}
+    type_index = {bike_type: index for index, bike_type in enumerate(types)}
+    week_index = {week: index for index, week in enumerate(week_starts)}
+    for bike_type, week, rentals, rental_days, peak in rows:
+        arrays["rentals"][type_index[bike_type], week_index[week]] = rentals
+        arrays["rental_days"][type_index[bike_type], week_index[week]] = rental_days
+        arrays["peak"][type_index[bike_type], week_index[week]] = peak
+    return week_starts, types, arrays
+
+# Bikes per type in the fleet now
+def fleet_sizes():
+    with session() as conn:
+        return {bike_type: bikes for bike_type, bikes in
+                conn.execute("SELECT type, SUM(bikes) FROM bicycle_facets WHERE type != '' GROUP BY type")}
+
+# Demand per type over the last `weeks` complete weeks: {type: {"fleet", "weekly_rentals", "utilisation",
+# "peak", "peak_p90", "growth"}}. Utilisation is the share of bike-days the type's fleet was out; growth compares
+# rentals in the last RECENT_WEEKS weeks with the whole period (1.0 = steady)
+def demand_profile(weeks=PROFILE_WEEKS, as_of=None):
+    import numpy as np
+    _, types, arrays = weekly_demand(weeks, as_of)
+    fleet = fleet_sizes()
+    profile = {}
+    for index, bike_type in enumerate(types):
+        rentals = arrays["rentals"][index]
+        bikes = fleet.get(bike_type, 0)
+        mean_rentals = rentals.mean() if weeks else 0.0
+        recent = rentals[-RECENT_WEEKS:].mean() if weeks else 0.0
+        profile[bike_type] = {
+            "fleet": bikes,
+            "weekly_rentals": float(mean_rentals),
+            "utilisation": float(arrays["rental_days"][index].sum() / (bikes * 7 * weeks)) if bikes and weeks else None,
+            "peak": int(arrays["peak"][index].max(initial=0)),
+            "peak_p90": float(np.percentile(arrays["peak"][index], 90)) if weeks else 0.0,
+            "growth": float(min(max(recent / mean_rentals, 0.5), 2.0)) if mean_rentals else 1.0,
+        }
+    return profile
+
+# Step 3: budget allocation
+
+# Spread `budget` over the bike types by expected use of each extra bike, given `costs` per type (e.g.
+# bikeSelect.bicycle_costs). The k-th extra bike of a type is worth the share of weeks whose peak, scaled by the
+# type's growth, reached the fleet plus k-1 bikes: a fleet that was fully rented out has probably turned customers
+# away. Bikes are bought greedily by that share per pound until the budget runs out or no extra bike would have
+# been used in at least MIN_PEAK_SHARE of weeks. Returns purchase lines like recommend_purchase_order:
+# [{"type", "units", "cost_per_unit", "total_cost", "utilisation", "peak"}]
+def allocate_budget(budget, costs, weeks=PROFILE_WEEKS, as_of=None, update=True):
+    import numpy as np
+    if update:
+        update_demand(as_of)
+    _, types, arrays = weekly_demand(weeks, as_of)
+    profile = demand_profile(weeks, as_of)
+    peaks = {bike_type: np.sort(arrays["peak"][index] * profile[bike_type]["growth"])
+             for index, bike_type in enumerate(types)}
+
+    def worth(bike_type, units):
+        needed = profile[bike_type]["fleet"] + units
+        # Share of weeks with a (scaled) peak of at least `needed` bikes
+        return (len(peaks[bike_type]) - np.searchsorted(peaks[bike_type], needed)) / max(len(peaks[bike_type]), 1)
+
+    candidates = []
+    for bike_type in types:
+        cost = costs.get(bike_type, 0)
+        share = worth(bike_type, 0) if cost > 0 else 0
+        if share >= MIN_PEAK_SHARE:
+            heapq.heappush(candidates, (-share / cost, bike_type))
+
+    units = {}
+    remaining = budget
+    while candidates:
+        _, bike_type = heapq.heappop(candidates)
+        cost = costs[bike_type]
+        if cost > remaining:
+            continue
+        units[bike_type] = units.get(bike_type, 0) + 1
+        remaining -= cost
+        share = worth(bike_type, units[bike_type])
+        if share >= MIN_PEAK_SHARE:
+            heapq.heappush(candidates, (-share / cost, bike_type))
+
+    return [{"type": bike_type, "units": count, "cost_per_unit": costs[bike_type], "total_cost": count * costs[bike_type],
+             "utilisation": profile[bike_type]["utilisation"], "peak": profile[bike_type]["peak"]}
+            for bike_type, count in sorted(units.items(), key=lambda item: -item[1] * costs[item[0]])]
+
+# Command line: `python demand.py [budget]` updates the weekly demand and prints the profile and an allocation
+if __name__ == "__main__":
+    from bikeSelect import bicycle_costs
+    budget = float(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    print(f"Recomputed {update_demand()} weeks of demand")
+    for bike_type, stats in sorted(demand_profile().items()):
+        utilisation = f"{stats['utilisation']:.0%}" if stats["utilisation"] is not None else "n/a"
+        print(f"{bike_type:<15} fleet {stats['fleet']:>6}  {stats['weekly_rentals']:8.1f} rentals/week  "
+              f"utilisation {utilisation:>4}  peak {stats['peak']:>5} (p90 {stats['peak_p90']:.0f})  "
+              f"growth {stats['growth']:.2f}")
+    for line in allocate_budget(budget, bicycle_costs, update=False):
+        print(f"Buy {line['units']} x {line['type']} at £{line['cost_per_unit']} = £{line['total_cost']}")
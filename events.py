@@ -0,0 +1,229 @@
+import json
+import sys
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from database import session, select_in
+
+# Append-only log of what happened to bikes and rentals, written by triggers in the same transaction as the change
+# itself, so it can never miss a committed change or record one that was rolled back:
+#
+#   rent       a rental was opened (bicycle_id, rental_id, member_id; details: rental and expected return dates)
+#   return     a rental was closed (details: return date and fees)
+#   damage     a rental was closed with damage details (details: damage_details and fees)
+#   status     a bike's status changed (old_value -> new_value)
+#   condition  a bike's condition changed (old_value -> new_value)
+#   load       a feed file was bulk loaded (details: table, source file and rows). Rows loaded in bulk get no
+#              events of their own, so consumers should treat this as "anything may have changed"
+#
+# Event IDs only ever grow (the table is AUTOINCREMENT, so IDs are not reused after pruning), which makes the ID of
+# the last event seen a complete cursor: read_events(after_id) returns what happened since. Caches tail the log with
+# changes_since(), consumers that write to this database use process_events() with a cursor stored next to their
+# own tables, and external consumers follow tail_events() or `python events.py tail`. The log and its triggers are
+# created by database.MIGRATIONS 9 and 11.
+EVENT_KINDS = ("rent", "return", "damage", "status", "condition", "load")
+
+EVENT_TIME = "strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime')"
+
+# Events read from the database at a time
+EVENT_BATCH_SIZE = 1000
+
+# Seconds tail_events() waits before looking for new events again when it has caught up
+TAIL_POLL_SECONDS = 1.0
+
+# Events older than this many days can be pruned once every consumer has processed them
+EVENT_RETENTION_DAYS = 365
+
+EVENT_COLUMNS = "id, recorded_at, kind, bicycle_id, rental_id, member_id, old_value, new_value, details"
+
+# One logged event; details is a dict (or None)
+Event = namedtuple("Event", ["id", "recorded_at", "kind", "bicycle_id", "rental_id", "member_id", "old_value",
+                             "new_value", "details"])
+
+def _event(row):
+    return Event(*row[:-1], json.loads(row[-1]) if row[-1] else None)
+
+# Log an event that no trigger records, e.g. a bulk load. Call inside the session making the change
+def record_event(conn, kind, bicycle_id=None, rental_id=None, member_id=None, old_value=None, new_value=None,
+                 details=None):
+    if kind not in EVENT_KINDS:
+        raise ValueError(f"Unknown event kind: {kind}")
+    conn.execute(f"""INSERT INTO rental_events (recorded_at, kind, bicycle_id, rental_id, member_id, old_value,
+                                                new_value, details)
+                     VALUES ({EVENT_TIME}, ?, ?, ?, ?, ?, ?, ?)""",
+                 (kind, bicycle_id, rental_id, member_id, old_value, new_value,
+                  json.dumps(details) if details is not None else None))
+
+# For bulk loads: inside the block rentals added get no "rent" event each. The loader records one "load" event
+# instead. Must run inside a transaction (the flag is rolled back with it if the load fails, and other connections
+# never see it set); the schema is not changed
+@contextmanager
+def bulk_load(conn):
+    conn.execute("UPDATE ingest_state SET defer_events = 1")
+    yield
+    conn.execute("UPDATE ingest_state SET defer_events = 0")
+
+# The ID of the newest event ever logged (0 if none), the cursor to start from to see only what happens next.
+# Read from sqlite_sequence, so it does not go back when old events are pruned
+def latest_event_id(conn=None):
+    if conn is None:
+        with session() as conn:
+            return latest_event_id(conn)
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'rental_events'").fetchone()
+    return row[0] if row else 0
+
+# Change feed: up to `limit` events after `after_id`, oldest first, optionally only some kinds or one bike.
+# Returns (events, last_id); pass last_id back in to continue. Fewer than `limit` events means the feed has caught up,
+# and last_id then moves past the events that were filtered out too
+def read_events(after_id=0, limit=EVENT_BATCH_SIZE, kinds=None, bicycle_id=None, conn=None):
+    if conn is None:
+        with session() as conn:
+            return read_events(after_id, limit, kinds, bicycle_id, conn)
+    last_id = latest_event_id(conn)
+    where, parameters = "id > ? AND id <= ?", [after_id, last_id]
+    if kinds:
+        where += f" AND kind IN ({', '.join('?' * len(kinds))})"
+        parameters.extend(kinds)
+    if bicycle_id is not None:
+        where += " AND bicycle_id = ?"
+        parameters.append(bicycle_id)
+    events = [_event(row) for row in conn.execute(
+        f"SELECT {EVENT_COLUMNS} FROM rental_events WHERE {where} ORDER BY id LIMIT ?", parameters + [limit])]
+    return events, events[-1].id if len(events) == limit else max(last_id, after_id)
+
+# For caches: the bikes whose status or condition changed after `after_id`, as (bike IDs, last_id), or (None, last_id)
+# if something too broad to list happened: a bulk load, or events pruned before they were read.
+# Event IDs have no gaps, so a log starting after after_id + 1 has lost events
+def changes_since(after_id, conn=None):
+    if conn is None:
+        with session() as conn:
+            return changes_since(after_id, conn)
+    last_id = latest_event_id(conn)
+    if last_id <= after_id:
+        return set(), after_id
+    oldest = conn.execute("SELECT MIN(id) FROM rental_events").fetchone()[0]
+    if oldest is None or oldest > after_id + 1:
+        return None, last_id
+    bike_ids = set()
+    for kind, bike_id in conn.execute("SELECT kind, bicycle_id FROM rental_events WHERE id > ? AND id <= ?",
+                                      (after_id, last_id)):
+        if kind == "load":
+            return None, last_id
+        if kind in ("status", "condition"):
+            bike_ids.add(bike_id)
+    return bike_ids, last_id
+
+# Follow the log: yield events as they are committed, from after `after_id` (default: from now on), until `stop`
+# (a threading.Event) is set. Looks for new events every `poll_seconds` once it has caught up
+def tail_events(after_id=None, kinds=None, poll_seconds=TAIL_POLL_SECONDS, stop=None):
+    stop = stop or threading.Event()
+    if after_id is None:
+        after_id = latest_event_id()
+    while not stop.is_set():
+        events, after_id = read_events(after_id, EVENT_BATCH_SIZE, kinds)
+        yield from events
+        if len(events) < EVENT_BATCH_SIZE:
+            stop.wait(poll_seconds)
+
+# The last event a named consumer has processed (0 if it has not started)
+def consumer_position(consumer, conn=None):
+    if conn is None:
+        with session() as conn:
+            return consumer_position(consumer, conn)
+    row = conn.execute("SELECT last_event_id FROM event_cursors WHERE consumer = ?", (consumer,)).fetchone()
+    return row[0] if row else 0
+
+def _set_position(conn, consumer, event_id):
+    conn.execute("""INSERT INTO event_cursors (consumer, last_event_id, updated_at) VALUES (?, ?, ?)
+                    ON CONFLICT (consumer) DO UPDATE SET last_event_id = excluded.last_event_id,
+                                                         updated_at = excluded.updated_at""",
+                 (consumer, event_id, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+
+# Feed the events a named consumer has not processed yet to handler(conn, events), a batch at a time. Each batch is
+# handled and the consumer's cursor moved past it in one write transaction, so what the handler writes to this
+# database is applied exactly once even if the process stops part way. Returns the number of events handled.
+# A new consumer starts from the first event in the log, which replays the whole history it holds
+def process_events(consumer, handler, kinds=None, batch_size=EVENT_BATCH_SIZE):
+    handled = 0
+    while True:
+        with session(immediate=True) as conn:
+            events, last_id = read_events(consumer_position(consumer, conn), batch_size, kinds, conn=conn)
+            if events:
+                handler(conn, events)
+            _set_position(conn, consumer, last_id)
+        handled += len(events)
+        if len(events) < batch_size:
+            return handled
+
+# Forget a consumer, so its cursor no longer holds back prune_events
+def remove_consumer(consumer):
+    with session() as conn:
+        conn.execute("DELETE FROM event_cursors WHERE consumer = ?", (consumer,))
+
+# Delete events recorded before `before` ("YYYY-MM-DD", default EVENT_RETENTION_DAYS ago) that every consumer has
+# processed. Returns the number of events deleted
+def prune_events(before=None):
+    before = before or (datetime.now() - timedelta(days=EVENT_RETENTION_DAYS)).strftime("%Y-%m-%d")
+    with session(immediate=True) as conn:
+        slowest = conn.execute("SELECT MIN(last_event_id) FROM event_cursors").fetchone()[0]
+        last = conn.execute("SELECT MAX(id) FROM rental_events WHERE recorded_at < ? AND id <= ?",
+                            (before, slowest if slowest is not None else latest_event_id(conn))).fetchone()[0]
+        if last is None:
+            return 0
+        return conn.execute("DELETE FROM rental_events WHERE id <= ?", (last,)).rowcount
+
+# Replay: the status and condition of bikes just after event `event_id`, as {bike ID: (status, condition)}, worked out
+# from the bicycles table by undoing the status and condition events since. For an event_id older than the log
+# this is their state when the log was started (or last pruned)
+def bicycle_states_at(event_id, bike_ids=None):
+    with session() as conn:
+        if bike_ids is None:
+            rows = conn.execute("SELECT id, status, condition FROM bicycles")
+        else:
+            rows = select_in(conn, "SELECT id, status, condition FROM bicycles WHERE id IN ({})", set(bike_ids))
+        states = {row[0]: row[1:] for row in rows}
+        for kind, bike_id, old_value in conn.execute("""
+                SELECT kind, bicycle_id, old_value FROM rental_events
+                WHERE id > ? AND kind IN ('status', 'condition') ORDER BY id DESC""", (event_id,)):
+            if bike_id in states:
+                status, condition = states[bike_id]
+                states[bike_id] = (old_value, condition) if kind == "status" else (status, old_value)
+    return states
+
+# Everything logged for one bike, oldest first: its rentals, returns, damage and status and condition changes
+def bicycle_events(bike_id):
+    events, after_id, page = [], 0, None
+    while page is None or len(page) == EVENT_BATCH_SIZE:
+        page, after_id = read_events(after_id, bicycle_id=bike_id)
+        events.extend(page)
+    return events
+
+def format_event(event):
+    subject = f"bike {event.bicycle_id}" if event.bicycle_id is not None else ""
+    if event.rental_id is not None:
+        subject += f", rental {event.rental_id}"
+    if event.member_id is not None:
+        subject += f", member {event.member_id}"
+    change = f" {event.old_value} -> {event.new_value}" if event.kind in ("status", "condition") else ""
+    details = " " + ", ".join(f"{key}={value}" for key, value in event.details.items()) if event.details else ""
+    return f"#{event.id} {event.recorded_at} {event.kind:<9} {subject}{change}{details}"
+
+# Command line: `python events.py [COUNT]` prints the last COUNT events (default 20), `python events.py tail [AFTER_ID]`
+# follows the log until interrupted, `python events.py bike ID` prints one bike's history
+if __name__ == "__main__":
+    try:
+        if len(sys.argv) > 1 and sys.argv[1] == "tail":
+            for event in tail_events(int(sys.argv[2]) if len(sys.argv) > 2 else None):
+                print(format_event(event), flush=True)
+        elif len(sys.argv) > 2 and sys.argv[1] == "bike":
+            for event in bicycle_events(int(sys.argv[2])):
+                print(format_event(event))
+        else:
+            count = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+            events, _ = read_events(max(latest_event_id() - count, 0), count)
+            for event in events:
+                print(format_event(event))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,124 @@
+import sys
+from contextlib import contextmanager
+
+from database import session
+
+# Materialized fleet statistics, kept up to date by triggers on bicycles and rentals so that
+# dashboards and purchase recommendations read a handful of summary rows instead of scanning rentals.
+# NULL types, conditions, dates and purchase years are stored as '' so they can be part of a primary key
+# (the tables are WITHOUT ROWID, where primary key columns cannot be NULL).
+#
+#   type_daily_rentals:    rentals started per bike type per day. Rentals are counted under the bike's type at the
+#                          time they are recorded and are never subtracted, so history survives rentals being archived
+#   type_condition_counts: bikes per type, condition and purchase year
+#   member_active_rentals: open rentals per member
+#   bicycle_facets:        bikes per type, brand, frame size, status and condition (the bikeSearch facet counts)
+#   archived_daily_rentals, archived_bike_rentals:
+#                          rentals per type and day, and per bike, that archive.py has moved out of rentals, so
+#                          the summaries can still be checked against (and rebuilt from) the rentals that remain
+#
+# The tables and triggers are created by database.MIGRATIONS 3, 4, 8 and 11.
+
+# What each summary table should contain, computed from scratch
+SUMMARY_QUERIES = {
+    "type_daily_rentals": """
+        SELECT type, day, SUM(rentals) FROM (
+            SELECT COALESCE(bicycles.type, '') AS type, COALESCE(rentals.rental_date, '') AS day, COUNT(*) AS rentals
+            FROM rentals JOIN bicycles ON bicycles.id = rentals.bicycle_id
+            GROUP BY 1, 2
+            UNION ALL
+            SELECT type, day, rentals FROM archived_daily_rentals)
+        GROUP BY 1, 2""",
+    "type_condition_counts": """
+        SELECT COALESCE(type, ''), COALESCE(condition, ''), COALESCE(substr(purchase_date, 1, 4), ''), COUNT(*)
+        FROM bicycles
+        GROUP BY 1, 2, 3""",
+    "bicycle_facets": """
+        SELECT COALESCE(type, ''), COALESCE(brand, ''), COALESCE(frame_size, ''), COALESCE(status, ''),
+               COALESCE(condition, ''), COUNT(*)
+        FROM bicycles
+        GROUP BY 1, 2, 3, 4, 5""",
+    "member_active_rentals": """
+        SELECT member_id, COUNT(*)
+        FROM rentals WHERE return_date IS NULL AND member_id IS NOT NULL
+        GROUP BY member_id""",
+}
+
+# Recompute every summary table from scratch, in its own transaction or in the caller's connection
+def rebuild_fleet_stats(conn=None):
+    if conn is None:
+        with session() as conn:
+            return rebuild_fleet_stats(conn)
+    for table, query in SUMMARY_QUERIES.items():
+        conn.execute(f"DELETE FROM {table}")
+        conn.execute(f"INSERT INTO {table} {query}")
+
+# For bulk loads: inside the block the per-row rentals trigger is switched off, and the rentals added
+# are folded into the summaries with two grouped statements at the end. Must run inside a transaction
+# (the flag is rolled back with it if the load fails, and other connections never see it set)
+@contextmanager
+def deferred_rental_stats(conn):
+    last_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM rentals").fetchone()[0]
+    conn.execute("UPDATE ingest_state SET defer_stats = 1")
+    yield
+    conn.execute("""
+        INSERT INTO type_daily_rentals (type, day, rentals)
+            SELECT COALESCE(bicycles.type, ''), COALESCE(rentals.rental_date, ''), COUNT(*)
+            FROM rentals JOIN bicycles ON bicycles.id = rentals.bicycle_id
+            WHERE rentals.id > ?
+            GROUP BY 1, 2
+            ON CONFLICT (type, day) DO UPDATE SET rentals = rentals + excluded.rentals""", (last_id,))
+    conn.execute("""
+        INSERT INTO member_active_rentals (member_id, active_rentals)
+            SELECT member_id, COUNT(*) FROM rentals
+            WHERE rentals.id > ? AND return_date IS NULL AND member_id IS NOT NULL
+            GROUP BY member_id
+            ON CONFLICT (member_id) DO UPDATE SET active_rentals = active_rentals + excluded.active_rentals""", (last_id,))
+    conn.execute("UPDATE ingest_state SET defer_stats = 0")
+
+# Compare the summary tables with a full recomputation.
+# Returns {table: [(key, expected value, stored value), ...]} for every table that has drifted
+def check_fleet_stats():
+    problems = {}
+    with session() as conn:
+        for table, query in SUMMARY_QUERIES.items():
+            expected = {row[:-1]: row[-1] for row in conn.execute(query)}
+            stored = {row[:-1]: row[-1] for row in conn.execute(f"SELECT * FROM {table}")}
+            mismatches = [(key, expected.get(key, 0), stored.get(key, 0))
+                          for key in expected.keys() | stored.keys()
+                          if expected.get(key, 0) != stored.get(key, 0)]
+            if mismatches:
+                problems[table] = sorted(mismatches, key=repr)
+    return problems
+
+# Rentals per bike type, summed over every day
+def rentals_per_type():
+    with session() as conn:
+        return {bike_type or None: rentals for bike_type, rentals in
+                conn.execute("SELECT type, SUM(rentals) FROM type_daily_rentals GROUP BY type")}
+
+# (type, condition, purchase year, bikes) rows for the whole fleet, with '' turned back into None
+def bikes_per_type_condition_year():
+    with session() as conn:
+        return [(bike_type or None, condition or None, purchase_year or None, bikes) for
+                bike_type, condition, purchase_year, bikes in
+                conn.execute("SELECT type, condition, purchase_year, bikes FROM type_condition_counts WHERE bikes > 0")]
+
+# Open rentals for one member, read from the summary instead of counting rentals
+def active_rentals(member_id):
+    with session() as conn:
+        row = conn.execute("SELECT active_rentals FROM member_active_rentals WHERE member_id = ?",
+                           (member_id,)).fetchone()
+    return row[0] if row else 0
+
+# Command line: `python fleetStats.py rebuild` or `python fleetStats.py check`
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "check"
+    if command == "rebuild":
+        rebuild_fleet_stats()
+        print("Fleet statistics rebuilt.")
+    else:
+        problems = check_fleet_stats()
+        for table, mismatches in problems.items():
+            print(f"{table}: {len(mismatches)} rows out of date, e.g. {mismatches[:3]}")
+        print("Fleet statistics are consistent." if not problems else "Run `python fleetStats.py rebuild` to fix.")
@@ -0,0 +1,219 @@
+import argparse
+import os
+import sys
+import time
+from collections import deque
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor
+
+import database
+from database import session, FEEDS, MAX_REPORTED_REJECTS
+
+# Loads feed files from many depots at once. Files are cut into pieces at line boundaries and parsed and cleaned
+# by a pool of processes with the same parse_bicycle_line/parse_rental_line as load_and_clean_data; the cleaned
+# rows come back to this process, which is the only one writing to the database. Each file is loaded in its own
+# transaction together with its ingest ledger entry, so an interrupted load resumes at the first unfinished file,
+# and files already loaded are only read from where the last run stopped.
+
+# Worker processes parsing files (default: one per core)
+WORKERS = os.cpu_count() or 1
+
+# Files are split into pieces of about this many bytes, so a single large file is spread over the workers too
+PIECE_BYTES = 8 * 1024 * 1024
+
+# Pieces parsed ahead of the writer, per worker; bounds the memory held by rows waiting to be written
+PIECES_AHEAD = 2
+
+FEED_SUFFIXES = (".txt", ".csv", ".psv")
+
+# Which table a feed file is for: by the number of fields on its first line (8 for bicycles, 4 for rentals) or,
+# for an empty file, by its name (Rental_History*, Bicycle_Info*, ...). None if it is neither. The contents come
+# first because depot files are named freely: depot3_bike_rentals.txt holds rentals
+def feed_kind(path):
+    with open(path, "rb") as file:
+        fields = file.readline().count(b"|") + 1
+    kind = {8: "bicycles", 4: "rentals"}.get(fields)
+    if kind or os.path.getsize(path):
+        return kind
+    name = os.path.basename(path).lower()
+    if "rental" in name:
+        return "rentals"
+    if "bicycle" in name or "bike" in name:
+        return "bicycles"
+    return None
+
+# The feed files named by `sources` (files and directories), as (path, kind) pairs with every bicycles file
+# before the rentals files, so rentals find their bikes. Files in directories that are not feeds are skipped
+def collect_feeds(sources):
+    feeds = []
+    for source in sources:
+        if os.path.isdir(source):
+            for name in sorted(os.listdir(source)):
+                path = os.path.join(source, name)
+                if os.path.isfile(path) and name.lower().endswith(FEED_SUFFIXES):
+                    kind = feed_kind(path)
+                    if kind:
+                        feeds.append((path, kind))
+        else:
+            kind = feed_kind(source)
+            if kind is None:
+                raise ValueError(f"Cannot tell whether {source} holds bicycles or rentals")
+            feeds.append((source, kind))
+    return sorted(feeds, key=lambda feed: feed[1] != "bicycles")
+
+# Byte ranges of about PIECE_BYTES covering [start, end) of a file, each starting at the beginning of a line
+def split_file(path, start, end, piece_bytes=PIECE_BYTES):
+    pieces = []
+    with open(path, "rb") as file:
+        while start < end:
+            file.seek(min(start + piece_bytes, end))
+            if file.tell() < end:
+                file.readline()
+            stop = min(file.tell(), end)
+            pieces.append((start, stop))
+            start = stop
+    return pieces
+
+# The end of the complete lines in a file: a last line without a newline may still be being written
+def complete_end(path):
+    size = os.path.getsize(path)
+    with open(path, "rb") as file:
+        file.seek(max(size - 1, 0))
+        if size == 0 or file.read(1) == b"\n":
+            return size
+        position = size
+        while position > 0:
+            step = min(65536, position)
+            file.seek(position - step)
+            block = file.read(step)
+            newline = block.rfind(b"\n")
+            if newline >= 0:
+                return position - step + newline + 1
+            position -= step
+    return 0
+
+# Worker: parse the lines in bytes [start, end) of a file. Returns (rows, rejects, rejected, lines, seconds),
+# with reject line numbers counted from the start of the piece and at most MAX_REPORTED_REJECTS rejects kept
+def parse_piece(path, kind, start, end):
+    began = time.perf_counter()
+    parse_line = FEEDS[kind][0]
+    rows, rejects, rejected, lines = [], [], 0, 0
+    with open(path, "rb") as file:
+        file.seek(start)
+        data = file.read(end - start)
+        raw_lines = data.split(b"\n")
+        if data.endswith(b"\n"):
+            raw_lines.pop()
+        for raw_line in raw_lines:
+            lines += 1
+            try:
+                rows.append(parse_line(raw_line.decode("utf-8")))
+            except (IndexError, ValueError) as e:
+                rejected += 1
+                if len(rejects) < MAX_REPORTED_REJECTS:
+                    rejects.append({"file": path, "line": lines, "text": raw_line.decode("utf-8", "replace").rstrip("\r\n"),
+                                    "error": str(e)})
+    return rows, rejects, rejected, lines, time.perf_counter() - began
+
+# Run parse_piece over the pieces in order, with at most `ahead` pieces parsing or parsed but not yet consumed
+def _parsed_pieces(executor, pieces, ahead):
+    pending = deque()
+    for piece in pieces:
+        pending.append(executor.submit(parse_piece, *piece))
+        if len(pending) >= ahead:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+# Load every feed file in `sources` (files or directories) using `workers` processes to parse them.
+# Returns {"files": [one report per file, as load_and_clean_data], "rows", "rejected", "lines", "bytes",
+# "seconds", "rows_per_s", "mb_per_s", "workers"}. Each file report also has its "lines", "bytes",
+# "parse_s" (worker CPU time), "write_s" and "seconds" (wall time until it was committed)
+def ingest_sources(sources, workers=WORKERS, incremental=True, piece_bytes=PIECE_BYTES):
+    import events
+    import fleetStats
+    began = time.perf_counter()
+    feeds = collect_feeds(sources)
+
+    # Work out every file's pieces first, so all of them are handed to the workers straight away
+    plans = []
+    with session() as conn:
+        for path, kind in feeds:
+            offset, lines = database.ledger_position(conn, path) if incremental else (0, 0)
+            end = complete_end(path) if incremental else os.path.getsize(path)
+            plans.append((path, kind, offset, lines, end, split_file(path, offset, end, piece_bytes)))
+    pieces = [(path, kind, start, stop) for path, kind, _, _, _, file_pieces in plans for start, stop in file_pieces]
+
+    executor = ProcessPoolExecutor(max_workers=workers)
+    reports = []
+    try:
+        parsed = _parsed_pieces(executor, pieces, workers * PIECES_AHEAD)
+        for path, kind, offset, lines, end, file_pieces in plans:
+            insert_sql = FEEDS[kind][1]
+            report = {"file": path, "table": kind, "start_offset": offset, "rows": 0, "rejected": 0, "rejects": [],
+                      "lines": 0, "bytes": end - offset, "parse_s": 0.0, "write_s": 0.0}
+            with session() as conn, (fleetStats.deferred_rental_stats(conn) if kind == "rentals" else nullcontext()), \
+                    events.bulk_load(conn):
+                for _ in file_pieces:
+                    rows, rejects, rejected, piece_lines, seconds = next(parsed)
+                    written = time.perf_counter()
+                    conn.executemany(insert_sql, rows)
+                    report["write_s"] += time.perf_counter() - written
+                    for reject in rejects[:MAX_REPORTED_REJECTS - len(report["rejects"])]:
+                        reject["line"] += lines + report["lines"]
+                        report["rejects"].append(reject)
+                    report["rows"] += len(rows)
+                    report["rejected"] += rejected
+                    report["lines"] += piece_lines
+                    report["parse_s"] += seconds
+                database.update_ledger(conn, path, kind, end, lines + report["lines"])
+                if report["rows"]:
+                    events.record_event(conn, "load", details={"table": kind, "source": os.path.abspath(path),
+                                                               "rows": report["rows"]})
+                # Loaded rentals change which bikes are out as much as loaded bikes do
+                if report["rows"]:
+                    database.mark_bicycles_changed()
+            report["seconds"] = time.perf_counter() - began
+            reports.append(report)
+    finally:
+        executor.shutdown()
+
+    if any(report["rows"] for report in reports):
+        with session() as conn:
+            conn.execute("PRAGMA optimize")
+        import snapshot
+        snapshot.refresh_if_present()
+
+    seconds = time.perf_counter() - began
+    rows = sum(report["rows"] for report in reports)
+    lines = sum(report["lines"] for report in reports)
+    size = sum(report["bytes"] for report in reports)
+    return {"files": reports, "rows": rows, "rejected": sum(report["rejected"] for report in reports), "lines": lines,
+            "bytes": size, "seconds": seconds, "rows_per_s": lines / seconds if seconds else None,
+            "mb_per_s": size / 1e6 / seconds if seconds else None, "workers": workers}
+
+# Print a summary of an ingest_sources result, one line per file and a total
+def print_ingest_summary(result):
+    for report in result["files"]:
+        resumed = f" (resumed at byte {report['start_offset']:,})" if report["start_offset"] else ""
+        rate = report["lines"] / report["parse_s"] if report["parse_s"] else 0
+        print(f"{report['file']}: {report['rows']:,} rows into {report['table']}, {report['rejected']:,} rejected, "
+              f"parsed at {rate:,.0f} lines/s per worker, written in {report['write_s']:.2f}s{resumed}")
+        for reject in report["rejects"][:5]:
+            print(f"  line {reject['line']}: {reject['error']} ({reject['text']})")
+    print(f"Total: {result['lines']:,} lines ({result['bytes'] / 1e6:,.1f} MB) from {len(result['files'])} files in "
+          f"{result['seconds']:.2f}s with {result['workers']} workers = {result['rows_per_s'] or 0:,.0f} lines/s, "
+          f"{result['mb_per_s'] or 0:,.1f} MB/s")
+
+# Command line: `python ingest.py [--workers N] [--full] DIRECTORY_OR_FILE...`
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load bicycle and rental feeds from many depots in parallel")
+    parser.add_argument("sources", nargs="+", help="feed files, or directories of them")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="parsing processes (default: one per core)")
+    parser.add_argument("--full", action="store_true", help="reload whole files instead of only what was appended")
+    args = parser.parse_args()
+    try:
+        print_ingest_summary(ingest_sources(args.sources, args.workers, not args.full))
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
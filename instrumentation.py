@@ -0,0 +1,282 @@
+import functools
+import importlib
+import inspect
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import database
+
+# Opt-in profiling of the rental code. Nothing here runs until enable() is called: it then wraps the public
+# functions of MODULES in timing spans and makes new database connections time every SQL statement, e.g.
+#
+#   import instrumentation
+#   instrumentation.enable()
+#   ... rent, return, search ...
+#   instrumentation.print_summary()            # or instrumentation.export("profile.json")
+#
+# disable() puts the original functions and connections back, so when it is off the code runs exactly as before.
+# Span times include the time spent in nested spans and statements.
+
+# bikePlots separates time spent drawing charts with matplotlib; it is skipped if matplotlib is not installed
+MODULES = ("database", "bikeRent", "bikeReturn", "bikeSearch", "bikeSelect", "membershipManager", "bikePlots")
+
+# Functions called once per feed line or per result row; timing them would cost more than it tells
+EXCLUDED = {
+    "database.clean_date", "database.clean_rental_rate", "database.clean_member_id", "database.clean_bike_id",
+    "database.parse_bicycle_line", "database.parse_rental_line", "database.get_connection",
+    "bikeReturn.daily_rate_of",
+}
+
+_lock = threading.Lock()
+_spans = {}         # span name -> [calls, total seconds, max seconds]
+_statements = {}    # SQL text -> [executions, total seconds, max seconds, rows]
+_counters = {}      # e.g. connections, commits -> count
+_patched = []       # (owner, attribute, original) for everything enable() replaced
+_started = None
+
+def enabled():
+    return bool(_patched)
+
+def _add(table, key, elapsed, rows=None):
+    with _lock:
+        entry = table.get(key)
+        if entry is None:
+            entry = table[key] = [0, 0.0, 0.0] if rows is None else [0, 0.0, 0.0, 0]
+        entry[0] += 1
+        entry[1] += elapsed
+        if elapsed > entry[2]:
+            entry[2] = elapsed
+        if rows is not None:
+            entry[3] += rows
+
+def count(name, amount=1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+# Time a block of code as a named span, e.g. `with span("bikeSelect.plot"): ...`. Costs a flag check when disabled
+@contextmanager
+def span(name):
+    if not _patched:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _add(_spans, name, time.perf_counter() - start)
+
+def _timed(name, function):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _add(_spans, name, time.perf_counter() - start)
+    wrapper.__instrumented__ = function
+    return wrapper
+
+# Statements are grouped by their text with whitespace collapsed and IN (?, ?, ...) lists of any length merged
+def _statement_key(sql):
+    return re.sub(r"\?(\s*,\s*\?)+", "?, ...", " ".join(sql.split()))
+
+def _count_transaction(key):
+    word = key[:8].upper()
+    if word.startswith("COMMIT"):
+        count("commits")
+    elif word.startswith("ROLLBACK"):
+        count("rollbacks")
+    elif word.startswith("BEGIN"):
+        count("transactions")
+
+# Cursor that times each statement from execute() until its last row is fetched, and counts the rows it
+# returned (or changed, for INSERT/UPDATE/DELETE)
+class ProfiledCursor(sqlite3.Cursor):
+    _key = None
+
+    def _start(self, sql):
+        self._key = _statement_key(sql)
+        _count_transaction(self._key)
+        return time.perf_counter()
+
+    def _finish(self, start, rows):
+        _add(_statements, self._key, time.perf_counter() - start, rows)
+
+    def execute(self, sql, parameters=()):
+        start = self._start(sql)
+        super().execute(sql, parameters)
+        self._finish(start, max(self.rowcount, 0))
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        start = self._start(sql)
+        super().executemany(sql, seq_of_parameters)
+        self._finish(start, max(self.rowcount, 0))
+        return self
+
+    def executescript(self, script):
+        start = self._start(script)
+        super().executescript(script)
+        self._finish(start, 0)
+        return self
+
+    # Fetch time and rows are added to the statement's totals without counting another execution
+    def _fetched(self, start, rows):
+        if self._key is not None:
+            elapsed = time.perf_counter() - start
+            with _lock:
+                entry = _statements[self._key]
+                entry[1] += elapsed
+                entry[3] += rows
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(start, row is not None)
+        return row
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._fetched(start, len(rows))
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(start, len(rows))
+        return rows
+
+    def __next__(self):
+        start = time.perf_counter()
+        row = super().__next__()
+        self._fetched(start, 1)
+        return row
+
+# Connection whose statements all go through a ProfiledCursor (Connection.execute does not call cursor() itself)
+class ProfiledConnection(sqlite3.Connection):
+    def __init__(self, *args, **kwargs):
+        start = time.perf_counter()
+        super().__init__(*args, **kwargs)
+        _add(_spans, "sqlite3.connect", time.perf_counter() - start)
+        count("connections")
+
+    def cursor(self, factory=ProfiledCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, script):
+        return self.cursor().executescript(script)
+
+    def commit(self):
+        count("commits")
+        super().commit()
+
+    def rollback(self):
+        count("rollbacks")
+        super().rollback()
+
+# The public functions defined in a module, leaving out generators and context managers, where a span
+# would only time creating the generator
+def _public_functions(module):
+    for name, value in vars(module).items():
+        if (not name.startswith("_") and inspect.isfunction(value) and value.__module__ == module.__name__
+                and not inspect.isgeneratorfunction(inspect.unwrap(value))
+                and f"{module.__name__}.{name}" not in EXCLUDED):
+            yield name, value
+
+# Start collecting. Existing pooled connections are closed so the next ones are profiled; call this at
+# start-up, before other threads are using the database
+def enable(modules=MODULES):
+    global _started
+    if _patched:
+        return
+    _patched.append((database, "CONNECTION_FACTORY", database.CONNECTION_FACTORY))
+    database.CONNECTION_FACTORY = ProfiledConnection
+    database.close_pool()
+
+    wrappers = {}
+    for module_name in modules:
+        try:
+            module = importlib.import_module(module_name)
+        except ImportError:
+            continue
+        for name, function in _public_functions(module):
+            wrappers[function] = _timed(f"{module_name}.{name}", function)
+
+    # Rebind the functions wherever the project's modules hold them, including `from module import function`
+    # copies, so every caller goes through the span
+    root = os.path.dirname(os.path.abspath(__file__))
+    for module in list(sys.modules.values()):
+        path = getattr(module, "__file__", None)
+        if not path or not os.path.abspath(path).startswith(root):
+            continue
+        for name, value in list(vars(module).items()):
+            if inspect.isfunction(value) and value in wrappers:
+                _patched.append((module, name, value))
+                setattr(module, name, wrappers[value])
+
+    _started = _started or time.time()
+
+# Stop collecting and restore the original functions; what was collected is kept until reset()
+def disable():
+    while _patched:
+        owner, name, original = _patched.pop()
+        setattr(owner, name, original)
+    database.close_pool()
+
+def reset():
+    global _started
+    with _lock:
+        _spans.clear()
+        _statements.clear()
+        _counters.clear()
+    _started = time.time() if _patched else None
+
+# Everything collected so far, slowest first
+def summary():
+    with _lock:
+        spans = [{"name": name, "calls": calls, "total_s": total, "max_s": longest, "mean_s": total / calls}
+                 for name, (calls, total, longest) in _spans.items()]
+        statements = [{"sql": sql, "executions": runs, "total_s": total, "max_s": longest, "mean_s": total / runs,
+                       "rows": rows}
+                      for sql, (runs, total, longest, rows) in _statements.items()]
+        counters = dict(_counters)
+    return {
+        "started": datetime.fromtimestamp(_started).isoformat(timespec="seconds") if _started else None,
+        "spans": sorted(spans, key=lambda span: span["total_s"], reverse=True),
+        "statements": sorted(statements, key=lambda statement: statement["total_s"], reverse=True),
+        "counters": counters,
+    }
+
+def print_summary(limit=15):
+    report = summary()
+    print(f"{'Span':<50} {'calls':>8} {'total ms':>10} {'mean ms':>9} {'max ms':>9}")
+    for span in report["spans"][:limit]:
+        print(f"{span['name'][:50]:<50} {span['calls']:>8,} {span['total_s'] * 1000:>10.1f} "
+              f"{span['mean_s'] * 1000:>9.3f} {span['max_s'] * 1000:>9.3f}")
+    print()
+    print(f"{'Statement':<70} {'runs':>8} {'rows':>9} {'total ms':>10} {'max ms':>9}")
+    for statement in report["statements"][:limit]:
+        print(f"{statement['sql'][:70]:<70} {statement['executions']:>8,} {statement['rows']:>9,} "
+              f"{statement['total_s'] * 1000:>10.1f} {statement['max_s'] * 1000:>9.3f}")
+    print()
+    print(", ".join(f"{name}: {value:,}" for name, value in sorted(report["counters"].items())) or "No counters")
+
+# Write the summary as JSON to a local file
+def export(path):
+    with open(path, "w") as file:
+        json.dump(summary(), file, indent=2)
+        file.write("\n")
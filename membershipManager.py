@@ -0,0 +1,85 @@
+import json
+import os
+import threading
+from datetime import datetime
+
+from database import session
+
+# Location of the memberships file
+MEMBERSHIP_FILE = "membership.json"
+
+# Where memberships are looked up: "json" reads MEMBERSHIP_FILE, "db" uses the members table
+# (see import_memberships), which suits shops with very large member bases
+MEMBERSHIP_SOURCE = "json"
+
+# Parsed contents of MEMBERSHIP_FILE, reloaded only when the file's modification time changes
+_cache = {"path": None, "mtime": None, "members": {}}
+_cache_lock = threading.Lock()
+
+# Read and parse a memberships file, converting MembershipEndDate strings to datetime objects
+def load_memberships_file(path):
+    try:
+        with open(path, "r") as file:
+            memberships = json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        print("Error: Could not load membership data.")
+        return {}
+    for member_id, details in memberships.items():
+        details["MembershipEndDate"] = datetime.strptime(details["MembershipEndDate"], "%Y-%m-%d")
+    return memberships
+
+# Get the cached memberships dictionary, re-reading the file only if it has changed since the last call
+def get_memberships():
+    path = MEMBERSHIP_FILE
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        mtime = None
+    with _cache_lock:
+        if _cache["path"] != path or _cache["mtime"] != mtime:
+            _cache["members"] = load_memberships_file(path)
+            _cache["path"], _cache["mtime"] = path, mtime
+        return _cache["members"]
+
+# Drop the cached memberships so the next lookup re-reads the file
+def reload_memberships():
+    with _cache_lock:
+        _cache["path"] = _cache["mtime"] = None
+    return get_memberships()
+
+# Look up a single member, returning their details dictionary or None
+def get_member(member_id):
+    if MEMBERSHIP_SOURCE == "db":
+        with session() as conn:
+            row = conn.execute("SELECT active, rental_limit, membership_end_date FROM members WHERE id = ?",
+                               (member_id,)).fetchone()
+        if not row:
+            return None
+        return {"active": bool(row[0]), "RentalLimit": row[1],
+                "MembershipEndDate": datetime.strptime(row[2], "%Y-%m-%d")}
+    return get_memberships().get(str(member_id))
+
+# Copy a memberships file into the members table, replacing existing entries; returns the number imported
+def import_memberships(path=None):
+    memberships = load_memberships_file(path or MEMBERSHIP_FILE)
+    with session() as conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO members (id, active, rental_limit, membership_end_date) VALUES (?, ?, ?, ?)",
+            ((int(member_id), int(bool(details.get("active"))), details.get("RentalLimit", 0),
+              details["MembershipEndDate"].strftime("%Y-%m-%d")) for member_id, details in memberships.items()))
+    return len(memberships)
+
+# Check that a member exists, is flagged active and their membership has not expired.
+# Pass a memberships dictionary to check against it instead of the cache
+def check_membership(member_id, memberships=None):
+    member = memberships.get(str(member_id)) if memberships is not None else get_member(member_id)
+    if not member or not member.get("active"):
+        return False
+    return member["MembershipEndDate"] >= datetime.now()
+
+# Get the maximum number of bikes a member may have out at once (0 for unknown members)
+def get_rental_limit(member_id, memberships=None):
+    member = memberships.get(str(member_id)) if memberships is not None else get_member(member_id)
+    if not member:
+        return 0
+    return member.get("RentalLimit", 0)
@@ -0,0 +1,69 @@
+import csv
+import sys
+from datetime import date
+
+from database import session
+from bikeReturn import calculate_fees_bulk, daily_rate_of
+
+# Number of overdue rentals read and priced at a time; memory use is bounded by this, not by the size of rentals
+OVERDUE_CHUNK_SIZE = 10000
+
+# Columns of the billing report
+REPORT_COLUMNS = ["rental_id", "bicycle_id", "member_id", "rental_date", "expected_return_date", "days_overdue",
+                  "accrued_late_fee"]
+
+# Function to stream the open rentals whose expected return date is before `as_of` ("YYYY-MM-DD", default today),
+# oldest first, in lists of at most chunk_size rows:
+# (rental_id, bicycle_id, member_id, rental_date, expected_return_date, daily_rate, rental_rate).
+# Each chunk is read in its own short transaction, continuing after the last (expected_return_date, id) seen,
+# so a long scan neither holds a read snapshot open nor rereads what it has already passed
+def iter_overdue(as_of=None, chunk_size=OVERDUE_CHUNK_SIZE):
+    as_of = as_of or date.today().strftime("%Y-%m-%d")
+    after = ("", 0)
+    while True:
+        with session() as conn:
+            rows = conn.execute("""
+                SELECT rentals.id, rentals.bicycle_id, rentals.member_id, rentals.rental_date,
+                       rentals.expected_return_date, bicycles.daily_rate, bicycles.rental_rate
+                FROM rentals
+                LEFT JOIN bicycles ON bicycles.id = rentals.bicycle_id
+                WHERE rentals.return_date IS NULL AND rentals.expected_return_date < ?
+                  AND (rentals.expected_return_date, rentals.id) > (?, ?)
+                ORDER BY rentals.expected_return_date, rentals.id
+                LIMIT ?""", (as_of, after[0], after[1], chunk_size)).fetchall()
+        if not rows:
+            return
+        yield rows
+        after = (rows[-1][4], rows[-1][0])
+
+# Function to price a chunk from iter_overdue as of a date: returns (days overdue, accrued late fee) arrays.
+# The late fee follows the calculate_fees rules, i.e. what return_bike would charge if the bike came back on `as_of`
+def price_overdue(rows, as_of):
+    import numpy as np
+    as_of_dates = np.full(len(rows), as_of, dtype="datetime64[D]")
+    expected = np.asarray([row[4] for row in rows], dtype="datetime64[D]")
+    fees = calculate_fees_bulk([row[3] for row in rows], as_of_dates, [daily_rate_of(row[5], row[6]) for row in rows])
+    return (as_of_dates - expected).astype("int64"), fees
+
+# Function to write the billing report for every overdue rental to a CSV file, chunk by chunk.
+# Returns a summary with the number of overdue rentals and the total accrued late fees
+def write_billing_report(path, as_of=None, chunk_size=OVERDUE_CHUNK_SIZE):
+    as_of = as_of or date.today().strftime("%Y-%m-%d")
+    summary = {"as_of": as_of, "path": path, "rentals": 0, "total_fees": 0.0}
+    with open(path, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(REPORT_COLUMNS)
+        for rows in iter_overdue(as_of, chunk_size):
+            days_overdue, fees = price_overdue(rows, as_of)
+            writer.writerows((row[0], row[1], row[2], row[3], row[4], int(days), round(float(fee), 2))
+                             for row, days, fee in zip(rows, days_overdue, fees))
+            summary["rentals"] += len(rows)
+            summary["total_fees"] += float(fees.sum())
+    return summary
+
+# Nightly job: `python overdue.py [report.csv] [as_of YYYY-MM-DD]`
+if __name__ == "__main__":
+    report_path = sys.argv[1] if len(sys.argv) > 1 else f"overdue_{date.today().strftime('%Y-%m-%d')}.csv"
+    summary = write_billing_report(report_path, sys.argv[2] if len(sys.argv) > 2 else None)
+    print(f"{summary['rentals']} overdue rentals as of {summary['as_of']}, "
+          f"£{summary['total_fees']:.2f} in accrued late fees, written to {summary['path']}")
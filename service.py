@@ -0,0 +1,178 @@
+import asyncio
+import json
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qs
+
+import availability
+import bikeSearch
+from bikeRent import rent_bike, rent_available_bike
+from bikeReturn import return_bike
+from bikeSelect import recommend_purchase_order
+
+# HTTP/JSON front end for kiosks and the mobile app, standard library only. Requests are parsed on the asyncio
+# event loop; the blocking SQLite work runs on a bounded pool of threads, each with its own pooled connection.
+#
+#   GET  /bicycles?type=..&brand=..&frame_size=..&status=..&condition=..&min_rate=..&max_rate=..&after_id=..&limit=..
+#   GET  /facets?(same filters)
+#   GET  /availability?type=..&frame_size=..
+#   GET  /recommendations?budget=..
+#   POST /rentals   {"member_id": .., "bike_id": .., "rental_duration": ..}
+#                   or {"member_id": .., "type": .., "frame_size": .., "rental_duration": ..} for any available bike
+#   POST /returns   {"bike_id": .., "damage_details": .., "damage_charge": .., "new_condition": ..}
+#   GET  /health
+#
+# Rent and return answer with the same messages as rent_bike/return_bike, as {"message": ...}
+
+HOST = "127.0.0.1"
+PORT = 8080
+
+# Threads running database work; requests beyond this wait their turn
+WORKERS = 8
+
+# Largest page of search results a client may ask for, and largest request body accepted
+MAX_PAGE_SIZE = 500
+MAX_BODY_BYTES = 65536
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large",
+           500: "Internal Server Error"}
+
+# Search filters from the query string; a filter given more than once matches any of its values
+def _filters(query):
+    filters = {}
+    for name in bikeSearch.FACETS:
+        values = [value for value in query.get(name, []) if value]
+        if values:
+            filters[name] = values[0] if len(values) == 1 else values
+    for name in ("min_rate", "max_rate"):
+        if query.get(name):
+            filters[name] = float(query[name][0])
+    return filters
+
+def _search(query, body):
+    after_id = int(query["after_id"][0]) if query.get("after_id") else None
+    limit = min(int(query["limit"][0]), MAX_PAGE_SIZE) if query.get("limit") else bikeSearch.PAGE_SIZE
+    if limit < 1:
+        raise ValueError("limit must be at least 1")
+    rows, next_after_id = bikeSearch.search_page(after_id, limit, **_filters(query))
+    return {"bicycles": [dict(zip(bikeSearch.COLUMNS, row)) for row in rows], "next_after_id": next_after_id}
+
+def _facets(query, body):
+    return bikeSearch.facet_counts(**_filters(query))
+
+def _availability(query, body):
+    bike_type = query["type"][0]
+    frame_size = query["frame_size"][0] if query.get("frame_size") else None
+    return {"type": bike_type, "frame_size": frame_size, "available": availability.count_available(bike_type, frame_size)}
+
+def _recommendations(query, body):
+    return {"recommendations": recommend_purchase_order(float(query["budget"][0]), show=False)}
+
+def _rent(query, body):
+    rental_duration = int(body["rental_duration"])
+    if "bike_id" in body:
+        return {"message": rent_bike(body["member_id"], int(body["bike_id"]), rental_duration)}
+    return {"message": rent_available_bike(body["member_id"], body["type"], body.get("frame_size"), rental_duration)}
+
+def _return(query, body):
+    return {"message": return_bike(int(body["bike_id"]), body.get("damage_details"),
+                                   float(body.get("damage_charge", 0)), body.get("new_condition", "Good"))}
+
+def _health(query, body):
+    return {"status": "ok"}
+
+ROUTES = {
+    "/bicycles": ("GET", _search),
+    "/facets": ("GET", _facets),
+    "/availability": ("GET", _availability),
+    "/recommendations": ("GET", _recommendations),
+    "/rentals": ("POST", _rent),
+    "/returns": ("POST", _return),
+    "/health": ("GET", _health),
+}
+
+# Route one request and run its handler on the thread pool, returning (status, JSON-able payload)
+async def _dispatch(executor, method, target, body):
+    url = urlsplit(target)
+    route = ROUTES.get(url.path)
+    if route is None:
+        return 404, {"error": f"Unknown path {url.path}"}
+    if method != route[0]:
+        return 405, {"error": f"Use {route[0]} for {url.path}"}
+    try:
+        payload = json.loads(body) if body else {}
+        if not isinstance(payload, dict):
+            raise ValueError("Request body must be a JSON object")
+        query = parse_qs(url.query)
+        return 200, await asyncio.get_running_loop().run_in_executor(executor, route[1], query, payload)
+    except KeyError as e:
+        return 400, {"error": f"Missing parameter {e}"}
+    except (ValueError, TypeError) as e:
+        return 400, {"error": str(e)}
+    except Exception as e:
+        return 500, {"error": f"{type(e).__name__}: {e}"}
+
+def _response(status, payload, keep_alive):
+    data = json.dumps(payload, default=str).encode("utf-8")
+    head = (f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(data)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+    return head.encode("latin-1") + data
+
+# Serve requests on one connection until the client closes it or asks to (HTTP/1.1 keep-alive)
+async def _handle_connection(executor, reader, writer):
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line.strip():
+                break
+            method, target, version = request_line.decode("latin-1").split()
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if not line.strip():
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+
+            length = int(headers.get("content-length", 0))
+            if length > MAX_BODY_BYTES:
+                writer.write(_response(413, {"error": "Request body too large"}, False))
+                await writer.drain()
+                break
+            body = await reader.readexactly(length) if length else b""
+
+            status, payload = await _dispatch(executor, method, target, body)
+            writer.write(_response(status, payload, keep_alive))
+            await writer.drain()
+            if not keep_alive:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+        pass  # Client went away or sent something that is not HTTP
+    finally:
+        writer.close()
+
+# Start listening and return the asyncio server; the caller runs the loop (see serve())
+async def start_server(host=HOST, port=PORT, workers=WORKERS):
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bike-db")
+    server = await asyncio.start_server(lambda reader, writer: _handle_connection(executor, reader, writer), host, port)
+    server.executor = executor
+    return server
+
+async def serve(host=HOST, port=PORT, workers=WORKERS):
+    server = await start_server(host, port, workers)
+    print(f"Bicycle rental service listening on http://{host}:{port}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        server.executor.shutdown()
+
+# Run the service: `python service.py [host] [port]`
+if __name__ == "__main__":
+    try:
+        asyncio.run(serve(sys.argv[1] if len(sys.argv) > 1 else HOST, int(sys.argv[2]) if len(sys.argv) > 2 else PORT))
+    except KeyboardInterrupt:
+        pass
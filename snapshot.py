@@ -0,0 +1,392 @@
+import json
+import os
+import shutil
+import sys
+from collections import namedtuple
+from datetime import datetime
+
+import database
+from database import session, select_in
+
+# Columnar snapshot of bicycles and rentals for analytics, so trends over years of history are computed with NumPy
+# on memory-mapped arrays instead of queries against the transactional database. A snapshot is a directory
+# (by default next to the database, "BicycleRental.db.snapshot") holding one .npy file per column:
+#
+#   snapshot.json         what the snapshot holds: row counts, the dictionaries, the rental parts and watermark
+#   bicycles-N/           every bike, ordered by id, rewritten on each refresh (status and condition change often)
+#   rentals-N/            rentals ordered by id in parts of at most PART_ROWS rows; new rentals are appended as parts
+#   open_rentals.npy      IDs of the rentals that were still open, whose return date and fees are filled in once
+#                         they are returned
+#
+# Text columns are dictionary encoded: the array holds int32 codes (-1 for NULL) into the column's list of values in
+# snapshot.json. Dates are datetime64[D] (NaT for NULL), rates and fees float64 (NaN for NULL) and IDs int64 (-1 for
+# NULL). NumPy is only needed by the functions that build or read a snapshot.
+#
+# load_and_clean_data() refreshes an existing snapshot after every ingest; refresh it after rentals and returns
+# with refresh_snapshot() (or `python snapshot.py`).
+
+# Rentals per part file; a refresh appends to the last part until it is full
+PART_ROWS = 1_000_000
+
+# Rows fetched from SQLite at a time while exporting
+FETCH_ROWS = 100_000
+
+META_FILE = "snapshot.json"
+OPEN_RENTALS_FILE = "open_rentals.npy"
+
+# Column kinds: "id" int64, "code" dictionary encoded text, "date" datetime64[D], "real" float64
+DTYPES = {"id": "int64", "code": "int32", "date": "datetime64[D]", "real": "float64"}
+BICYCLE_COLUMNS = {
+    "id": "id",
+    "brand": "code",
+    "type": "code",
+    "frame_size": "code",
+    "condition": "code",
+    "status": "code",
+    "purchase_date": "date",
+    "daily_rate": "real",
+    "weekly_rate": "real",
+}
+RENTAL_COLUMNS = {
+    "id": "id",
+    "bicycle_id": "id",
+    "member_id": "id",
+    "rental_date": "date",
+    "expected_return_date": "date",
+    "return_date": "date",
+    "fees": "real",
+}
+
+# A loaded table: a list of parts ({column: array}, memory-mapped), its column kinds, {column: list of values}
+# for the dictionary-encoded columns, and the total number of rows
+Table = namedtuple("Table", ["parts", "columns", "dictionaries", "rows"])
+Snapshot = namedtuple("Snapshot", ["bicycles", "rentals", "meta"])
+
+def snapshot_dir():
+    return database.DB_PATH + ".snapshot"
+
+def _numpy():
+    import numpy
+    return numpy
+
+# Step 1: writing
+
+def _dates(values):
+    np = _numpy()
+    try:
+        return np.array(values, dtype="datetime64[D]")
+    except ValueError:
+        # Something other than YYYY-MM-DD slipped into the table: keep what parses, NaT for the rest
+        days = np.full(len(values), np.datetime64("NaT"), dtype="datetime64[D]")
+        for index, value in enumerate(values):
+            try:
+                days[index] = np.datetime64(value, "D")
+            except (ValueError, TypeError):
+                pass
+        return days
+
+def _column(values, kind, dictionary=None):
+    np = _numpy()
+    if kind == "id":
+        return np.array([-1 if value is None else value for value in values], dtype="int64")
+    if kind == "real":
+        return np.array(values, dtype="float64")
+    if kind == "date":
+        return _dates(values)
+    return np.array([-1 if value is None else dictionary.setdefault(value, len(dictionary)) for value in values],
+                    dtype="int32")
+
+# Turn fetched rows into {column: array}, adding new text values to `dictionaries`
+def _columns(rows, columns, dictionaries):
+    return {name: _column([row[index] for row in rows], kind, dictionaries.get(name))
+            for index, (name, kind) in enumerate(columns.items())}
+
+def _concatenate(chunks, columns):
+    np = _numpy()
+    return {name: np.concatenate([chunk[name] for chunk in chunks]) for name in columns}
+
+# Write {column: array} as a directory of .npy files, atomically: it is written under a temporary name and renamed
+def _write_part(directory, name, arrays):
+    np = _numpy()
+    path = os.path.join(directory, name)
+    temporary = path + ".tmp"
+    shutil.rmtree(temporary, ignore_errors=True)
+    os.makedirs(temporary)
+    for column, values in arrays.items():
+        np.save(os.path.join(temporary, column + ".npy"), values)
+    os.rename(temporary, path)
+
+def _read_part(directory, name, columns, mmap_mode="r"):
+    np = _numpy()
+    return {column: np.load(os.path.join(directory, name, column + ".npy"), mmap_mode=mmap_mode) for column in columns}
+
+def _write_meta(directory, meta):
+    temporary = os.path.join(directory, META_FILE + ".tmp")
+    with open(temporary, "w") as file:
+        json.dump(meta, file, indent=1)
+    os.replace(temporary, os.path.join(directory, META_FILE))
+
+def _read_meta(directory):
+    with open(os.path.join(directory, META_FILE)) as file:
+        return json.load(file)
+
+# Write every bike as a new bicycles-N part, returning its name and the dictionaries of its text columns
+def _write_bicycles(conn, directory, generation):
+    dictionaries = {name: {} for name, kind in BICYCLE_COLUMNS.items() if kind == "code"}
+    rows = conn.execute(f"SELECT {', '.join(BICYCLE_COLUMNS)} FROM bicycles ORDER BY id").fetchall()
+    name = f"bicycles-{generation}"
+    _write_part(directory, name, _columns(rows, BICYCLE_COLUMNS, dictionaries))
+    return name, len(rows), {column: list(values) for column, values in dictionaries.items()}
+
+# Write the rentals after `after_id` as parts of at most PART_ROWS rows. `head` (the rows of a part that is not
+# full yet) is written first, so it is completed rather than followed by another small part.
+# Returns the new parts as [{"name", "rows", "first_id", "last_id"}] and the IDs of the open rentals among them
+def _write_rentals(conn, directory, after_id, first_part, head=None):
+    np = _numpy()
+    parts, open_ids = [], []
+    chunks = [head] if head is not None and len(head["id"]) else []
+    buffered = sum(len(chunk["id"]) for chunk in chunks)
+
+    # Write the buffered rows as full parts, keeping the rest buffered unless this is the final flush
+    def flush(final):
+        arrays = _concatenate(chunks, RENTAL_COLUMNS)
+        chunks.clear()
+        rows = len(arrays["id"])
+        end = rows if final else rows - rows % PART_ROWS
+        for start in range(0, end, PART_ROWS):
+            part = {column: values[start:min(start + PART_ROWS, end)] for column, values in arrays.items()}
+            name = f"rentals-{first_part + len(parts)}"
+            _write_part(directory, name, part)
+            parts.append({"name": name, "rows": len(part["id"]), "first_id": int(part["id"][0]),
+                          "last_id": int(part["id"][-1])})
+        if end < rows:
+            chunks.append({column: values[end:] for column, values in arrays.items()})
+        return rows - end
+
+    cursor = conn.execute(f"SELECT {', '.join(RENTAL_COLUMNS)} FROM rentals WHERE id > ? ORDER BY id", (after_id,))
+    while True:
+        rows = cursor.fetchmany(FETCH_ROWS)
+        if not rows:
+            break
+        chunk = _columns(rows, RENTAL_COLUMNS, {})
+        open_ids.append(chunk["id"][np.isnat(chunk["return_date"])])
+        chunks.append(chunk)
+        buffered += len(rows)
+        if buffered >= PART_ROWS:
+            buffered = flush(False)
+    if chunks:
+        flush(True)
+    return parts, np.concatenate(open_ids) if open_ids else np.zeros(0, dtype="int64")
+
+# Write a complete snapshot from scratch into `directory` (default snapshot_dir()), replacing any existing one
+def export_snapshot(directory=None):
+    np = _numpy()
+    directory = directory or snapshot_dir()
+    building = directory + ".building"
+    shutil.rmtree(building, ignore_errors=True)
+    os.makedirs(building)
+    # One read transaction, so bicycles and rentals are from the same moment
+    with session() as conn:
+        bicycles, bicycle_rows, dictionaries = _write_bicycles(conn, building, 1)
+        parts, open_ids = _write_rentals(conn, building, 0, 1)
+    np.save(os.path.join(building, OPEN_RENTALS_FILE), open_ids)
+    now = datetime.now().isoformat(timespec="seconds")
+    meta = {"created": now, "refreshed": now, "bicycles": bicycles, "bicycle_rows": bicycle_rows,
+            "dictionaries": dictionaries, "rental_parts": parts, "next_part": len(parts) + 1,
+            "rental_watermark": parts[-1]["last_id"] if parts else 0}
+    _write_meta(building, meta)
+
+    if os.path.exists(directory):
+        shutil.rmtree(directory)
+    os.rename(building, directory)
+    return {"bicycles": bicycle_rows, "new_rentals": sum(part["rows"] for part in parts), "closed_rentals": 0}
+
+# Bring a snapshot up to date: rewrite bicycles, append the rentals added since the last refresh and fill in the
+# return date and fees of rentals that were open then and have been returned since. Creates the snapshot if there
+# is none. Returns counts of what changed
+def refresh_snapshot(directory=None):
+    np = _numpy()
+    directory = directory or snapshot_dir()
+    if not os.path.exists(os.path.join(directory, META_FILE)):
+        return export_snapshot(directory)
+    meta = _read_meta(directory)
+    old_bicycles = meta["bicycles"]
+    was_open = np.load(os.path.join(directory, OPEN_RENTALS_FILE))
+
+    parts = meta["rental_parts"]
+    head = None
+    if parts and parts[-1]["rows"] < PART_ROWS:
+        # The last part is not full: it is read into memory and rewritten together with the new rentals
+        head = _read_part(directory, parts[-1]["name"], RENTAL_COLUMNS, mmap_mode=None)
+        replaced = parts.pop()["name"]
+
+    with session() as conn:
+        generation = int(old_bicycles.rsplit("-", 1)[1]) + 1
+        bicycles, bicycle_rows, dictionaries = _write_bicycles(conn, directory, generation)
+        closed = list(select_in(conn, "SELECT id, return_date, fees FROM rentals WHERE return_date IS NOT NULL AND id IN ({})",
+                                was_open.tolist()))
+        closed_ids = np.array([row[0] for row in closed], dtype="int64")
+        return_dates = _dates([row[1] for row in closed])
+        fees = np.array([row[2] for row in closed], dtype="float64")
+        if head is not None:
+            _fill_returns(head, closed_ids, return_dates, fees)
+        new_parts, new_open = _write_rentals(conn, directory, meta["rental_watermark"], meta["next_part"], head)
+
+    # Rentals returned since the last refresh that live in full parts are updated in place
+    if len(closed_ids):
+        for part in parts:
+            inside = (closed_ids >= part["first_id"]) & (closed_ids <= part["last_id"])
+            if inside.any():
+                arrays = _read_part(directory, part["name"], ("id", "return_date", "fees"), mmap_mode="r+")
+                _fill_returns(arrays, closed_ids[inside], return_dates[inside], fees[inside])
+                for values in arrays.values():
+                    values.flush()
+    np.save(os.path.join(directory, OPEN_RENTALS_FILE), np.union1d(np.setdiff1d(was_open, closed_ids), new_open))
+
+    meta.update({"refreshed": datetime.now().isoformat(timespec="seconds"), "bicycles": bicycles,
+                 "bicycle_rows": bicycle_rows, "dictionaries": dictionaries, "rental_parts": parts + new_parts,
+                 "next_part": meta["next_part"] + len(new_parts)})
+    if new_parts:
+        meta["rental_watermark"] = new_parts[-1]["last_id"]
+    _write_meta(directory, meta)
+
+    # Readers that loaded the old files keep them mapped; on POSIX they stay readable until unmapped
+    shutil.rmtree(os.path.join(directory, old_bicycles), ignore_errors=True)
+    if head is not None:
+        shutil.rmtree(os.path.join(directory, replaced), ignore_errors=True)
+    head_rows = len(head["id"]) if head is not None else 0
+    return {"bicycles": bicycle_rows, "new_rentals": sum(part["rows"] for part in new_parts) - head_rows,
+            "closed_rentals": len(closed_ids)}
+
+# Set the return date and fees of the given rentals in {column: array} (ids sorted, as in every part)
+def _fill_returns(arrays, rental_ids, return_dates, fees):
+    np = _numpy()
+    positions = np.searchsorted(arrays["id"], rental_ids)
+    found = positions < len(arrays["id"])
+    found[found] = arrays["id"][positions[found]] == rental_ids[found]
+    arrays["return_date"][positions[found]] = return_dates[found]
+    arrays["fees"][positions[found]] = fees[found]
+
+# Refresh the default snapshot if one has been created; called after each ingest
+def refresh_if_present():
+    if os.path.exists(os.path.join(snapshot_dir(), META_FILE)):
+        return refresh_snapshot()
+    return None
+
+# Step 2: reading
+
+def _load_table(directory, names, columns, dictionaries, rows):
+    return Table([_read_part(directory, name, columns) for name in names], columns, dictionaries, rows)
+
+# Open a snapshot for reading. The arrays are memory-mapped, so loading is instant and only the pages that are
+# used are read; they are read-only, and stay valid even if the snapshot is refreshed meanwhile
+def load_snapshot(directory=None):
+    directory = directory or snapshot_dir()
+    meta = _read_meta(directory)
+    bicycles = _load_table(directory, [meta["bicycles"]], BICYCLE_COLUMNS, meta["dictionaries"], meta["bicycle_rows"])
+    rentals = _load_table(directory, [part["name"] for part in meta["rental_parts"]], RENTAL_COLUMNS, {},
+                          sum(part["rows"] for part in meta["rental_parts"]))
+    return Snapshot(bicycles, rentals, meta)
+
+# One column of a table as a single array: the memory-mapped file itself for a table with one part, a copy
+# joining the parts otherwise. Iterate over table.parts to stay zero-copy on a large rentals table
+def column(table, name):
+    np = _numpy()
+    if len(table.parts) == 1:
+        return table.parts[0][name]
+    if not table.parts:
+        return np.zeros(0, dtype=DTYPES[table.columns[name]])
+    return np.concatenate([part[name] for part in table.parts])
+
+# Turn codes of a dictionary-encoded column back into values (None for NULL)
+def decode(table, name, codes):
+    np = _numpy()
+    values = np.array(table.dictionaries[name] + [None], dtype=object)
+    return values[codes]
+
+# A pandas DataFrame of a table, with the text columns as categoricals built straight from the codes
+def to_dataframe(table, columns=None):
+    import pandas as pd
+    columns = columns or list(table.columns)
+    data = {}
+    for name in columns:
+        values = column(table, name)
+        if name in table.dictionaries:
+            values = pd.Categorical.from_codes(values, categories=table.dictionaries[name])
+        data[name] = values
+    return pd.DataFrame(data)
+
+# Step 3: analytics on a snapshot
+
+# Position of each rental's bike in the bicycles arrays, -1 for bikes that are not in the snapshot
+def _bike_positions(snapshot, bicycle_ids):
+    np = _numpy()
+    ids = snapshot.bicycles.parts[0]["id"]
+    positions = np.searchsorted(ids, bicycle_ids)
+    positions[positions >= len(ids)] = 0
+    return np.where(ids[positions] == bicycle_ids, positions, -1) if len(ids) else np.full(len(bicycle_ids), -1)
+
+# The current type code of each rental's bike, one array per rentals part
+def _rental_types(snapshot, part):
+    np = _numpy()
+    positions = _bike_positions(snapshot, part["bicycle_id"])
+    types = snapshot.bicycles.parts[0]["type"]
+    return np.where(positions >= 0, types[positions], -1) if len(types) else positions
+
+# Rentals per month and bike type: returns (months as "YYYY-MM", types, counts) where counts[m][t] is the number of
+# rentals of type types[t] started in months[m]. Rentals without a valid date or bike are left out
+def rentals_per_month(snapshot, start=None, end=None):
+    np = _numpy()
+    types = snapshot.bicycles.dictionaries["type"]
+    totals = {}
+    for part in snapshot.rentals.parts:
+        months = part["rental_date"].astype("datetime64[M]")
+        type_codes = _rental_types(snapshot, part)
+        keep = ~np.isnat(months) & (type_codes >= 0)
+        if start:
+            keep &= months >= np.datetime64(start, "M")
+        if end:
+            keep &= months <= np.datetime64(end, "M")
+        month_numbers = months[keep].astype("int64")
+        if not len(month_numbers):
+            continue
+        first = month_numbers.min()
+        cells = (month_numbers - first) * len(types) + type_codes[keep]
+        counts = np.bincount(cells, minlength=(month_numbers.max() - first + 1) * len(types)).reshape(-1, len(types))
+        for offset, row in enumerate(counts):
+            if row.any():
+                totals[first + offset] = totals.get(first + offset, 0) + row
+    months = sorted(totals)
+    counts = np.array([totals[month] for month in months], dtype="int64").reshape(len(months), len(types))
+    return [str(np.datetime64(int(month), "M")) for month in months], types, counts
+
+# Rentals per type as (type, rental count) pairs, for types that have been rented (as in bikeSelect)
+def rental_frequency_by_type(snapshot):
+    np = _numpy()
+    types = snapshot.bicycles.dictionaries["type"]
+    counts = np.zeros(len(types), dtype="int64")
+    for part in snapshot.rentals.parts:
+        type_codes = _rental_types(snapshot, part)
+        counts += np.bincount(type_codes[type_codes >= 0], minlength=len(types))
+    return sorted(((types[code], int(count)) for code, count in enumerate(counts) if count), key=lambda pair: pair[0])
+
+# Average length in days of returned rentals per type, as {type: days}
+def mean_rental_days_by_type(snapshot):
+    np = _numpy()
+    types = snapshot.bicycles.dictionaries["type"]
+    days = np.zeros(len(types))
+    rentals = np.zeros(len(types), dtype="int64")
+    for part in snapshot.rentals.parts:
+        type_codes = _rental_types(snapshot, part)
+        lengths = (part["return_date"] - part["rental_date"]).astype("int64")
+        keep = (type_codes >= 0) & ~np.isnat(part["return_date"]) & ~np.isnat(part["rental_date"])
+        days += np.bincount(type_codes[keep], weights=lengths[keep], minlength=len(types))
+        rentals += np.bincount(type_codes[keep], minlength=len(types))
+    return {types[code]: float(days[code] / rentals[code]) for code in range(len(types)) if rentals[code]}
+
+# Create or refresh the snapshot of the database: `python snapshot.py [directory]`
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else None
+    report = refresh_snapshot(path)
+    print(f"Snapshot {path or snapshot_dir()}: {report['bicycles']:,} bicycles, {report['new_rentals']:,} new rentals, "
+          f"{report['closed_rentals']:,} rentals returned since the last refresh")
@@ -0,0 +1,50 @@
+import json
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+import database
+import membershipManager
+
+BIKE_TYPES = ["Mountain Bike", "Road Bike", "Hybrid Bike", "Electric Bike"]
+RATES = ["10/day; 50/week", "20/day; 100/week"]
+
+# A fresh database and membership file in a temporary directory, with `bikes` Available bikes (IDs 1..bikes)
+# and active members 1001..1000+members. Returns the directory
+@pytest.fixture
+def make_db(tmp_path, monkeypatch):
+    def make(bikes=10, members=5, rental_limit=3):
+        database.close_pool()
+        monkeypatch.setattr(database, "DB_PATH", str(tmp_path / "BicycleRental.db"))
+        monkeypatch.setattr(membershipManager, "MEMBERSHIP_FILE", str(tmp_path / "membership.json"))
+        end_date = (datetime.now() + timedelta(days=365)).strftime("%Y-%m-%d")
+        with open(membershipManager.MEMBERSHIP_FILE, "w") as file:
+            json.dump({str(1001 + i): {"active": True, "RentalLimit": rental_limit, "MembershipEndDate": end_date}
+                       for i in range(members)}, file)
+        membershipManager.reload_memberships()
+        database.create_tables()
+        with database.session() as conn:
+            conn.executemany(
+                "INSERT INTO bicycles (id, brand, type, frame_size, rental_rate, purchase_date, condition, status, "
+                "daily_rate, weekly_rate) VALUES (?, 'Trek', ?, 'Medium', ?, ?, 'Good', 'Available', ?, ?)",
+                ((i, BIKE_TYPES[i % len(BIKE_TYPES)], RATES[i % len(RATES)], f"{2015 + i % 5}-01-01")
+                 + database.parse_rental_rate(RATES[i % len(RATES)]) for i in range(1, bikes + 1)))
+        return str(tmp_path)
+
+    yield make
+    database.close_pool()
+
+@pytest.fixture
+def db(make_db):
+    return make_db()
+
+def rental_count(where="1"):
+    with database.session() as conn:
+        return conn.execute(f"SELECT COUNT(*) FROM rentals WHERE {where}").fetchone()[0]
+
+# Write a feed file with one line per row
+def write_feed(path, lines):
+    with open(path, "w") as file:
+        file.write("".join(line + "\n" for line in lines))
+    return os.fspath(path)
@@ -0,0 +1,60 @@
+from datetime import date, timedelta
+
+import archive
+import database
+import demand
+
+def _days_ago(days):
+    return (date.today() - timedelta(days=days)).isoformat()
+
+# Closed rentals from about three years ago to last month, and one still open
+def _add_rentals():
+    with database.session() as conn:
+        conn.executemany("INSERT INTO rentals (bicycle_id, rental_date, return_date, member_id) VALUES (?, ?, ?, 1001)",
+                         [(1 + i % 10, _days_ago(1100 - i * 25), _days_ago(1100 - i * 25 - 3 - i % 5))
+                          for i in range(43)] + [(2, _days_ago(2), None)])
+
+def _weekly_demand():
+    with database.session() as conn:
+        return conn.execute("SELECT type, week, rentals, rental_days, peak FROM type_weekly_demand "
+                            "ORDER BY type, week").fetchall()
+
+def _rentals():
+    with database.session() as conn:
+        return conn.execute("SELECT COUNT(*) FROM rentals").fetchone()[0]
+
+def test_archiving_keeps_the_weekly_demand_of_archived_rentals(db):
+    _add_rentals()
+    demand.update_demand()
+    expected = _weekly_demand()
+    with database.session() as conn:
+        conn.execute("DELETE FROM type_weekly_demand")
+        conn.execute("DELETE FROM demand_state")
+
+    # The first update of the demand after an archive, and later ones, still count the archived rentals
+    report = archive.archive_rentals(_days_ago(730))
+    assert report["archived"] > 10 and _rentals() < 44
+    assert _weekly_demand() == expected
+    demand.update_demand()
+    assert _weekly_demand() == expected
+
+def test_a_backdated_load_does_not_recompute_archived_weeks(db):
+    _add_rentals()
+    cutoff = _days_ago(730)
+    archive.archive_rentals(cutoff)
+    archived_weeks = [row for row in _weekly_demand() if row[1] < cutoff]
+    assert archived_weeks
+
+    before_load = {row[:2]: row[3] for row in _weekly_demand()}
+
+    # Older history loaded after the archive pulls the update back past the cutoff
+    with database.session() as conn:
+        conn.execute("INSERT INTO rentals (bicycle_id, rental_date, return_date, member_id) VALUES (3, ?, ?, 1002)",
+                     (_days_ago(1000), _days_ago(600)))
+    demand.update_demand()
+    assert [row for row in _weekly_demand() if row[1] < cutoff] == archived_weeks
+    # The backdated rental counts from the first whole week after the cutoff
+    first_week = (date.fromisoformat(cutoff) + timedelta(days=6))
+    first_week = (first_week - timedelta(days=first_week.weekday())).isoformat()
+    after_load = {row[:2]: row[3] for row in _weekly_demand()}
+    assert after_load[("Electric Bike", first_week)] == before_load.get(("Electric Bike", first_week), 0) + 7
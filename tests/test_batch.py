@@ -0,0 +1,98 @@
+from datetime import datetime, timedelta
+
+import database
+from bikeRent import rent_bike, rent_bikes
+from bikeReturn import return_bike, return_bikes
+
+# Each scenario is run twice on the same fixture: once through the single-item functions and once as a batch,
+# and the messages and resulting rows must match
+
+def _state():
+    with database.session() as conn:
+        rentals = conn.execute("SELECT bicycle_id, member_id, rental_date, expected_return_date, return_date, fees, "
+                               "damage_details FROM rentals ORDER BY id").fetchall()
+        bikes = conn.execute("SELECT id, condition, status FROM bicycles ORDER BY id").fetchall()
+    return rentals, bikes
+
+# Put every bike back and clear the rentals, so the second run starts from the same fixture
+def _reset():
+    with database.session() as conn:
+        conn.execute("DELETE FROM rentals")
+        conn.execute("UPDATE bicycles SET condition = 'Good', status = 'Available'")
+
+# Open rentals for (bike_id, member_id, days_ago)
+def _open_rentals(rentals):
+    with database.session() as conn:
+        conn.execute("UPDATE bicycles SET status = 'Rented' WHERE id IN ({})".format(
+            ", ".join(str(bike_id) for bike_id, _, _ in rentals)))
+        conn.executemany("INSERT INTO rentals (bicycle_id, rental_date, member_id) VALUES (?, ?, ?)",
+                         ((bike_id, (datetime.now() - timedelta(days=days_ago)).strftime("%Y-%m-%d"), member_id)
+                          for bike_id, member_id, days_ago in rentals))
+
+def _compare_rents(requests, rentals=()):
+    if rentals:
+        _open_rentals(rentals)
+    singles = [rent_bike(*request) for request in requests]
+    single_state = _state()
+    _reset()
+    if rentals:
+        _open_rentals(rentals)
+    batch = rent_bikes(requests)
+    assert batch == singles
+    assert _state() == single_state
+    return batch
+
+def _compare_returns(rentals, returns):
+    _open_rentals(rentals)
+    singles = [return_bike(*item) if isinstance(item, tuple) else return_bike(item) for item in returns]
+    single_state = _state()
+    _reset()
+    _open_rentals(rentals)
+    batch = return_bikes(returns)
+    assert batch == singles
+    assert _state() == single_state
+    return batch
+
+def test_rent_batch_matches_single_rents(db):
+    messages = _compare_rents([(1001, 1, 3), ("1002", 2, 1), (1003, "3", 14)])
+    assert all(message.startswith("Rental successful.") for message in messages)
+
+def test_rent_batch_reports_errors_per_item(db):
+    messages = _compare_rents([(1001, 1, 3), (999, 2, 1), (1002, 99, 1), (1003, 1, 1), (1004, 4, 2)])
+    assert messages[0].startswith("Rental successful.")
+    assert messages[1] == "Member ID 999 is not active."
+    assert messages[2] == "Bicycle ID 99 does not exist."
+    assert messages[3] == "Bicycle ID 1 is not available for rent. It is Rented"
+    assert messages[4].startswith("Rental successful.")
+
+def test_rent_batch_counts_earlier_items_towards_the_rental_limit(make_db):
+    make_db(rental_limit=2)
+    requests = [(1001, 2, 1), (1001, 3, 1), (1002, 4, 1), (1002, 5, 1), (1002, 6, 1)]
+    messages = _compare_rents(requests, rentals=[(1, 1001, 0)])
+    assert [message.startswith("Rental successful.") for message in messages] == [True, False, True, True, False]
+    assert messages[1] == messages[4].replace("1002", "1001") == "Member ID 1001 has reached the rental limit of 2."
+
+def test_return_batch_matches_single_returns(db):
+    rentals = [(1, 1001, 2), (2, 1002, 10), (3, 1003, 30), (4, 1004, 7)]
+    messages = _compare_returns(rentals, [1, 2, (3, "Bent wheel", 40, "Damaged"), ("4", None, 25, "Fair")])
+    assert messages[0] == "Bicycle Return processed for Bicycle ID 1."
+    # Bike 2 is 3 days late at 10/day plus the late fee, bike 3 is 23 days late at 20/day
+    assert messages[1] == "Bicycle Return processed for Bicycle ID 2. Late fee: £45.00."
+    assert messages[2] == ("Bicycle Return processed for Bicycle ID 3. Late fee: £575.00. Damage charge: £40.00. "
+                           "Bicycle marked as 'Damaged' and made unavailable for rental.")
+
+def test_return_batch_fee_totals_match(db):
+    rentals = [(bike_id, 1001 + bike_id % 5, bike_id * 2) for bike_id in range(1, 11)]
+    _compare_returns(rentals, [(bike_id, "Scratched" if bike_id % 3 == 0 else None, 15, "Good")
+                               for bike_id in range(1, 11)])
+    with database.session() as conn:
+        total = conn.execute("SELECT SUM(fees) FROM rentals").fetchone()[0]
+    # Late days are 2 * bike_id - 7 for bike_id >= 4, at 10/day (even IDs) or 20/day (odd IDs) plus 5,
+    # and three bikes are charged for damage
+    late = sum((2 * bike_id - 7) * ((20 if bike_id % 2 else 10) + 5) for bike_id in range(4, 11))
+    assert total == late + 3 * 15
+
+def test_return_batch_reports_errors_per_item(db):
+    messages = _compare_returns([(1, 1001, 1)], [1, 5, 99, 1])
+    assert messages[0] == "Bicycle Return processed for Bicycle ID 1."
+    assert messages[1:] == [f"No active rental found for Bicycle ID {bike_id}." for bike_id in (5, 99, 1)]
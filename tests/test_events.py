@@ -0,0 +1,94 @@
+import os
+
+import pytest
+
+import database
+import events
+from bikeRent import rent_bike
+from bikeReturn import return_bike
+from conftest import write_feed
+
+def _schema():
+    with database.session() as conn:
+        return (conn.execute("PRAGMA schema_version").fetchone()[0],
+                conn.execute("SELECT name, sql FROM sqlite_master WHERE type = 'trigger' ORDER BY name").fetchall())
+
+def _flags():
+    with database.session() as conn:
+        return conn.execute("SELECT defer_stats, defer_events FROM ingest_state").fetchone()
+
+def _load(directory, bike_ids):
+    bikes = write_feed(os.path.join(directory, "Bicycle_Info.txt"),
+                       ["ID|Brand|Type|Frame Size|Rental Rate|Purchase Date|Condition|Status"])
+    rentals = write_feed(os.path.join(directory, "Rental_History.txt"),
+                         [f"{bike_id}|01/03/2024|05/03/2024|1001" for bike_id in bike_ids])
+    return database.load_and_clean_data(bikes, rentals)
+
+def test_changes_since_lists_the_bikes_rented_and_returned(db):
+    start = events.latest_event_id()
+    rent_bike(1001, 3, 1)
+    rent_bike(1002, 4, 1)
+    return_bike(3, "Loose saddle", 5, "Fair")
+    bike_ids, last_id = events.changes_since(start)
+    assert bike_ids == {3, 4}
+    assert last_id == events.latest_event_id() > start
+    assert events.changes_since(last_id) == (set(), last_id)
+    assert [event.kind for event in events.read_events(start)[0]] == [
+        "status", "rent", "status", "rent", "return", "damage", "condition", "status"]
+
+def test_changes_since_reports_a_load_as_anything_changed(db):
+    rent_bike(1001, 1, 1)
+    start = events.latest_event_id()
+    rental_events = len(events.read_events()[0])
+    reports = _load(db, [2, 5, 6])
+    assert reports[1]["rows"] == 3
+
+    bike_ids, last_id = events.changes_since(start)
+    assert bike_ids is None and last_id > start
+    # The loaded rentals are logged as the one "load" event of each file, not one "rent" event per row
+    loaded = events.read_events(start)[0]
+    assert {event.kind for event in loaded} == {"load"}
+    assert len(events.read_events()[0]) == rental_events + len(loaded)
+    assert events.changes_since(last_id) == (set(), last_id)
+
+def test_a_load_does_not_change_the_schema(db):
+    before = _schema()
+    _load(db, [1, 2])
+    assert _schema() == before
+    assert _flags() == (0, 0)
+
+def test_a_failed_load_leaves_the_triggers_on(db, monkeypatch):
+    def fail(*args):
+        raise RuntimeError("disk full")
+    monkeypatch.setattr(database, "update_ledger", fail)
+    with pytest.raises(RuntimeError):
+        _load(db, [1])
+    assert _flags() == (0, 0)
+    rent_bike(1001, 1, 1)
+    assert [event.kind for event in events.read_events()[0]] == ["status", "rent"]
+
+def test_changes_since_reports_pruned_events_as_anything_changed(db):
+    start = events.latest_event_id()
+    rent_bike(1001, 1, 1)
+    return_bike(1)
+    assert events.prune_events(before="9999-12-31") == 4
+    bike_ids, last_id = events.changes_since(start)
+    assert bike_ids is None and last_id == events.latest_event_id()
+    # Cursors taken after the prune still see only what happens next
+    rent_bike(1001, 2, 1)
+    assert events.changes_since(last_id)[0] == {2}
+
+def test_bicycle_states_at_replays_status_and_condition(db):
+    rent_bike(1001, 1, 1)
+    after_rent = events.latest_event_id()
+    return_bike(1, "Bent wheel", 40, "Damaged")
+    after_damage = events.latest_event_id()
+    rent_bike(1002, 2, 1)
+    return_bike(2, None, 0, "Fair")
+
+    assert events.bicycle_states_at(0, [1, 2, 3]) == {1: ("Available", "Good"), 2: ("Available", "Good"),
+                                                       3: ("Available", "Good")}
+    assert events.bicycle_states_at(after_rent, [1, 2]) == {1: ("Rented", "Good"), 2: ("Available", "Good")}
+    assert events.bicycle_states_at(after_damage, [1, 2]) == {1: ("Unavailable", "Damaged"), 2: ("Available", "Good")}
+    now = events.bicycle_states_at(events.latest_event_id())
+    assert now[1] == ("Unavailable", "Damaged") and now[2] == ("Available", "Fair") and len(now) == 10
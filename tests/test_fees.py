@@ -0,0 +1,76 @@
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+import database
+from bikeReturn import calculate_fees, calculate_fees_bulk, daily_rate_of, late_fees_between
+
+# (rental date, return date, rental_rate text, bicycles.daily_rate)
+CASES = [
+    ("2024-01-01", "2024-01-01", "10/day; 50/week", 10.0),     # same day
+    ("2024-01-01", "2024-01-05", "10/day; 50/week", None),     # on time
+    ("2024-01-01", "2024-01-08", "20/day; 100/week", 20.0),    # exactly the allowed days
+    ("2024-01-01", "2024-01-09", "20/day; 100/week", 20.0),    # one day late
+    ("2024-01-01", "2024-01-20", "20/day; 100/week", None),    # late, rate read from the text
+    ("2024-01-01", "2024-01-20", "20/day; 100/week", 12.5),    # the parsed rate wins over the text
+    ("2024-02-25", "2024-03-05", "15/day; 75/week", None),     # across a leap day
+    ("2023-12-28", "2024-01-10", "10/day; 50/week", 10.0),     # across a year end
+    ("2024-01-10", "2024-01-01", "10/day; 50/week", 10.0),     # returned before it was rented
+]
+
+def _scalar(rental_date, return_date, rental_rate, daily_rate):
+    return calculate_fees(datetime.strptime(rental_date, "%Y-%m-%d"), datetime.strptime(return_date, "%Y-%m-%d"),
+                          rental_rate, daily_rate)
+
+@pytest.mark.parametrize("rental_date, return_date, rental_rate, daily_rate", CASES)
+def test_bulk_fee_matches_calculate_fees(rental_date, return_date, rental_rate, daily_rate):
+    bulk = calculate_fees_bulk([rental_date], [return_date], [daily_rate_of(daily_rate, rental_rate)])
+    assert bulk[0] == _scalar(rental_date, return_date, rental_rate, daily_rate)
+
+def test_bulk_fees_match_calculate_fees_for_a_whole_batch():
+    expected = [_scalar(*case) for case in CASES]
+    fees = calculate_fees_bulk([case[0] for case in CASES], [case[1] for case in CASES],
+                               [daily_rate_of(case[3], case[2]) for case in CASES])
+    assert fees.tolist() == expected
+    assert fees.sum() == sum(expected) > 0
+
+def test_bulk_accepts_dates_and_datetime64():
+    rental = datetime(2024, 1, 1)
+    returned = datetime(2024, 1, 12, 15, 30)
+    expected = calculate_fees(rental, returned, "10/day; 50/week")
+    assert expected == 4 * (10 + 5)
+    assert calculate_fees_bulk([rental], [returned], [10.0])[0] == expected
+    assert calculate_fees_bulk(np.array(["2024-01-01"], dtype="datetime64[D]"),
+                               np.array(["2024-01-12"], dtype="datetime64[D]"), [10.0])[0] == expected
+
+def test_missing_rate_or_date_costs_nothing():
+    # calculate_fees charges nothing when the rate cannot be parsed; the bulk version does the same
+    assert calculate_fees(datetime(2024, 1, 1), datetime(2024, 2, 1), "Missing") == 0
+    assert daily_rate_of(None, "Missing") is None
+    fees = calculate_fees_bulk(["2024-01-01", None, "", "2024-01-01", "NaT"],
+                               ["2024-02-01", "2024-02-01", "2024-02-01", None, "2024-02-01"],
+                               [None, 10.0, 10.0, 10.0, 10.0])
+    assert fees.tolist() == [0.0] * 5
+
+def test_late_fees_between_matches_calculate_fees(db):
+    with database.session() as conn:
+        conn.executemany("INSERT INTO rentals (bicycle_id, rental_date, return_date, member_id) VALUES (?, ?, ?, 1001)",
+                         [(1 + i % 10, case[0], case[1]) for i, case in enumerate(CASES)]
+                         + [(1, "2023-06-01", "2023-07-01"), (2, "2024-03-01", None)])
+        # A bike written without the parsed rate falls back to its rental_rate text
+        conn.execute("UPDATE bicycles SET daily_rate = NULL WHERE id = 3")
+        expected = {rental_id: _scalar(rental_date, return_date, rental_rate, daily_rate)
+                    for rental_id, rental_date, return_date, rental_rate, daily_rate in conn.execute("""
+                        SELECT rentals.id, rentals.rental_date, rentals.return_date, bicycles.rental_rate,
+                               bicycles.daily_rate
+                        FROM rentals JOIN bicycles ON rentals.bicycle_id = bicycles.id
+                        WHERE rentals.return_date BETWEEN '2024-01-01' AND '2024-03-31'""")}
+
+    ids, fees = late_fees_between("2024-01-01", "2024-03-31", chunk_size=4)
+    assert dict(zip(ids.tolist(), fees.tolist())) == expected
+    assert len(expected) == len(CASES) and sum(expected.values()) > 0
+
+def test_late_fees_between_with_no_returns(db):
+    ids, fees = late_fees_between("2030-01-01", "2030-12-31")
+    assert len(ids) == len(fees) == 0
@@ -0,0 +1,68 @@
+import os
+import sqlite3
+
+import database
+import fleetStats
+from bikeRent import rent_bike, rent_bikes
+from bikeReturn import return_bike, return_bikes
+from conftest import write_feed
+
+def test_summaries_match_a_rebuild_after_rents_returns_and_a_load(db):
+    assert rent_bike(1001, 1, 3).startswith("Rental successful.")
+    assert rent_bike(1002, 2, 1).startswith("Rental successful.")
+    rent_bikes([(1003, 3, 2), (1003, 4, 2), (1004, 5, 1)])
+    assert return_bike(1).startswith("Bicycle Return processed")
+    assert "marked as 'Damaged'" in return_bike(2, "Bent fork", 30, "Damaged")
+    return_bikes([3, (4, "Flat tyre", 10, "Fair")])
+
+    bikes = write_feed(os.path.join(db, "Bicycle_Info.txt"), [
+        "ID|Brand|Type|Frame Size|Rental Rate|Purchase Date|Condition|Status",
+        "11|Merida|Gravel Bike|Large|25/day; 125/week|19/10/2024|Fair|Available",
+        "12|Trek|Road Bike|Small|Missing|22/11/2019|Damaged|Under Maintenance",
+    ])
+    rentals = write_feed(os.path.join(db, "Rental_History.txt"), [
+        "11|14/04/2023|25/04/2023|1001",
+        "12|09/08/2023|22/08/2023|unknown",
+        "6|21/07/2022||1005",
+        "1|12/04/2024|25/04/2024|1002",
+    ])
+    reports = database.load_and_clean_data(bikes, rentals)
+    assert [report["rows"] for report in reports] == [2, 4]
+
+    assert fleetStats.check_fleet_stats() == {}
+    with database.session() as conn:
+        stored = {table: conn.execute(f"SELECT * FROM {table} ORDER BY 1, 2").fetchall()
+                  for table in ("type_daily_rentals", "type_condition_counts", "member_active_rentals")}
+    fleetStats.rebuild_fleet_stats()
+    with database.session() as conn:
+        for table, rows in stored.items():
+            assert conn.execute(f"SELECT * FROM {table} ORDER BY 1, 2").fetchall() == rows
+
+def test_an_old_database_upgrades_to_filled_summaries(tmp_path, monkeypatch):
+    database.close_pool()
+    monkeypatch.setattr(database, "DB_PATH", str(tmp_path / "BicycleRental.db"))
+    conn = sqlite3.connect(database.DB_PATH, isolation_level=None)
+    database._create_tables(conn)
+    for steps in database.MIGRATIONS[:2]:
+        for step in steps:
+            conn.execute(step)
+    conn.execute("PRAGMA user_version = 2")
+    conn.executemany("INSERT INTO bicycles (id, brand, type, frame_size, rental_rate, purchase_date, condition, status) "
+                     "VALUES (?, 'Trek', ?, 'Medium', '10/day; 50/week', '2020-01-01', 'Good', ?)",
+                     [(1, "Road Bike", "Rented"), (2, "Road Bike", "Available"), (3, "Hybrid Bike", "Available")])
+    conn.executemany("INSERT INTO rentals (bicycle_id, rental_date, return_date, member_id) VALUES (?, ?, ?, ?)",
+                     [(1, "2024-03-01", None, 1001), (2, "2024-02-01", "2024-02-03", 1002),
+                      (3, "2024-02-01", "2024-02-05", 1001)])
+    conn.close()
+
+    database.create_tables()
+    try:
+        assert fleetStats.check_fleet_stats() == {}
+        with database.session() as conn:
+            assert conn.execute("PRAGMA user_version").fetchone()[0] == len(database.MIGRATIONS)
+            assert conn.execute("SELECT * FROM member_active_rentals").fetchall() == [(1001, 1)]
+        with database.session() as conn:
+            conn.execute("INSERT INTO rentals (bicycle_id, rental_date, member_id) VALUES (2, '2024-03-02', 1002)")
+        assert fleetStats.check_fleet_stats() == {}
+    finally:
+        database.close_pool()
@@ -0,0 +1,20 @@
+import ingest
+from conftest import write_feed
+
+def test_feed_kind_goes_by_the_fields_before_the_name(tmp_path):
+    rentals = write_feed(tmp_path / "depot3_bike_rentals.txt", ["1|2024-01-01|2024-01-02|1001"])
+    bikes = write_feed(tmp_path / "rental_fleet.txt", [
+        "ID|Brand|Type|Frame Size|Rental Rate|Purchase Date|Condition|Status",
+        "1|Trek|Road Bike|Medium|10/day; 50/week|2020-01-01|Good|Available",
+    ])
+    assert ingest.feed_kind(rentals) == "rentals"
+    assert ingest.feed_kind(bikes) == "bicycles"
+    assert ingest.collect_feeds([rentals, bikes]) == [(bikes, "bicycles"), (rentals, "rentals")]
+
+def test_feed_kind_goes_by_the_name_of_an_empty_file(tmp_path):
+    assert ingest.feed_kind(write_feed(tmp_path / "depot3_bike_rentals.txt", [])) == "rentals"
+    assert ingest.feed_kind(write_feed(tmp_path / "depot3_bicycles.txt", [])) == "bicycles"
+    assert ingest.feed_kind(write_feed(tmp_path / "depot3_notes.txt", [])) is None
+
+def test_feed_kind_rejects_a_file_that_is_neither(tmp_path):
+    assert ingest.feed_kind(write_feed(tmp_path / "Rental_History.txt", ["1|2024-01-01"])) is None
@@ -0,0 +1,63 @@
+import os
+import shutil
+
+import pytest
+
+import database
+from conftest import rental_count, write_feed
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# A copy of the shipped database, filled by the loader from before the ingest ledger, next to its feed files
+@pytest.fixture
+def pre_ledger_db(tmp_path, monkeypatch):
+    for name in ("BicycleRental.db", database.BICYCLE_FEED, database.RENTAL_FEED):
+        shutil.copy(os.path.join(ROOT, name), tmp_path / name)
+    database.close_pool()
+    monkeypatch.setattr(database, "DB_PATH", str(tmp_path / "BicycleRental.db"))
+    monkeypatch.chdir(tmp_path)
+    yield tmp_path
+    database.close_pool()
+
+def test_loading_into_a_pre_ledger_database_does_not_duplicate_rentals(pre_ledger_db):
+    database.close_pool()
+    before = database.sqlite3.connect(database.DB_PATH).execute("SELECT COUNT(*) FROM rentals").fetchone()[0]
+    reports = database.initialize_database()
+    assert [report["rows"] for report in reports] == [0, 0]
+    assert rental_count() == before
+
+def test_appended_rentals_are_still_loaded_after_the_upgrade(pre_ledger_db):
+    database.initialize_database()
+    before = rental_count()
+    with open(database.RENTAL_FEED, "a") as file:
+        file.write("1|2024-03-01|2024-03-02|1001\n")
+    assert database.load_and_clean_data()[1]["rows"] == 1
+    assert rental_count() == before + 1
+
+def test_ledger_survives_moving_the_database_with_its_feeds(make_db, tmp_path, monkeypatch):
+    make_db()
+    feed = write_feed(tmp_path / "rentals.txt", ["1|2024-01-01|2024-01-02|1001", "2|2024-01-03||1002"])
+    with database.session() as conn:
+        database.ingest_file(conn, feed, "rentals")
+
+    moved = tmp_path.parent / (tmp_path.name + "-moved")
+    database.close_pool()
+    shutil.copytree(tmp_path, moved)
+    monkeypatch.setattr(database, "DB_PATH", str(moved / "BicycleRental.db"))
+    with database.session() as conn:
+        assert database.ingest_file(conn, str(moved / "rentals.txt"), "rentals")["rows"] == 0
+    assert rental_count() == 2
+
+def test_a_load_of_rentals_alone_notifies_the_change_listeners(db, monkeypatch):
+    import ingest
+    heard = []
+    monkeypatch.setattr(database, "_change_listeners", [heard.append])
+    bikes = write_feed(os.path.join(db, "Bicycle_Info.txt"),
+                       ["ID|Brand|Type|Frame Size|Rental Rate|Purchase Date|Condition|Status"])
+    rentals = write_feed(os.path.join(db, "Rental_History.txt"), ["1|2024-01-01|2024-01-02|1001"])
+    assert [report["rows"] for report in database.load_and_clean_data(bikes, rentals)] == [0, 1]
+    assert heard == [None]
+
+    write_feed(os.path.join(db, "Rental_History.txt"), ["1|2024-01-01|2024-01-02|1001", "2|2024-01-03||1002"])
+    ingest.ingest_sources([rentals])
+    assert heard == [None, None]
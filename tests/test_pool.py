@@ -0,0 +1,43 @@
+import threading
+
+import pytest
+
+import database
+
+def test_nested_session_joins_the_outer_transaction(db):
+    with pytest.raises(RuntimeError):
+        with database.session() as outer:
+            with database.session() as inner:
+                assert inner is outer
+                inner.execute("UPDATE bicycles SET status = 'Rented' WHERE id = 4")
+            # The inner session has not committed on its own
+            assert outer.in_transaction
+            raise RuntimeError
+    with database.session() as conn:
+        assert conn.execute("SELECT status FROM bicycles WHERE id = 4").fetchone()[0] == "Available"
+
+def test_pooled_connections_are_per_thread_and_isolated(db):
+    written, checked, done = threading.Event(), threading.Event(), threading.Event()
+    seen = {}
+
+    def writer():
+        with database.session() as conn:
+            seen["writer"] = conn
+            conn.execute("UPDATE bicycles SET status = 'Unavailable' WHERE id = 5")
+            written.set()
+            checked.wait(5)
+        done.set()
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    written.wait(5)
+    with database.session() as conn:
+        assert conn is not seen["writer"]
+        # Uncommitted changes of another thread's transaction are not visible
+        assert conn.execute("SELECT status FROM bicycles WHERE id = 5").fetchone()[0] == "Available"
+    checked.set()
+    done.wait(5)
+    thread.join()
+    with database.session() as conn:
+        assert conn.execute("SELECT status FROM bicycles WHERE id = 5").fetchone()[0] == "Unavailable"
+    assert database.get_connection() is database.get_connection()
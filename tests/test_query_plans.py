@@ -0,0 +1,23 @@
+import pytest
+
+import database
+
+def test_migrations_bring_a_new_database_to_the_latest_version(db):
+    with database.session() as conn:
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == len(database.MIGRATIONS)
+        assert database.migrate(conn) == 0
+
+@pytest.mark.parametrize("name", sorted(database.HOT_QUERIES))
+def test_hot_query_uses_an_index(make_db, name):
+    make_db(bikes=500)
+    with database.session() as conn:
+        conn.executemany("INSERT INTO rentals (bicycle_id, rental_date, return_date, member_id) VALUES (?, ?, ?, ?)",
+                         ((i % 500 + 1, "2024-01-01", "2024-01-03" if i % 4 else None, 1001 + i % 5)
+                          for i in range(2000)))
+        conn.execute("ANALYZE")
+        query, parameters = database.HOT_QUERIES[name]
+        plan = database.explain_query_plan(conn, query, parameters)
+    assert not any(line.startswith("SCAN") for line in plan), plan
+
+def test_check_query_plans_reports_no_full_scans(db):
+    assert database.check_query_plans() == {}
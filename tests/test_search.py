@@ -0,0 +1,20 @@
+import pytest
+
+import bikeSearch
+
+def test_search_rows_have_the_listed_columns(db):
+    rows = bikeSearch.search_bicycles(type="Road Bike")
+    page, _ = bikeSearch.search_page(limit=3, type="Road Bike")
+    streamed = list(bikeSearch.iter_bicycles(batch_size=2, type="Road Bike"))
+    assert rows == page == streamed
+    assert rows and all(len(row) == len(bikeSearch.COLUMNS) for row in rows)
+    assert dict(zip(bikeSearch.COLUMNS, rows[0])) == {
+        "id": 1, "brand": "Trek", "type": "Road Bike", "frame_size": "Medium", "rental_rate": "20/day; 100/week",
+        "purchase_date": "2016-01-01", "condition": "Good", "status": "Available"}
+
+@pytest.mark.parametrize("limit", [0, -4])
+def test_search_page_rejects_a_limit_below_one(db, limit):
+    with pytest.raises(ValueError):
+        bikeSearch.search_page(limit=limit)
+    with pytest.raises(ValueError):
+        list(bikeSearch.iter_bicycles(batch_size=limit))
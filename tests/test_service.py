@@ -0,0 +1,25 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import service
+
+def _get(target):
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return asyncio.run(service._dispatch(executor, "GET", target, b""))
+
+def test_search_pages_are_capped_at_max_page_size(make_db):
+    make_db(bikes=service.MAX_PAGE_SIZE + 20)
+    status, payload = _get(f"/bicycles?limit={service.MAX_PAGE_SIZE * 10}")
+    assert status == 200
+    assert len(payload["bicycles"]) == service.MAX_PAGE_SIZE
+    assert payload["next_after_id"] == service.MAX_PAGE_SIZE
+    status, payload = _get("/bicycles?limit=2")
+    assert [bike["id"] for bike in payload["bicycles"]] == [1, 2] and payload["next_after_id"] == 2
+
+@pytest.mark.parametrize("limit", ["0", "-5"])
+def test_search_rejects_a_limit_below_one(db, limit):
+    status, payload = _get(f"/bicycles?limit={limit}")
+    assert status == 400
+    assert payload == {"error": "limit must be at least 1"}
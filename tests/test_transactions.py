@@ -0,0 +1,69 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import database
+import bikeRent
+from bikeRent import rent_bike
+from conftest import rental_count
+
+def test_second_renter_is_rejected(db):
+    assert rent_bike("1001", 1, 2).startswith("Rental successful")
+    assert rent_bike("1002", 1, 2) == "Bicycle ID 1 is not available for rent. It is Rented"
+    assert rental_count("bicycle_id = 1") == 1
+
+# Both renters saw the bike as Available; the UPDATE ... AND status = 'Available' lets only the first one take it
+def test_compare_and_set_rent_rejects_a_bike_taken_since_it_was_checked(db):
+    def rent_twice(conn):
+        cursor = conn.cursor()
+        return (bikeRent._record_rental(cursor, "1001", 2, 1), bikeRent._record_rental(cursor, "1002", 2, 1))
+
+    first, second = database.write_transaction(rent_twice)
+    assert first.startswith("Rental successful")
+    assert second is None
+    assert rental_count("bicycle_id = 2") == 1
+
+def test_write_transaction_retries_while_another_connection_holds_the_lock(db, monkeypatch):
+    monkeypatch.setattr(database, "BUSY_TIMEOUT", 0.05)
+    monkeypatch.setattr(database, "LOCK_BACKOFF", 0.05)
+    database.close_pool()
+    other = sqlite3.connect(database.DB_PATH, isolation_level=None, check_same_thread=False)
+    other.execute("BEGIN IMMEDIATE")
+    threading.Timer(0.3, other.execute, ("COMMIT",)).start()
+
+    attempts = []
+    def work(conn):
+        attempts.append(1)
+        return conn.execute("UPDATE bicycles SET condition = 'Fair' WHERE id = 3").rowcount
+
+    started = time.perf_counter()
+    assert database.write_transaction(work) == 1
+    assert time.perf_counter() - started >= 0.3
+    assert len(attempts) == 1
+    other.close()
+
+def test_write_transaction_gives_up_after_the_last_retry(db, monkeypatch):
+    monkeypatch.setattr(database, "BUSY_TIMEOUT", 0.01)
+    monkeypatch.setattr(database, "LOCK_RETRIES", 1)
+    monkeypatch.setattr(database, "LOCK_BACKOFF", 0.01)
+    database.close_pool()
+    other = sqlite3.connect(database.DB_PATH, isolation_level=None)
+    other.execute("BEGIN IMMEDIATE")
+    try:
+        with pytest.raises(sqlite3.OperationalError, match="locked"):
+            database.write_transaction(lambda conn: None)
+    finally:
+        other.execute("ROLLBACK")
+        other.close()
+
+def test_write_transaction_does_not_retry_other_errors(db):
+    attempts = []
+    def work(conn):
+        attempts.append(1)
+        conn.execute("SELECT * FROM no_such_table")
+
+    with pytest.raises(sqlite3.OperationalError, match="no such table"):
+        database.write_transaction(work)
+    assert len(attempts) == 1